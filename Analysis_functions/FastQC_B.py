@@ -1,44 +1,99 @@
+import numpy as np
+
 from Analysis_functions import FastQC_G
+from Analysis_functions import fastq_parser
+from Analysis_functions import histogram
+from Analysis_functions import streaming
+
+# Offsets of quality symbols of the encodings, unknown encodings are decoded as Phred+33
+ENCODING_OFFSETS = {'Phred+33': 33, 'Phred+64': 64, 'Solexa+64': 64, 'PacBio': 33}
+# Number of the first reads used to detect the encoding of a parsed file
+ENCODING_READS = 10000
+
+
+def min_defined(first, second):
+    '''
+    Minimum of two values, None means "no value yet".
+    '''
+    if first is None or (second is not None and second < first):
+        return second
+    return first
+
+
+def max_defined(first, second):
+    '''
+    Maximum of two values, None means "no value yet".
+    '''
+    if first is None or (second is not None and second > first):
+        return second
+    return first
+
+
+class BasicStatisticsAccumulator(streaming.Accumulator):
+    '''
+    Collect data for basic statistics in one pass:
+    number of reads, min and max read length, GC count and quality range for encoding.
+    Read lengths are counted in a histogram, the number of reads and bases are its sums.
+    '''
+    name = 'basic_statistics'
+
+    def __init__(self):
+        self.lengths = histogram.Histogram()
+        self.GC_count = int()
+        self.min_quality, self.max_qulity = None, None
+
+    def update_batch(self, batch):
+        if len(batch) == 0:
+            return
+
+        GC_count, lengths = FastQC_G.count_gc_batch(batch)
+        self.lengths.update(lengths)
+        self.GC_count += int(GC_count.sum())
+
+        qulity_line, _ = batch.concatenated(fastq_parser.QUALITY)
+        if len(qulity_line):
+            self.min_quality = min_defined(self.min_quality, int(qulity_line.min()))
+            self.max_qulity = max_defined(self.max_qulity, int(qulity_line.max()))
+
+    def merge(self, other):
+        self.lengths.merge(other.lengths)
+        self.GC_count += other.GC_count
+        self.min_quality = min_defined(self.min_quality, other.min_quality)
+        self.max_qulity = max_defined(self.max_qulity, other.max_qulity)
+
+    def finalize(self):
+        return {'Encoding': detect_encoding(self.min_quality, self.max_qulity),
+                'total_sequences': self.lengths.total(),
+                'sequence_length': (self.lengths.min(), self.lengths.max()),
+                'GC': round(self.GC_count * 100 / int(self.lengths.sum()), 1)}
 
 
 def sequence_length(parsed_file):
     '''
     Return min and max read length
     '''
-    length_reads = [len(read[1]) for read in parsed_file]
-    return min(length_reads), max(length_reads)
+    return streaming.accumulate(parsed_file, BasicStatisticsAccumulator())['sequence_length']
 
 
 def count_all_GC(parsed_file):
     '''
     Count GC content over all sequenses.
     '''
-    GC_count, line_lenght = int(), int()
-
-    for read in parsed_file:
-        GC_lenght = FastQC_G.count_gc(read[1])
-        GC_count += GC_lenght[0]
-        line_lenght += GC_lenght[1]
-
-    return round(GC_count * 100 / line_lenght, 1)
+    return streaming.accumulate(parsed_file, BasicStatisticsAccumulator())['GC']
 
 
 def encoding_detector(parsed_file):
     '''
-    We calculate the minimum and maximum ASCII quality in all reads.
+    We calculate the minimum and maximum ASCII quality in the first ENCODING_READS reads.
     Based on this, we choose the encoding.
     '''
-    min_quality, max_qulity = 0, 0
+    return streaming.accumulate(parsed_file[:ENCODING_READS], BasicStatisticsAccumulator())['Encoding']
 
-    for read in parsed_file:
-        qulity_line = [ord(quality_element) for quality_element in read[3]]
-        min_qual_line, max_qual_line = min(qulity_line), max(qulity_line)
-
-        if min_qual_line < min_quality or min_quality == 0:
-            min_quality = min_qual_line
-        if max_qual_line > max_qulity or max_qulity == 0:
-            max_qulity = min_quality
 
+def detect_encoding(min_quality, max_qulity):
+    '''
+    Choose the encoding by the minimum and maximum ASCII quality.
+    '''
     if min_quality < 59 and min_quality >= 33 and max_qulity <= 74:
         return 'Phred+33'
 
@@ -53,3 +108,64 @@ def encoding_detector(parsed_file):
 
     else:
         return 'Unknown score encoding!'
+
+
+def encoding_offset(min_quality, max_qulity):
+    '''
+    Offset of quality symbols of the encoding chosen by the minimum and maximum ASCII quality.
+    '''
+    return ENCODING_OFFSETS.get(detect_encoding(min_quality, max_qulity), fastq_parser.QUALITY_OFFSET)
+
+
+class QualityDecoder:
+    '''
+    Decoder of quality symbols into Phred scores with a 256-entry lookup table.
+    The offset is chosen by the symbols of the first batch (the first reads of the file
+    or of the part of the file) and checked again with the range of symbols of every
+    next batch. If a symbol out of the range of the encoding comes later, the offset
+    changes, and update() returns the shift: scores counted before have to be
+    decreased by it (the new offset minus the old one).
+    '''
+
+    def __init__(self):
+        self.offset = None
+        self.table = None
+        self.min_quality, self.max_qulity = None, None
+
+    def set_range(self, min_quality, max_qulity):
+        '''
+        Extend the range of symbols and return the shift of the offset.
+        '''
+        self.min_quality = min_defined(self.min_quality, min_quality)
+        self.max_qulity = max_defined(self.max_qulity, max_qulity)
+        offset = encoding_offset(self.min_quality, self.max_qulity)
+        shift = offset - self.offset if self.offset is not None else 0
+        if offset != self.offset:
+            self.offset = offset
+            self.table = fastq_parser.quality_table(offset).tobytes()
+        return shift
+
+    def update(self, symbols):
+        '''
+        Check the offset with the quality symbols of a batch (uint8 array), return its shift.
+        '''
+        if len(symbols) == 0:
+            return 0
+        return self.set_range(int(symbols.min()), int(symbols.max()))
+
+    def merge(self, other):
+        '''
+        Join the ranges of symbols, return the shifts of the offsets of this and other decoder.
+        '''
+        if other.offset is None:
+            return 0, 0
+        other_offset = other.offset
+        shift = self.set_range(other.min_quality, other.max_qulity)
+        return shift, self.offset - other_offset
+
+    def scores(self, symbols):
+        '''
+        Phred scores of quality symbols (uint8 array) as uint8 array.
+        bytes.translate() applies the table to the whole buffer faster than numpy indexing.
+        '''
+        return np.frombuffer(symbols.tobytes().translate(self.table), dtype=np.uint8)
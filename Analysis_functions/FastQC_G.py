@@ -1,52 +1,166 @@
-import matplotlib.pyplot as plt
-from scipy import stats
+import logging
 import numpy as np
 
+from Analysis_functions import fastq_parser
+from Analysis_functions import histogram
+from Analysis_functions import position_bins
+from Analysis_functions import read_store
+from Analysis_functions import sampling
+from Analysis_functions import sketches
+from Analysis_functions import streaming
 
-def read_file(file_path):
-    parsed_file = []
-    temp_list = []
+# 1 for G and C in any case, 0 for other symbols
+GC_SYMBOLS = np.zeros(256, dtype=np.int64)
+GC_SYMBOLS[list(b'GCgc')] = 1
+# GC percents are counted in a histogram with GC_RESOLUTION steps per percent: even bins are
+# exact values k / GC_RESOLUTION and odd bins are the values between them, so that the numbers
+# of reads in closed intervals of percents are exact
+GC_RESOLUTION = 100
+GC_BINS = 200 * GC_RESOLUTION + 1
 
-    with open(file_path) as inf:
 
-        for line in inf:
-            temp_list.append(line.rstrip())
+def read_file(file_path, headers=False):
+    return read_store.ReadStore.from_file(file_path, headers)
 
-            if len(temp_list) == 4:
-                parsed_file.append(temp_list)
-                temp_list = []
 
-    return parsed_file
+def gc_bins(GC_count, lengths):
+    """
+    Bins of GC percents of reads with GC_count G and C of lengths (non-empty reads).
+    """
+    steps = GC_count * (100 * GC_RESOLUTION)
+    return 2 * (steps // lengths) + (steps % lengths != 0)
 
 
-def kde(x, steps):
-    return np.array([np.sum((x >= steps[i]) & (x <= steps[i + 1])) for i in range(len(steps) - 1)])
+def kde(gc_histogram, steps):
+    """
+    Number of values of the GC histogram in every closed interval [steps[i], steps[i + 1]]
+    (steps are sorted integer percents).
+    """
+    counts = np.zeros(GC_BINS, dtype=np.int64)
+    counts[:len(gc_histogram.counts)] = gc_histogram.counts
+    cumulative = np.concatenate([[0], np.cumsum(counts)])
+    bins = 2 * GC_RESOLUTION * np.asarray(steps)
+    return cumulative[bins[1:] + 1] - cumulative[bins[:-1]]
 
 
 def count_gc(line):
     line_lenght = len(line)
-    GC_count = line.upper().count('G') + line.upper().count('C')
+    GC_count = line.upper().count(b'G') + line.upper().count(b'C')
     return GC_count, line_lenght
 
 
+def count_gc_batch(batch):
+    """
+    Number of G and C and length of every read of the RecordBatch.
+    """
+    symbols, lengths = batch.concatenated(fastq_parser.SEQUENCE)
+    cumulative = np.concatenate([[0], np.cumsum(GC_SYMBOLS[symbols])])
+    ends = np.cumsum(lengths)
+    return cumulative[ends] - cumulative[ends - lengths], lengths
+
+
 def count_gc_content(line):
     GC_count, length = count_gc(line)
     percent = (GC_count / length) * 100
     return percent
 
 
+class GCContentAccumulator(streaming.Accumulator):
+    """
+    Histogram of GC percents of reads.
+    """
+    name = 'gc_content'
+
+    def __init__(self):
+        self.gc_content = histogram.Histogram(0.5 / GC_RESOLUTION)
+
+    def update_batch(self, batch):
+        GC_count, lengths = count_gc_batch(batch)
+        # Empty reads have no GC content:
+        nonempty = lengths > 0
+        self.gc_content.update(gc_bins(GC_count[nonempty], lengths[nonempty]))
+
+    def merge(self, other):
+        self.gc_content.merge(other.gc_content)
+
+    def finalize(self):
+        return self.gc_content
+
+
 def draw_gc_content(parsed_file, DEFAULT_OUTPUT_DIR='./Report_data/'):
-    gc_content = [count_gc_content(read[1]) for read in parsed_file]
-    gc_content = np.array(gc_content)
-    median = np.median(gc_content)
-    sd = np.std(gc_content)
+    gc_content = streaming.accumulate(parsed_file, GCContentAccumulator())
+    return report_gc_content(gc_content, DEFAULT_OUTPUT_DIR)
+
+
+def report_gc_content(gc_content, DEFAULT_OUTPUT_DIR='./Report_data/'):
+    summary = summarize_gc_content(gc_content)
+    render_gc_content(summary, DEFAULT_OUTPUT_DIR)
+    return summary['status']
+
+
+def normal_pdf(x, loc, scale):
+    """
+    Density of the normal distribution (the same as scipy.stats.norm.pdf, without importing scipy).
+    It is nan for scale 0, as in scipy.
+    """
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.exp(-((x - loc) / scale) ** 2 / 2.0) / np.sqrt(2 * np.pi) / scale
+
+
+def gc_deviation(gc_content):
+    """
+    Numbers of reads per GC percent, the theoretical normal distribution
+    and the total deviation between them (percent of reads).
+    gc_content is the histogram of GC percents.
+    """
+    median = gc_content.quantile(0.5)
+    sd = gc_content.std()
+    reads = gc_content.total()
     xx = np.arange(0, 100, 1)
     y = kde(gc_content, xx)
-    fig, ax = plt.subplots(figsize=(8, 6))
-    ax.plot(xx[:-1], y, color='#D14139', label='GC count per read')
+    theoretical_y = normal_pdf(xx[:-1], median, sd) * reads
+
+    total_deviation = np.sum(np.abs(y - theoretical_y)) / reads * 100
+    return y, theoretical_y, total_deviation
+
+
+def gc_deviation_interval(gc_content, replicates=100, seed=0):
+    """
+    Bootstrap 95% confidence interval of the total deviation,
+    if gc_content is calculated for a random sample of reads.
+    """
+    rng = np.random.default_rng(seed)
+    reads = gc_content.total()
+    # Reads are resampled with replacement: the numbers of them in the bins are multinomial
+    proportions = gc_content.counts / reads
+    deviations = [gc_deviation(histogram.Histogram(gc_content.width, rng.multinomial(reads, proportions)))[2]
+                  for _ in range(replicates)]
+    return tuple(np.percentile(deviations, [2.5, 97.5]))
+
+
+def summarize_gc_content(gc_content):
+    """
+    Summary of the module: check status, numbers of reads per GC percent
+    and the theoretical normal distribution.
+    """
+    y, theoretical_y, total_deviation = gc_deviation(gc_content)
+    if total_deviation > 30:
+        status = 'Failure'
+    elif total_deviation > 15:
+        status = 'Warning'
+    else:
+        status = 'Good'
+
+    return {'status': status, 'counts': y, 'theoretical': theoretical_y}
 
-    theoretical_y = stats.norm.pdf(xx[:-1], loc=median, scale=sd) * len(parsed_file)
-    ax.plot(xx[:-1], theoretical_y, color='#1D2DD8', label='Theoretical Distribution')
+
+def render_gc_content(summary, DEFAULT_OUTPUT_DIR='./Report_data/'):
+    import matplotlib.pyplot as plt
+
+    xx = np.arange(0, 100, 1)
+    fig, ax = plt.subplots(figsize=(8, 6))
+    ax.plot(xx[:-1], summary['counts'], color='#D14139', label='GC count per read')
+    ax.plot(xx[:-1], summary['theoretical'], color='#1D2DD8', label='Theoretical Distribution')
     plt.xticks(range(0, 100, 10))
     plt.title('GC distribution over all sequences')
     plt.xlabel('Mean GC content (%)')
@@ -57,42 +171,91 @@ def draw_gc_content(parsed_file, DEFAULT_OUTPUT_DIR='./Report_data/'):
     plt.savefig(DEFAULT_OUTPUT_DIR+'gc_content.png', dpi=100, bbox_inches='tight')
     plt.close()
 
-    total_deviation = np.sum(np.abs(y - theoretical_y)) / len(parsed_file) * 100
-    if total_deviation > 30:
-        return 'Failure'
-
-    if total_deviation > 15:
-        return 'Warning'
 
-    return 'Good'
+class NContentAccumulator(streaming.Accumulator):
+    """
+    Numbers of N and of all bases in bins of positions (see position_bins).
+    """
+    name = 'N_content'
+
+    def __init__(self):
+        self.N_counter = np.zeros(0, dtype=np.int64)
+        self.Read_counter = np.zeros(0, dtype=np.int64)
+
+    def update_batch(self, batch):
+        symbols, lengths = batch.concatenated(fastq_parser.SEQUENCE)
+        if len(symbols) == 0:
+            return
+
+        positions = batch.positions(fastq_parser.SEQUENCE)
+        n = int(lengths.max())
+        # Number of reads longer than i is the reversed cumulative sum of the lengths histogram:
+        reads = np.cumsum(np.bincount(lengths, minlength=n + 1)[::-1])[::-1][1:]
+        N_bins = position_bins.bin_positions(positions[symbols == ord('N')], n)
+        self.N_counter = streaming.add_arrays(self.N_counter,
+                                              np.bincount(N_bins, minlength=position_bins.bins_number(n)))
+        self.Read_counter = streaming.add_arrays(self.Read_counter, position_bins.sum_by_bins(reads))
+
+    def merge(self, other):
+        self.N_counter = streaming.add_arrays(self.N_counter, other.N_counter)
+        self.Read_counter = streaming.add_arrays(self.Read_counter, other.Read_counter)
+
+    def finalize(self):
+        """
+        Return fraction of N in groups of positions and the first positions of groups.
+        """
+        index = position_bins.groups(self.Read_counter)
+        N_content = position_bins.group(self.N_counter, index) / position_bins.group(self.Read_counter, index)
+        return {'N_content': N_content, 'positions': position_bins.first_positions(len(self.Read_counter))[index]}
+
+
+def N_content_interval(N_counter, Read_counter):
+    """
+    95% confidence interval of the maximal N content (fraction) in groups of positions,
+    if the counters are calculated for a random sample of reads.
+    """
+    index = position_bins.groups(Read_counter)
+    lower, upper = sampling.wilson_interval(position_bins.group(N_counter, index),
+                                            position_bins.group(Read_counter, index))
+    return lower.max(), upper.max()
 
 
 def draw_N_content(parsed_file, DEFAULT_OUTPUT_DIR='./Report_data/'):
-    length_dict = {}
+    N_content = streaming.accumulate(parsed_file, NContentAccumulator())
+    return report_N_content(N_content, DEFAULT_OUTPUT_DIR)
 
-    for read in parsed_file:
-        length = len(read[1])
-        if length in length_dict.keys():
-            length_dict[length] += 1
-        else:
-            length_dict[length] = 1
-
-    max_length = max(length_dict.keys())
-    N_counter = [0 for i in range(max_length)]
-    Read_counter = [0 for i in range(max_length)]
-    for read in parsed_file:
-        for i in range(len(read[1])):
-            if read[1][i] == 'N':
-                N_counter[i] += 1
-                Read_counter[i] += 1
-            else:
-                Read_counter[i] += 1
-
-    N_content = [N_counter[i] / Read_counter[i] for i in range(len(N_counter))]
-    N_content = np.array(N_content)
 
+def report_N_content(result, DEFAULT_OUTPUT_DIR='./Report_data/'):
+    summary = summarize_N_content(result)
+    render_N_content(summary, DEFAULT_OUTPUT_DIR)
+    return summary['status']
+
+
+def summarize_N_content(result):
+    """
+    Summary of the module: check status, the fraction of N per group of positions
+    and the first positions of groups.
+    """
+    N_content = result['N_content']
+    max_content = np.max(N_content * 100)
+    if max_content > 20:
+        status = 'Failure'
+    elif max_content > 5:
+        status = 'Warning'
+    else:
+        status = 'Good'
+
+    return {'status': status, 'N_content': N_content, 'positions': result['positions']}
+
+
+def render_N_content(summary, DEFAULT_OUTPUT_DIR='./Report_data/'):
+    import matplotlib.pyplot as plt
+
+    N_content = summary['N_content']
     fig, ax = plt.subplots(figsize=(8, 6))
     ax.plot(range(len(N_content)), N_content * 100, color='#D14139', label='%N')
+    if position_bins.grouped(summary['positions']):
+        plt.xticks(*position_bins.ticks(summary['positions'], start=0))
     plt.yticks(range(0, 100, 10))
     plt.title('N content across all bases')
     plt.xlabel('Position in read (bp)')
@@ -103,29 +266,135 @@ def draw_N_content(parsed_file, DEFAULT_OUTPUT_DIR='./Report_data/'):
     plt.savefig(DEFAULT_OUTPUT_DIR+'N_content.png', dpi=100, bbox_inches='tight')
     plt.close()
 
-    max_content = np.max(N_content * 100)
-    if max_content > 20:
-        return 'Failure'
 
-    if max_content > 5:
-        return 'Warning'
+class DeduplicationAccumulator(streaming.Accumulator):
+    """
+    Counts of distinct sequences.
+    In exact mode every distinct sequence is kept as a dictionary key.
+    Otherwise memory is bounded: exact counts are kept only for a uniform sample
+    of at most 'limit' distinct sequences (by their 64-bit fingerprints),
+    and the number of distinct sequences is estimated by HyperLogLog.
+    """
+    name = 'deduplicated'
+
+    def __init__(self, exact=False, limit=100000):
+        self.exact = exact
+        self.total_number = 0
+        if exact:
+            self.reads_count = {}
+        else:
+            self.sample = sketches.DistinctSample(limit)
+            self.hyperloglog = sketches.HyperLogLog()
+
+    def update_batch(self, batch):
+        self.add_reads(batch.lines(fastq_parser.SEQUENCE))
+
+    def add_reads(self, reads):
+        """
+        Count list of sequences (bytes objects).
+        """
+        self.total_number += len(reads)
+
+        if self.exact:
+            for read in reads:
+                if read in self.reads_count:
+                    self.reads_count[read] += 1
+                else:
+                    self.reads_count[read] = 1
+            return
+
+        fingerprints = [sketches.fingerprint(read) for read in reads]
+        for fingerprint in fingerprints:
+            self.sample.add(fingerprint)
+        self.hyperloglog.update(fingerprints)
+
+    def merge(self, other):
+        self.total_number += other.total_number
+        if self.exact:
+            for read, count in other.reads_count.items():
+                self.reads_count[read] = self.reads_count.get(read, 0) + count
+        else:
+            self.sample.merge(other.sample)
+            self.hyperloglog.merge(other.hyperloglog)
+
+    def finalize(self):
+        """
+        Return dictionary with counts of (sampled) distinct sequences,
+        total and distinct number of sequences and the relative error of the distinct number.
+        """
+        if self.exact:
+            counts = [a for a in self.reads_count.values()]
+            sampling_rate = 1.0
+        else:
+            counts = list(self.sample.counts.values())
+            sampling_rate = self.sample.sampling_rate()
 
-    return 'Good'
+        if sampling_rate == 1:
+            distinct_number, distinct_error = len(counts), 0
+        else:
+            distinct_number, distinct_error = self.hyperloglog.count(), self.hyperloglog.relative_error()
+
+        return {'counts': counts,
+                'total_number': self.total_number,
+                'distinct_number': distinct_number,
+                'distinct_error': distinct_error,
+                'sampling_rate': sampling_rate}
+
+
+def non_unique_fraction(counts, total_number, sampling_rate=1.0):
+    """
+    Fraction of non-unique sequences among all sequences and its standard error.
+    If counts are a sample of distinct sequences, the number of unique sequences
+    is estimated from the sampled ones: each of them is sampled with probability sampling_rate.
+    It does not depend on a few very frequent sequences which may or may not be sampled.
+    """
+    counts = np.array(counts)
+    unique = np.count_nonzero(counts == 1)
 
+    if sampling_rate == 1:
+        return 1 - unique / total_number, 0.0
+
+    fraction = 1 - unique / sampling_rate / total_number
+    error = np.sqrt(unique * (1 - sampling_rate)) / sampling_rate / total_number
+    return min(max(fraction, 0.0), 1.0), error
+
+
+def non_unique_interval(result):
+    """
+    95% confidence interval of the fraction of non-unique sequences
+    among the reads of a random sample (binomial and the estimation error).
+    """
+    fraction, error = non_unique_fraction(result['counts'], result['total_number'], result['sampling_rate'])
+    error = np.sqrt(fraction * (1 - fraction) / result['total_number'] + error ** 2)
+    return max(fraction - 1.96 * error, 0.0), min(fraction + 1.96 * error, 1.0)
+
+
+def draw_deduplicated(parsed_file, DEFAULT_OUTPUT_DIR='./Report_data/', exact=True):
+    result = streaming.accumulate(parsed_file, DeduplicationAccumulator(exact))
+    return report_deduplicated(result, DEFAULT_OUTPUT_DIR)
+
+
+def report_deduplicated(result, DEFAULT_OUTPUT_DIR='./Report_data/'):
+    summary = summarize_deduplicated(result)
+    render_deduplicated(summary, DEFAULT_OUTPUT_DIR)
+    return summary['status']
 
-def draw_deduplicated(parsed_file, DEFAULT_OUTPUT_DIR='./Report_data/'):
-    reads_count = {}
-    for read in parsed_file:
-        if read[1] in reads_count:
-            reads_count[read[1]] += 1
-        else:
-            reads_count[read[1]] = 1
 
-    counts = [a for a in reads_count.values()]
-    total_number = len(parsed_file)
-    distinct_number = len(reads_count)
+def summarize_deduplicated(result):
+    """
+    Summary of the module: check status, plot title and percents
+    of distinct and total sequences per duplication level.
+    """
+    counts = result['counts']
+    total_number = result['total_number']
+    distinct_number = result['distinct_number']
+    sampling_rate = result['sampling_rate']
 
     percent = round(100 * distinct_number / total_number, 2)
+    title = 'Percent of seq remaining if deduplicated ' + str(percent) + '%'
+    if result['distinct_error']:
+        # 95% confidence interval of the HyperLogLog estimate
+        title += ' (±' + str(round(1.96 * result['distinct_error'] * percent, 2)) + '%)'
 
     lower = [1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 50, 100, 500, 1000, 5000, 10000]
     upper = lower[1:] + [1e10]
@@ -140,16 +409,37 @@ def draw_deduplicated(parsed_file, DEFAULT_OUTPUT_DIR='./Report_data/'):
         y_sum.append(sum(values))
         y_len.append(len(values))
 
-    x_values = range(len(lower))
-    x_ticks = map(str, lower)
-    y_sum = [100 * x / total_number for x in y_sum]
-    y_len = [100 * x / distinct_number for x in y_len]
+    # Each sampled distinct sequence represents 1 / sampling_rate distinct sequences:
+    y_sum = [100 * x / sampling_rate / total_number for x in y_sum]
+    y_len = [100 * x / len(counts) for x in y_len]
 
-    plt.plot(y_len, color='#D14139', label='Deduplicated sequences')
-    plt.plot(y_sum, color='#1D2DD8', label='Total sequences')
+    fraction, error = non_unique_fraction(counts, total_number, sampling_rate)
+    non_unique_seq_frac = fraction * 100
+    if error:
+        logging.info('non-unique sequences %.2f%% (95%% CI ±%.2f%%), %.4f of distinct sequences sampled',
+                     non_unique_seq_frac, 1.96 * error * 100, sampling_rate)
+
+    if non_unique_seq_frac > 50:
+        status = 'Failure'
+    elif non_unique_seq_frac > 20:
+        status = 'Warning'
+    else:
+        status = 'Good'
+
+    return {'status': status, 'title': title, 'levels': lower, 'distinct': y_len, 'total': y_sum}
+
+
+def render_deduplicated(summary, DEFAULT_OUTPUT_DIR='./Report_data/'):
+    import matplotlib.pyplot as plt
+
+    x_values = range(len(summary['levels']))
+    x_ticks = map(str, summary['levels'])
+
+    plt.plot(summary['distinct'], color='#D14139', label='Deduplicated sequences')
+    plt.plot(summary['total'], color='#1D2DD8', label='Total sequences')
     plt.xticks(x_values, x_ticks)
     plt.yticks(range(0, 100, 10))
-    plt.title('Percent of seq remaining if deduplicated ' + str(percent) + '%')
+    plt.title(summary['title'])
     plt.xlabel('Sequence duplication level')
     plt.legend()
     plt.grid(alpha=0.5)
@@ -157,17 +447,6 @@ def draw_deduplicated(parsed_file, DEFAULT_OUTPUT_DIR='./Report_data/'):
     plt.savefig(DEFAULT_OUTPUT_DIR+'deduplication.png', dpi=100, bbox_inches='tight')
     plt.close()
 
-    counts = np.array(counts)
-    non_unique_seq_frac = np.sum(counts[counts > 1]) / total_number * 100
-
-    if non_unique_seq_frac > 50:
-        return 'Failure'
-
-    if non_unique_seq_frac > 20:
-        return 'Warning'
-
-    return 'Good'
-
 
 def main():
     parsed_file = read_file('23769689.fastq')
@@ -1,112 +1,182 @@
 import numpy as np
-import matplotlib.pyplot as plt
-import seaborn as sns
-import pandas as pd
 
+from Analysis_functions import FastQC_B
+from Analysis_functions import fastq_parser
+from Analysis_functions import histogram
+from Analysis_functions import position_bins
+from Analysis_functions import read_store
+from Analysis_functions import streaming
 
-def read_file(file_path):
+
+def read_file(file_path, headers=False):
     """
     Function that processes input fastq file.
-    This function reads fastq file in a temporary list of 4 strings
-    (identifier, read sequence, plus, and quality score sequence).
-    Then it adds this list into  the main 'parsed file' list.
+    Returns the 'parsed file' ReadStore: read sequences and quality score sequences
+    in two concatenated arrays (identifiers are kept only if headers is True).
     """
-    parsed_file = []
-    temp_list = []
+    return read_store.ReadStore.from_file(file_path, headers)
 
-    with open(file_path) as inf:
 
-        for line in inf:
-            temp_list.append(line.rstrip())
+# 1. Per base sequence quality
 
-            if len(temp_list) == 4:
-                parsed_file.append(temp_list)
-                temp_list = []
+# Number of possible quality values (Phred score 0-93)
+QUALITY_VALUES = fastq_parser.MAX_SCORE + 1
 
-    return parsed_file
 
+def shift_scores(counts, shift):
+    """
+    Matrix of counts with quality values (columns) decreased by shift,
+    when the offset of quality symbols changes.
+    """
+    shifted = np.zeros_like(counts)
+    for score, new_score in enumerate(np.clip(np.arange(QUALITY_VALUES) - shift, 0, QUALITY_VALUES - 1)):
+        shifted[:, new_score] += counts[:, score]
+    return shifted
 
-# 1. Per base sequence quality
 
-def max_read_length(lst):
+class QualityPerBaseAccumulator(streaming.Accumulator):
     """
-    Function that calculates the greatest read length, using a list of reads.
+    Accumulator that counts quality scores per base.
+    The result is a matrix 'bins of positions x quality values' of uint64 counts:
+    element [i, q] is the number of bases with quality q in the bin i
+    (see position_bins, for reads up to 1024 bp it is the position i + 1).
+    We process the 3rd element of 'read' list (quality score sequences)
     """
-    l_max = 0  # We set maximal length equal to zero
+    name = 'quality_per_base'
+
+    def __init__(self):
+        self.counts = np.zeros((0, QUALITY_VALUES), dtype=np.uint64)
+        self.decoder = FastQC_B.QualityDecoder()
+
+    def update_batch(self, batch):
+        symbols, lengths = batch.concatenated(fastq_parser.QUALITY)
+        if len(symbols) == 0:
+            return
+
+        # Quality scores of the symbols by the lookup table of the detected encoding:
+        shift = self.decoder.update(symbols)
+        if shift:
+            self.counts = shift_scores(self.counts, shift)
+        scores = self.decoder.scores(symbols)
+
+        # Position of every symbol inside its read:
+        positions = batch.positions(fastq_parser.QUALITY)
+
+        length = int(lengths.max())
+        n = position_bins.bins_number(length)
+        self.grow(n)
+
+        bins = position_bins.bin_positions(positions, length)
+        batch_counts = np.bincount(bins * QUALITY_VALUES + scores, minlength=n * QUALITY_VALUES)
+        self.counts[:n] += batch_counts.reshape(n, QUALITY_VALUES).astype(np.uint64)
+
+    def grow(self, n):
+        """
+        Add rows for bins up to n, if the reads become longer.
+        """
+        if n > len(self.counts):
+            self.counts = np.vstack([self.counts, np.zeros((n - len(self.counts), QUALITY_VALUES), dtype=np.uint64)])
 
-    # And then for each sequence in a list we compare its length to current l_max
-    for k in lst:
-        if len(k) > l_max:
-            # Update l_max if len(k) is greater:
-            l_max = len(k)
+    def merge(self, other):
+        shift, other_shift = self.decoder.merge(other.decoder)
+        if shift:
+            self.counts = shift_scores(self.counts, shift)
+        self.grow(len(other.counts))
+        self.counts[:len(other.counts)] += shift_scores(other.counts, other_shift) if other_shift else other.counts
 
-    return l_max
+    def finalize(self):
+        return self.counts
 
 
 def calculate_quality_per_base(parsed_file):
     """
-    Function that calculates quality score per base.
-    The positions(bp) will be the keys in this dictionary
-    and the values will contain the lists of quality scores in each position.
-    We process the 3rd element of 'reads' list (quality score sequences)
-
-    In the next step (plot drawing) we will need to turn dictionary into dataframe.
-    Therefore, we need all values (which are lists) to contain equal number of elements.
-    This number will be equal to the max read length.
+    Function that calculates quality score histogram per base.
+    Returns matrix 'bins of positions x quality values', element [i, q] is the number
+    of bases with quality q in the bin i (the position i + 1 for reads up to 1024 bp).
     """
-    qualities_per_base = dict()  # the new empty dictionary is created
+    return streaming.accumulate(parsed_file, QualityPerBaseAccumulator())
 
-    qualities = []
-    for read in parsed_file:
-        qualities.append(read[3])  # the 3rd element of 'read' list  is quality score sequences
-    n = max_read_length(qualities)
 
-    for qual_seq in qualities:
-        # For each quality score sequence we add 1 value for each key of 'qualities_per_base' dictionary
-        for i in range(n):
+def quantile_per_base(qualities_per_base, q):
+    """
+    Function that calculates q-th quantile of quality for each position
+    from the histogram matrix. The result is exactly the same as np.quantile
+    (linear interpolation) over all quality scores in the position.
+    """
+    cumulative = np.cumsum(qualities_per_base, axis=1)
+    total = cumulative[:, -1].astype(np.float64)
 
-            # If this specific read contains >= i symbols, we add specific score to the list:
-            if i < len(qual_seq):
-                if i + 1 not in qualities_per_base:
-                    # For the symbol in quality score line, we calculate its number in ascii
-                    # table and subtract 33
-                    qualities_per_base[i + 1] = [ord(qual_seq[i]) - 33]
-                else:
-                    qualities_per_base[i + 1].append(ord(qual_seq[i]) - 33)
+    # Index of the quantile in sorted list of qualities and its neighbours:
+    h = (total - 1) * q
+    lower = np.floor(h)
+    upper = np.minimum(lower + 1, total - 1)
 
-            # If this specific read contains less then i symbols, we add None to the list:
-            else:
-                if i + 1 not in qualities_per_base:
-                    qualities_per_base[i + 1] = [None]
-                else:
-                    qualities_per_base[i + 1].append(None)
+    # The value with index k is the first quality whose cumulative count is greater than k:
+    lower_value = np.sum(cumulative <= lower[:, None], axis=1)
+    upper_value = np.sum(cumulative <= upper[:, None], axis=1)
 
-    return qualities_per_base
+    return lower_value + (h - lower) * (upper_value - lower_value)
 
 
 def calculate_mean_quality_per_base(qualities_per_base):
     """
     Function that calculates average quality per base.
+    Keys are positions starting from 0.
     """
-    dict_mean_qual = dict()  # The new empty dictionary is created
+    scores = np.arange(QUALITY_VALUES)
+    totals = qualities_per_base.sum(axis=1)
+    means = (qualities_per_base * scores).sum(axis=1) / totals
 
-    # We use 'quality_per_base' dictionary. It is a result of previous function,
-    # containing the positions(bp) as the keys and the lists of quality scores in each position as values
-    for key in qualities_per_base:
-        # For each key we calculate average of value-list (we do not include None, while calculating mean):
-        dict_mean_qual[key-1] = np.mean([i for i in qualities_per_base[key] if i is not None])
-
-    return dict_mean_qual
+    return {i: mean for i, mean in enumerate(means)}
 
 
 def plot_per_base_seq_quality(parsed_file, DEFAULT_OUTPUT_DIR='./Report_data/'):
     """
     Function for 'Per base sequence quality' plot drawing.
     """
-    # We turn 'qualities_per_base' dictionary into pandas data frame
-    qualities_per_base = calculate_quality_per_base(parsed_file)
-    dict_mean_qual = calculate_mean_quality_per_base(qualities_per_base)
-    base = pd.DataFrame.from_dict(qualities_per_base)
+    return report_per_base_seq_quality(calculate_quality_per_base(parsed_file), DEFAULT_OUTPUT_DIR)
+
+
+def report_per_base_seq_quality(qualities_per_base, DEFAULT_OUTPUT_DIR='./Report_data/'):
+    """
+    'Per base sequence quality' plot drawing and checker for already calculated
+    quality histogram matrix.
+    """
+    summary = summarize_per_base_seq_quality(qualities_per_base)
+    render_per_base_seq_quality(summary, DEFAULT_OUTPUT_DIR)
+    return summary['status']
+
+
+def summarize_per_base_seq_quality(qualities_per_base):
+    """
+    Summary of the module: check status, mean quality and the statistics
+    of the boxplot (10, 25, 50, 75 and 90 percentiles) for each group of positions
+    and the first positions of groups (every position of short reads is a group).
+    """
+    index = position_bins.groups(qualities_per_base.sum(axis=1))
+    positions = position_bins.first_positions(len(qualities_per_base))[index]
+    qualities_per_base = position_bins.group(qualities_per_base, index)
+
+    mean = np.array(list(calculate_mean_quality_per_base(qualities_per_base).values()))
+    p10, quartiles, medians, p75, p90 = [quantile_per_base(qualities_per_base, q)
+                                         for q in (0.1, 0.25, 0.5, 0.75, 0.9)]
+
+    # Checker:
+    if np.any(quartiles < 5) or np.any(medians < 20):
+        status = 'failure'
+    elif np.any(quartiles < 10) or np.any(medians < 25):
+        status = 'warning'
+    else:
+        status = 'good'
+
+    return {'status': status, 'positions': positions, 'mean': mean, 'p10': p10, 'q1': quartiles, 'median': medians,
+            'q3': p75, 'p90': p90}
+
+
+def render_per_base_seq_quality(summary, DEFAULT_OUTPUT_DIR='./Report_data/'):
+    import matplotlib.pyplot as plt
+
+    positions_number = len(summary['mean'])
 
     # Set default theme and remove margins:
     plt.margins(0)
@@ -116,61 +186,93 @@ def plot_per_base_seq_quality(parsed_file, DEFAULT_OUTPUT_DIR='./Report_data/'):
     plt.axhspan(20, 28, facecolor='yellow', alpha=0.1)
     plt.axhspan(28, 42, facecolor='green', alpha=0.1)
 
-    # And, finally, draw boxplot
-    sns.boxplot(data=base, color="yellow", whis=[10, 90], showfliers=False,
-                medianprops=dict(linewidth=0.5, color='#D14139'))
-
-    # We process dictionary in order to set x and y for the plot:
-    lists = sorted(dict_mean_qual.items())  # sorted by key, return a list of tuples
-    x2, y2 = zip(*lists)  # unpack a list of pairs into two tuples
+    # And, finally, draw boxplot from the precalculated statistics
+    # (whiskers are 10 and 90 percentiles), groups of positions are drawn at 1, 2, 3...:
+    boxes = [{'whislo': summary['p10'][i], 'q1': summary['q1'][i], 'med': summary['median'][i],
+              'q3': summary['q3'][i], 'whishi': summary['p90'][i]}
+             for i in range(positions_number)]
+    positions = np.arange(1, positions_number + 1)
+    plt.gca().bxp(boxes, positions=positions, widths=0.8, manage_ticks=False, showfliers=False, patch_artist=True,
+                  boxprops=dict(facecolor='yellow', linewidth=0.5),
+                  whiskerprops=dict(linewidth=0.5), capprops=dict(linewidth=0.5),
+                  medianprops=dict(linewidth=0.5, color='#D14139'))
 
     # And also draw the mean plot:
-    plt.plot(x2, y2, color="#1D2DD8", linewidth=0.5)
+    plt.plot(positions, summary['mean'], color="#1D2DD8", linewidth=0.5)
 
     # Some improvements to make the plot easier to read:
+    plt.xlim(0.5, positions_number + 0.5)
     plt.yticks(np.arange(0, 42, step=2))
-    plt.xticks(np.arange(0, len(qualities_per_base) + 1, step=10))
+    plt.xticks(*position_bins.ticks(summary['positions']))
     plt.title('Quality scores across all bases')
     plt.xlabel('Position in read')
     plt.gcf().set_size_inches(8, 6)
     plt.savefig(DEFAULT_OUTPUT_DIR + 'Per_base_sequence_quality.png', dpi=100, bbox_inches='tight')
     plt.close()
 
-    # Checker:
-    qualities_list = []
-    for quality in qualities_per_base.values():
-        quality_without_none = [j for j in quality if j is not None]
-        qualities_list.append(quality_without_none)
-    medians = []
-    quartiles = []
-    for lst in qualities_list:
-        lst = np.array(lst)
-        median = np.median(lst)
-        medians.append(median)
-        quartile = np.quantile(lst, 0.25)
-        quartiles.append(quartile)
-    medians = np.array(medians)
-    quartiles = np.array(quartiles)
-    if np.any(quartiles < 5) or np.any(medians < 20):
-        return 'failure'
-    elif np.any(quartiles < 10) or np.any(medians < 25):
-        return 'warning'
-    return 'good'
-
 
 # 2. Per sequence quality scores
 
-def mean_quality(qual):
+class PerSequenceQualityAccumulator(streaming.Accumulator):
     """
-    Function that calculate mean quality score per sequence.
+    Accumulator for average quality scores (keys)
+    and the number of sequences with that average (values).
+    We process the 3rd element of 'read' list - quality score sequence.
+    Rounded averages are counted in a histogram.
     """
-    quality_score = 0
-    #  For each symbol in quality score line, we calculate its number in ascii
-    #  table and subtract 33
-    for i in qual:
-        quality_score += ord(i) - 33
-    # Returns round value of mean quality score:
-    return round(quality_score / len(qual))
+    name = 'per_sequence_quality'
+
+    def __init__(self):
+        self.qual_and_numbers = histogram.Histogram()
+        # Numbers of sequences with the average exactly n + 0.5 (bins are n): they are rounded
+        # in finalize(), so that the averages are shifted exactly if the offset changes
+        self.halves = histogram.Histogram()
+        self.decoder = FastQC_B.QualityDecoder()
+
+    def shift(self, shift):
+        """
+        Decrease the average quality scores by shift, when the offset of quality symbols changes.
+        """
+        self.qual_and_numbers.shift(shift)
+        self.halves.shift(shift)
+
+    def update_batch(self, batch):
+        symbols, lengths = batch.concatenated(fastq_parser.QUALITY)
+        shift = self.decoder.update(symbols)
+        if shift:
+            self.shift(shift)
+        if len(symbols) == 0:
+            return
+
+        # For each quality score sequence we calculate the average quality score
+        # (scores are decoded by the lookup table of the detected encoding),
+        # sums of non-empty reads are sums of the scores from their starts to the next starts:
+        lengths = lengths[lengths > 0]
+        sums = np.add.reduceat(self.decoder.scores(symbols), np.cumsum(lengths) - lengths, dtype=np.int64)
+        # The average is n + 0.5 if twice the sum is an odd multiple of the length:
+        halves = (2 * sums % lengths == 0) & (2 * sums // lengths % 2 == 1)
+        self.qual_and_numbers.update(np.round(sums[~halves] / lengths[~halves]).astype(np.int64))
+        self.halves.update(sums[halves] // lengths[halves])
+
+    def merge(self, other):
+        shift, other_shift = self.decoder.merge(other.decoder)
+        if shift:
+            self.shift(shift)
+        # Histograms of other are shifted in copies (shift() replaces the counts):
+        other_means = histogram.Histogram(counts=other.qual_and_numbers.counts)
+        other_halves = histogram.Histogram(counts=other.halves.counts)
+        other_means.shift(other_shift)
+        other_halves.shift(other_shift)
+        self.qual_and_numbers.merge(other_means)
+        self.halves.merge(other_halves)
+
+    def finalize(self):
+        # Halves are rounded to even, as the built-in round() does:
+        means = histogram.Histogram(counts=self.qual_and_numbers.counts)
+        halves, numbers = self.halves.nonzero()
+        means.update(halves + halves % 2, numbers)
+        qualities, numbers = means.nonzero()
+        return dict(zip(qualities.tolist(), numbers.tolist()))
 
 
 def per_sequence_quality(parsed_file):
@@ -178,25 +280,7 @@ def per_sequence_quality(parsed_file):
     We process the 3rd element of 'reads' list - the list of quality scores sequences.
     Then we put it to function that calculate mean quality score per sequence.
     """
-    qualities = []
-    for read in parsed_file:
-        qualities.append(read[3])  # the 3rd element of 'read' list  is quality score sequences
-
-    # The new empty dictionary for average quality scores (keys)
-    # and the number of sequences with that average (values):
-    qual_and_numbers = dict()
-
-    for qual_seq in qualities:
-        # For each quality score sequence in the list we calculate the average quality score:
-        n = mean_quality(qual_seq)
-        if n in qual_and_numbers:
-            # If the quality score is in the dictionary, we add 1 to its value
-            qual_and_numbers[n] += 1
-        else:
-            # If it is not, we set 1 its value
-            qual_and_numbers[n] = 1
-
-    return qual_and_numbers
+    return streaming.accumulate(parsed_file, PerSequenceQualityAccumulator())
 
 
 def plot_per_seq_quality_scores(parsed_file, DEFAULT_OUTPUT_DIR='./Report_data/'):
@@ -205,7 +289,40 @@ def plot_per_seq_quality_scores(parsed_file, DEFAULT_OUTPUT_DIR='./Report_data/'
     Checker returns 'failure' if the most frequently observed mean quality is below 27
     Returns 'warning' if the most frequently observed mean quality is below 20
     """
-    d = per_sequence_quality(parsed_file)
+    return report_per_seq_quality_scores(per_sequence_quality(parsed_file), DEFAULT_OUTPUT_DIR)
+
+
+def report_per_seq_quality_scores(d, DEFAULT_OUTPUT_DIR='./Report_data/'):
+    """
+    'Per sequence quality scores' plot drawing and checker for already calculated
+    dictionary {mean quality: number of sequences}.
+    """
+    summary = summarize_per_seq_quality_scores(d)
+    render_per_seq_quality_scores(summary, DEFAULT_OUTPUT_DIR)
+    return summary['status']
+
+
+def summarize_per_seq_quality_scores(d):
+    """
+    Summary of the module: check status and the dictionary {mean quality: number of sequences}.
+    """
+    # Checker:
+    max_freq = max(list(d.values()))
+    scores = np.array([score for score, freq in d.items() if freq == max_freq])
+    if np.any(scores < 20):
+        status = 'failure'
+    elif np.any(scores < 27):
+        status = 'warning'
+    else:
+        status = 'good'
+
+    return {'status': status, 'qualities': dict(d)}
+
+
+def render_per_seq_quality_scores(summary, DEFAULT_OUTPUT_DIR='./Report_data/'):
+    import matplotlib.pyplot as plt
+
+    d = summary['qualities']
 
     # We process dictionary in order to set x and y for the plot:
     lists = sorted(d.items())  # sorted by key, return a list of tuples
@@ -225,82 +342,83 @@ def plot_per_seq_quality_scores(parsed_file, DEFAULT_OUTPUT_DIR='./Report_data/'
     plt.savefig(DEFAULT_OUTPUT_DIR + 'Per_sequence_quality_scores.png', dpi=100, bbox_inches='tight')
     plt.close()
 
-    # Checker:
-    max_freq = max(list(d.values()))
-    scores = np.array([score for score, freq in d.items() if freq == max_freq])
-    if np.any(scores < 20):
-        return 'failure'
-    elif np.any(scores < 27):
-        return 'warning'
-    return 'good'
-
 
 # 3. Per base sequence content
 
+# Codes of A, T, G, C are their indexes in 'ATGC', all other symbols are 4
+NUCLEOTIDE_CODES = np.full(256, 4, dtype=np.int64)
+for code, nucleotide in enumerate('ATGC'):
+    NUCLEOTIDE_CODES[ord(nucleotide)] = code
+
+
+class NucleotidesPerBaseAccumulator(streaming.Accumulator):
+    """
+    Accumulator that counts the number of each nucleotide for each base pair.
+    We process the 1st element in the 'read' list - seq.
+    """
+    name = 'nucleotides_per_base'
+    nucleotides = 'ATGC'
+
+    def __init__(self):
+        # Matrix 'bins of positions x nucleotides', the last column counts other symbols:
+        self.counts = np.zeros((0, len(self.nucleotides) + 1), dtype=np.int64)
+
+    def update_batch(self, batch):
+        symbols, lengths = batch.concatenated(fastq_parser.SEQUENCE)
+        if len(symbols) == 0:
+            return
+
+        codes = NUCLEOTIDE_CODES[symbols]
+        positions = batch.positions(fastq_parser.SEQUENCE)
+        length = int(lengths.max())
+        n = position_bins.bins_number(length)
+        self.grow(n)
+
+        columns = self.counts.shape[1]
+        bins = position_bins.bin_positions(positions, length)
+        batch_counts = np.bincount(bins * columns + codes, minlength=n * columns)
+        self.counts[:n] += batch_counts.reshape(n, columns)
+
+    def grow(self, n):
+        if n > len(self.counts):
+            self.counts = np.vstack([self.counts, np.zeros((n - len(self.counts), self.counts.shape[1]),
+                                                           dtype=np.int64)])
+
+    def merge(self, other):
+        self.grow(len(other.counts))
+        self.counts[:len(other.counts)] += other.counts
+
+    def finalize(self):
+        """
+        Return a list of 4 dictionaries (A, T, G, C) that contain number of base pair
+        in the sequence (the first position of the group of positions for long reads)
+        as a key and the proportion of this nucleotide as a value.
+        """
+        a_proportion, t_proportion, g_proportion, c_proportion = dict(), dict(), dict(), dict()
+        index = position_bins.groups(self.counts.sum(axis=1))
+        positions = position_bins.first_positions(len(self.counts))[index].tolist()
+        a_count, t_count, g_count, c_count = position_bins.group(self.counts, index)[:, :4].T.tolist()
+
+        # And calculate nucleotide proportion for each base:
+        for i, position in enumerate(positions):
+            general_count = a_count[i] + t_count[i] + g_count[i] + c_count[i]
+            if general_count == 0:
+                continue
+            a_proportion[position] = a_count[i] / general_count * 100
+            t_proportion[position] = t_count[i] / general_count * 100
+            g_proportion[position] = g_count[i] / general_count * 100
+            c_proportion[position] = c_count[i] / general_count * 100
+
+        return [a_proportion, t_proportion, g_proportion, c_proportion]
+
+
 def per_base_nucleotides_proportion(parsed_file):
     """
     Function that creates and returns a list of 4 dictionaries (1 for each nucleotide)
     that contain number of base pair in the sequence as a key
     and the proportion of this nucleotide as a value.
     """
-    seqs = []
-    for read in parsed_file:
-        seqs.append(read[1])  # We process the 1st element in the 'read' list - seq
-    # We create 4 empty dictionaries:
-    a_count, t_count, g_count, c_count = dict(), dict(), dict(), dict()
-
-    # And count the number of each nucleotide for each base pair:
-    for seq in seqs:
-        for i in range(len(seq)):
-
-            if seq[i] == 'A':
-                if i+1 in a_count:
-                    a_count[i + 1] += 1
-                else:
-                    a_count[i + 1] = 1
-                    t_count[i + 1] = 0
-                    g_count[i + 1] = 0
-                    c_count[i + 1] = 0
-
-            elif seq[i] == 'T':
-                if i+1 in t_count:
-                    t_count[i + 1] += 1
-                else:
-                    t_count[i + 1] = 1
-                    a_count[i + 1] = 0
-                    g_count[i + 1] = 0
-                    c_count[i + 1] = 0
-
-            elif seq[i] == 'G':
-                if i+1 in g_count:
-                    g_count[i + 1] += 1
-                else:
-                    g_count[i + 1] = 1
-                    a_count[i + 1] = 0
-                    t_count[i + 1] = 0
-                    c_count[i + 1] = 0
-
-            elif seq[i] == 'C':
-                if i+1 in c_count:
-                    c_count[i + 1] += 1
-                else:
-                    c_count[i + 1] = 1
-                    a_count[i + 1] = 0
-                    t_count[i + 1] = 0
-                    g_count[i + 1] = 0
-
-    # We create 4 new empty dictionaries for proportion:
-    a_proportion, t_proportion, g_proportion, c_proportion = dict(), dict(), dict(), dict()
-
-    # And calculate nucleotide proportion for each base:
-    for count in a_count:
-        general_count = a_count[count] + t_count[count] + g_count[count] + c_count[count]
-        a_proportion[count] = a_count[count] / general_count * 100
-        t_proportion[count] = t_count[count] / general_count * 100
-        g_proportion[count] = g_count[count] / general_count * 100
-        c_proportion[count] = c_count[count] / general_count * 100
-
-    return [a_proportion, t_proportion, g_proportion, c_proportion]
+    return streaming.accumulate(parsed_file, NucleotidesPerBaseAccumulator())
 
 
 def plot_per_base_seq_content(parsed_file, DEFAULT_OUTPUT_DIR='./Report_data/'):
@@ -309,11 +427,40 @@ def plot_per_base_seq_content(parsed_file, DEFAULT_OUTPUT_DIR='./Report_data/'):
     The checker issues a 'warning' if the difference between A and T, or G and C is greater than 10% in any position.
     Returns 'failure' if the difference between A and T, or G and C is greater than 20% in any position.
     """
-    lst_proportions = per_base_nucleotides_proportion(parsed_file)
-    a_proportion = lst_proportions[0]
-    t_proportion = lst_proportions[1]
-    g_proportion = lst_proportions[2]
-    c_proportion = lst_proportions[3]
+    return report_per_base_seq_content(per_base_nucleotides_proportion(parsed_file), DEFAULT_OUTPUT_DIR)
+
+
+def report_per_base_seq_content(lst_proportions, DEFAULT_OUTPUT_DIR='./Report_data/'):
+    """
+    'Per base sequence content' plot drawing and checker for already calculated
+    list of 4 nucleotide proportion dictionaries.
+    """
+    summary = summarize_per_base_seq_content(lst_proportions)
+    render_per_base_seq_content(summary, DEFAULT_OUTPUT_DIR)
+    return summary['status']
+
+
+def summarize_per_base_seq_content(lst_proportions):
+    """
+    Summary of the module: check status and the list of 4 nucleotide proportion dictionaries.
+    """
+    # Checker:
+    a, t, g, c = [np.array(list(proportion.values())) for proportion in lst_proportions]
+    difference = np.append(np.absolute(a - t), np.absolute(g - c))
+    if np.any(difference > 20):
+        status = 'failure'
+    elif np.any(difference > 10):
+        status = 'warning'
+    else:
+        status = 'good'
+
+    return {'status': status, 'proportions': lst_proportions}
+
+
+def render_per_base_seq_content(summary, DEFAULT_OUTPUT_DIR='./Report_data/'):
+    import matplotlib.pyplot as plt
+
+    a_proportion, t_proportion, g_proportion, c_proportion = summary['proportions']
 
     # The y's are different for each nucleotide, it is the proportion of nucleotide in the read (dict values):
     ay = list(a_proportion.values())
@@ -321,8 +468,10 @@ def plot_per_base_seq_content(parsed_file, DEFAULT_OUTPUT_DIR='./Report_data/'):
     gy = list(g_proportion.values())
     cy = list(c_proportion.values())
 
-    # The x is the same for each nucleotides, it is the number of base in the read (dict keys):
-    x = list(a_proportion.keys())
+    # The x is the same for each nucleotides, it is the number of base in the read (dict keys),
+    # groups of positions of long reads are drawn at 1, 2, 3...:
+    positions = list(a_proportion.keys())
+    x = list(range(1, len(positions) + 1)) if position_bins.grouped(positions) else positions
 
     # And draw the plot for each nucleotide:
     plt.plot(x, ay, color="#D14139", linewidth=0.5, label='%A')
@@ -331,7 +480,10 @@ def plot_per_base_seq_content(parsed_file, DEFAULT_OUTPUT_DIR='./Report_data/'):
     plt.plot(x, cy, color="black", linewidth=0.5, label='%C')
 
     # Some improvements to make the plot easier to read:
-    plt.xticks(np.arange(0, len(x)+2, step=10))
+    if position_bins.grouped(positions):
+        plt.xticks(*position_bins.ticks(positions))
+    else:
+        plt.xticks(np.arange(0, len(x)+2, step=10))
     plt.yticks(np.arange(0, 110, step=10))
     plt.xlabel('Position in read(bp)')
     plt.title('Sequence content across all bases')
@@ -341,15 +493,6 @@ def plot_per_base_seq_content(parsed_file, DEFAULT_OUTPUT_DIR='./Report_data/'):
     plt.savefig(DEFAULT_OUTPUT_DIR + 'Per_base_sequence_content.png', dpi=100, bbox_inches='tight')
     plt.close()
 
-    # Checker:
-    a, t, g, c = np.array(ay), np.array(ty), np.array(gy), np.array(cy)
-    difference = np.append(np.absolute(a - t), np.absolute(g - c))
-    if np.any(difference > 20):
-        return 'failure'
-    elif np.any(difference > 10):
-        return 'warning'
-    return 'good'
-
 
 def main():
     # Sample input
@@ -0,0 +1,129 @@
+'''
+Multi-pattern search of adapter sequences in batches of reads.
+
+All adapters and their reverse complements are indexed by the first
+k bases (seed). Rolling 2-bit codes of all k-mers of a batch of reads are
+calculated with numpy and looked up among the seeds at once, so the cost
+does not grow with the number of adapters. Only the rare seed hits are
+verified by the exact comparison with the whole adapter.
+'''
+import numpy as np
+
+# Maximal seed length, 2 bits per base
+SEED_LENGTH = 12
+# Code for all symbols except A, C, G and T, it breaks k-mers
+INVALID = 4
+SEPARATOR = b'\n'
+
+CODES = np.full(256, INVALID, dtype=np.int64)
+for code, nucleotides in enumerate(['Aa', 'Cc', 'Gg', 'Tt']):
+    for nucleotide in nucleotides:
+        CODES[ord(nucleotide)] = code
+
+
+def reverse_complement(sequence):
+    return sequence[::-1].translate(bytes.maketrans(b'ATCG', b'TAGC'))
+
+
+def encode(sequence):
+    '''
+    2-bit code of a short bytes sequence of A, C, G and T.
+    '''
+    code = 0
+    for symbol in sequence:
+        code = (code << 2) | int(CODES[symbol])
+    return code
+
+
+class AdapterScanner:
+    '''
+    Finds the last occurrence of every adapter (or, if there is no such,
+    of its reverse complement) in each read of a batch.
+    Reads are bytes objects, adapters may be strings.
+    '''
+
+    def __init__(self, adapters):
+        self.names = list(adapters)
+        # Patterns: (adapter index, is reverse complement, sequence)
+        patterns = []
+        for i, name in enumerate(self.names):
+            sequence = adapters[name].encode() if isinstance(adapters[name], str) else adapters[name]
+            patterns.append((i, False, sequence))
+            patterns.append((i, True, reverse_complement(sequence)))
+
+        # Patterns with symbols other than A, C, G and T can not be indexed by 2-bit seeds,
+        # they are searched directly:
+        indexed = [pattern for pattern in patterns if set(pattern[2]) <= set(b'ACGT')]
+        self.direct = [pattern for pattern in patterns if pattern not in indexed]
+
+        self.k = min([SEED_LENGTH] + [len(sequence) for _, _, sequence in indexed])
+        self.seeds = {}
+        for pattern in indexed:
+            self.seeds.setdefault(encode(pattern[2][:self.k]), []).append(pattern)
+        self.seed_codes = np.array(sorted(self.seeds), dtype=np.int64)
+
+    def kmer_codes(self, symbols):
+        '''
+        Rolling 2-bit codes of all k-mers in the array of symbol codes
+        and the mask of k-mers without invalid symbols.
+        '''
+        n = len(symbols) - self.k + 1
+        codes = np.zeros(n, dtype=np.int64)
+        for j in range(self.k):
+            codes = (codes << 2) | (symbols[j:j + n] & 3)
+
+        invalid = np.concatenate([[0], np.cumsum(symbols == INVALID)])
+        valid = invalid[self.k:] - invalid[:n] == 0
+        return codes, valid
+
+    def scan(self, reads):
+        '''
+        Return list of hits (read index, adapter index, 1-based start of the adapter).
+        For every adapter the last forward occurrence is used,
+        the reverse complement is used only if there is no forward one.
+        '''
+        found = {}
+        text = SEPARATOR.join(reads)
+        # Upper case text is made once per batch, only if it is needed:
+        upper_text = None
+
+        if len(self.seed_codes) and reads:
+            symbols = CODES[np.frombuffer(text, dtype=np.uint8)]
+
+            if len(symbols) >= self.k:
+                codes, valid = self.kmer_codes(symbols)
+                index = np.searchsorted(self.seed_codes, codes)
+                index[index == len(self.seed_codes)] = 0
+                candidates = np.flatnonzero(valid & (self.seed_codes[index] == codes))
+
+                if len(candidates):
+                    starts = np.cumsum([0] + [len(read) + 1 for read in reads[:-1]])
+                    read_indexes = np.searchsorted(starts, candidates, side='right') - 1
+                    upper_text = text.upper()
+
+                    # Indexed patterns have only A, C, G and T, so a match in the text
+                    # does not cross the separator and lies inside the read:
+                    for position, i in zip(candidates.tolist(), read_indexes.tolist()):
+                        start = position - int(starts[i])
+                        for adapter, reverse, sequence in self.seeds[int(codes[position])]:
+                            if upper_text.startswith(sequence, position):
+                                key = (i, adapter, reverse)
+                                found[key] = max(found.get(key, -1), start)
+
+        # Direct search is done only if the pattern is present in the batch at all:
+        if self.direct and upper_text is None:
+            upper_text = text.upper()
+        for adapter, reverse, sequence in self.direct:
+            if sequence not in upper_text:
+                continue
+            for i, read in enumerate(reads):
+                start = read.upper().rfind(sequence)
+                if start != -1:
+                    found[(i, adapter, reverse)] = start
+
+        hits = []
+        for (i, adapter, reverse), start in found.items():
+            if reverse and (i, adapter, False) in found:
+                continue
+            hits.append((i, adapter, start + 1))
+        return hits
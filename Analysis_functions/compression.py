@@ -0,0 +1,177 @@
+'''
+Opening of plain, gzip and BGZF compressed fastq files.
+
+The format is detected from the magic bytes, not from the file extension.
+BGZF (blocked gzip, as written by bgzip/samtools) consists of independent
+gzip blocks, so blocks are inflated on a thread pool.
+zlib releases the GIL while inflating, so threads run in parallel.
+Standard input ('-') and named pipes are streams: they are read once from the
+beginning, the compression is detected by peeking at the first bytes and
+BGZF is decompressed as ordinary gzip.
+'''
+import gzip
+import io
+import os
+import stat
+import struct
+import sys
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+GZIP_MAGIC = b'\x1f\x8b'
+FEXTRA = 4
+BGZF_HEADER_SIZE = 18
+# Input file name of the standard input
+STDIN = '-'
+# Number of BGZF blocks (up to 64 Kb each) sent to one thread at once:
+BLOCKS_PER_TASK = 16
+
+
+def is_stream(file_path):
+    '''
+    Check if the input is the standard input or a named pipe, which can be read only once.
+    '''
+    return str(file_path) == STDIN or stat.S_ISFIFO(os.stat(file_path).st_mode)
+
+
+def open_stream(file_path):
+    '''
+    Open the standard input or a named pipe as binary stream, decompressed if it starts with gzip magic bytes.
+    '''
+    inf = sys.stdin.buffer if str(file_path) == STDIN else open(file_path, 'rb')
+    if inf.peek(len(GZIP_MAGIC))[:len(GZIP_MAGIC)] == GZIP_MAGIC:
+        return gzip.GzipFile(fileobj=inf, mode='rb')
+    return inf
+
+
+def detect_compression(file_path):
+    '''
+    Return 'bgzf', 'gzip' or None (plain text) by the first bytes of the file.
+    '''
+    with open(file_path, 'rb') as inf:
+        header = inf.read(BGZF_HEADER_SIZE)
+
+    if header[:2] != GZIP_MAGIC:
+        return None
+
+    # BGZF is gzip with an extra field containing 'BC' subfield
+    if len(header) == BGZF_HEADER_SIZE and header[3] & FEXTRA and header[12:14] == b'BC':
+        return 'bgzf'
+
+    return 'gzip'
+
+
+def read_bgzf_blocks(inf):
+    '''
+    Generator that yields raw compressed BGZF blocks (deflate data and uncompressed size).
+    Only the headers are parsed here, inflating is done by inflate_blocks().
+    '''
+    while True:
+        header = inf.read(BGZF_HEADER_SIZE)
+        if not header:
+            return
+        if len(header) < BGZF_HEADER_SIZE or header[:2] != GZIP_MAGIC:
+            raise Exception('Invalid BGZF block header')
+
+        extra_length = struct.unpack('<H', header[10:12])[0]
+        block_size = struct.unpack('<H', header[16:18])[0] + 1
+        # The rest of the extra field, deflate data, CRC32 and ISIZE:
+        block = inf.read(block_size - BGZF_HEADER_SIZE)
+        if len(block) != block_size - BGZF_HEADER_SIZE:
+            raise Exception('Truncated BGZF block')
+
+        data = block[extra_length - 6:-8]
+        crc, size = struct.unpack('<II', block[-8:])
+        yield data, crc, size
+
+
+def inflate_blocks(blocks):
+    '''
+    Inflate a list of BGZF blocks and check their CRC32.
+    '''
+    chunks = []
+    for data, crc, size in blocks:
+        chunk = zlib.decompress(data, -15)
+        if len(chunk) != size or zlib.crc32(chunk) != crc:
+            raise Exception('BGZF block is corrupted')
+        chunks.append(chunk)
+    return b''.join(chunks)
+
+
+def grouped(iterable, size):
+    '''
+    Split iterable into lists of the given size.
+    '''
+    group = []
+    for element in iterable:
+        group.append(element)
+        if len(group) == size:
+            yield group
+            group = []
+    if group:
+        yield group
+
+
+class BGZFReader(io.RawIOBase):
+    '''
+    Binary stream of decompressed BGZF data.
+    Blocks are inflated in order by a pool of threads,
+    at most 2 * threads tasks are in flight at the same time.
+    '''
+
+    def __init__(self, file_path, threads=None):
+        self.inf = open(file_path, 'rb')
+        self.threads = threads or os.cpu_count() or 1
+        self.executor = ThreadPoolExecutor(max_workers=self.threads)
+        self.chunks = self._inflated_chunks()
+        self.buffer = b''
+        self.position = 0
+
+    def _inflated_chunks(self):
+        pending = []
+        for blocks in grouped(read_bgzf_blocks(self.inf), BLOCKS_PER_TASK):
+            pending.append(self.executor.submit(inflate_blocks, blocks))
+            if len(pending) >= 2 * self.threads:
+                yield pending.pop(0).result()
+        for future in pending:
+            yield future.result()
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while self.position == len(self.buffer):
+            self.buffer = next(self.chunks, None)
+            self.position = 0
+            if self.buffer is None:
+                self.buffer = b''
+                return 0
+
+        size = min(len(b), len(self.buffer) - self.position)
+        b[:size] = self.buffer[self.position:self.position + size]
+        self.position += size
+        return size
+
+    def close(self):
+        if not self.closed:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.inf.close()
+        super().close()
+
+
+def open_fastq(file_path, threads=None):
+    '''
+    Open plain, gzip or BGZF fastq file (or stream) for reading as binary stream.
+    '''
+    if is_stream(file_path):
+        return open_stream(file_path)
+
+    compression = detect_compression(file_path)
+
+    if compression == 'bgzf':
+        return io.BufferedReader(BGZFReader(file_path, threads), buffer_size=1 << 20)
+
+    if compression == 'gzip':
+        return gzip.open(file_path, 'rb')
+
+    return open(file_path, 'rb')
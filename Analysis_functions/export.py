@@ -0,0 +1,55 @@
+'''
+Machine-readable results of the report.
+
+results.json holds the statuses, basic statistics and summaries of all modules,
+numpy arrays of the summaries (per-position values) are saved to results.npz
+and referenced from the JSON as {"array": key}. Everything is written from
+the summaries in memory, the same objects the plots and the report are made of.
+'''
+import datetime
+import json
+
+import numpy as np
+
+from Analysis_functions import result_cache
+
+RESULTS_FILE = 'results.json'
+ARRAYS_FILE = 'results.npz'
+
+
+def to_json(value, name, arrays):
+    '''
+    JSON-compatible copy of a summary value, numpy arrays are moved to the dictionary arrays {name: array}.
+    '''
+    if isinstance(value, np.ndarray):
+        arrays[name] = value
+        return {'array': name}
+    if isinstance(value, dict):
+        return {str(key): to_json(item, name + '/' + str(key), arrays) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [to_json(item, name + '/' + str(i), arrays) for i, item in enumerate(value)]
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def write_results(outdir, file, summaries, basic_statistics, information=None):
+    '''
+    Save "outdir/results.json" and "outdir/results.npz".
+    summaries is dictionary {module name: summary with status},
+    information is added to the top level of the JSON (for example, sample note).
+    '''
+    arrays = {}
+    modules = {name: to_json(summary, name, arrays) for name, summary in summaries.items()}
+    results = {'version': result_cache.VERSION,
+               'file': file,
+               'date': datetime.datetime.utcnow().isoformat(timespec='seconds'),
+               'basic_statistics': to_json(basic_statistics, 'basic_statistics', arrays),
+               'statuses': {name: summary['status'] for name, summary in summaries.items()},
+               'modules': modules,
+               'arrays': ARRAYS_FILE}
+    results |= information or {}
+
+    with open(outdir + RESULTS_FILE, 'w') as outf:
+        json.dump(results, outf, indent=1)
+    np.savez_compressed(outdir + ARRAYS_FILE, **arrays)
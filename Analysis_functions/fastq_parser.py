@@ -0,0 +1,199 @@
+'''
+Bytes-level fastq parser.
+
+Plain files are memory-mapped, compressed files are read by large blocks.
+Newlines of a whole block are found at once with numpy, and the block
+is returned as a RecordBatch: the raw bytes and the offsets of every line.
+Lines are not decoded or copied, accumulators work with numpy views
+of sequences and qualities.
+'''
+import mmap
+import os
+
+import numpy as np
+
+from Analysis_functions import compression
+
+# Size of the block of the file parsed at once
+BLOCK_SIZE = 4 << 20
+NEWLINE = ord('\n')
+CARRIAGE_RETURN = ord('\r')
+# Indexes of lines in the record
+HEADER, SEQUENCE, PLUS, QUALITY = 0, 1, 2, 3
+# Offset of quality symbols in Phred+33 and the largest Phred score
+QUALITY_OFFSET = 33
+MAX_SCORE = 93
+
+
+def quality_table(offset=QUALITY_OFFSET):
+    '''
+    Lookup table of Phred scores of all 256 bytes of quality lines with the offset,
+    symbols out of the range get 0 or MAX_SCORE.
+    '''
+    return np.clip(np.arange(256) - offset, 0, MAX_SCORE).astype(np.uint8)
+
+
+class RecordBatch:
+    '''
+    Batch of fastq records over one buffer of bytes.
+    starts and ends are arrays 'records x 4' with offsets of every line
+    (identifier, read sequence, plus, and quality score sequence).
+    Iteration yields records as tuples of 4 bytes objects,
+    a slice is a RecordBatch over the same buffer.
+    '''
+
+    def __init__(self, data, starts, ends):
+        self.data = data
+        self.starts = starts
+        self.ends = ends
+        self._bytes = None
+
+    @classmethod
+    def from_records(cls, records):
+        '''
+        Build batch from records (lists of 4 bytes or strings), for example from read_file().
+        '''
+        lines = [line.encode() if isinstance(line, str) else bytes(line) for record in records for line in record]
+        lengths = np.fromiter(map(len, lines), dtype=np.int64, count=len(lines))
+        starts = np.cumsum(lengths + 1) - lengths - 1
+        data = np.frombuffer(b'\n'.join(lines) + b'\n', dtype=np.uint8)
+        return cls(data, starts.reshape(-1, 4), (starts + lengths).reshape(-1, 4))
+
+    def __len__(self):
+        return len(self.starts)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            # Records i of the same buffer:
+            batch = RecordBatch(self.data, self.starts[i], self.ends[i])
+            batch._bytes = self._bytes
+            return batch
+        return tuple(self.data[start:end].tobytes() for start, end in zip(self.starts[i], self.ends[i]))
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def lengths(self, field=SEQUENCE):
+        return self.ends[:, field] - self.starts[:, field]
+
+    def lines(self, field=SEQUENCE):
+        '''
+        List of bytes objects of one line of every record.
+        '''
+        if self._bytes is None:
+            self._bytes = self.data.tobytes()
+        return [self._bytes[start:end]
+                for start, end in zip(self.starts[:, field].tolist(), self.ends[:, field].tolist())]
+
+    def concatenated(self, field=SEQUENCE):
+        '''
+        One line of all records concatenated into one uint8 array, and lengths of lines.
+        '''
+        lengths = self.lengths(field)
+        shifts = np.repeat(self.starts[:, field] - (np.cumsum(lengths) - lengths), lengths)
+        return self.data[np.arange(len(shifts)) + shifts], lengths
+
+    def positions(self, field=SEQUENCE):
+        '''
+        Position inside the line for every symbol of concatenated().
+        '''
+        lengths = self.lengths(field)
+        return np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+
+
+def split_lines(data, final):
+    '''
+    Find complete records in the buffer.
+    Return RecordBatch and the number of bytes it takes.
+    If final is True, the last line may have no newline symbol.
+    '''
+    newlines = np.flatnonzero(data == NEWLINE)
+    if final and len(data) and (not len(newlines) or newlines[-1] != len(data) - 1):
+        newlines = np.append(newlines, len(data))
+
+    records_number = len(newlines) // 4
+    if final and len(newlines) % 4:
+        raise Exception('Invalid number of file\'s lines')
+
+    ends = newlines[:records_number * 4]
+    starts = np.concatenate([[0], ends[:-1] + 1]) if len(ends) else ends
+    consumed = int(ends[-1]) + 1 if len(ends) else 0
+
+    # Windows line endings:
+    if len(ends):
+        carriage = data[np.maximum(ends - 1, 0)] == CARRIAGE_RETURN
+        ends = ends - (carriage & (ends > starts))
+
+    return RecordBatch(data, starts.reshape(-1, 4), ends.reshape(-1, 4)), min(consumed, len(data))
+
+
+def iter_buffer(data, block_size=BLOCK_SIZE):
+    '''
+    Split a buffer (for example memory-mapped file) into batches of complete records.
+    '''
+    position = 0
+    while position < len(data):
+        size = block_size
+        while True:
+            final = position + size >= len(data)
+            block = data[position:position + size]
+            batch, consumed = split_lines(block, final)
+            if len(batch) or final:
+                break
+            # The block is smaller than one record:
+            size *= 2
+        if len(batch):
+            yield batch
+        position += consumed
+        if final:
+            break
+
+
+def iter_stream(inf, block_size=BLOCK_SIZE):
+    '''
+    Read a binary stream by blocks and split it into batches of complete records.
+    The incomplete record in the end of a block is moved to the next block.
+    '''
+    rest = b''
+    while True:
+        chunk = inf.read(block_size)
+        final = not chunk
+        data = np.frombuffer(rest + chunk, dtype=np.uint8)
+        batch, consumed = split_lines(data, final)
+        if len(batch):
+            yield batch
+        if final:
+            return
+        rest = data[consumed:].tobytes()
+
+
+def iter_batches(file_path, threads=None, start=0, end=None, block_size=BLOCK_SIZE):
+    '''
+    Generator of RecordBatch objects for plain, gzip or BGZF fastq file,
+    the standard input ('-') or a named pipe.
+    Plain files are memory-mapped, start and end limit the range of bytes
+    (start must be the beginning of a record).
+    threads is the number of threads for BGZF decompression.
+    '''
+    if compression.is_stream(file_path) or compression.detect_compression(file_path) is not None:
+        with compression.open_fastq(file_path, threads) as inf:
+            yield from iter_stream(inf, block_size)
+        return
+
+    if os.path.getsize(file_path) == 0:
+        return
+
+    # The mapping is closed by garbage collector, when no batch refers to it any more:
+    with open(file_path, 'rb') as inf:
+        mapped = mmap.mmap(inf.fileno(), 0, access=mmap.ACCESS_READ)
+    data = np.frombuffer(mapped, dtype=np.uint8)
+    end = len(data) if end is None else end
+    yield from iter_buffer(data[start:end], block_size)
+
+
+def read_records(file_path):
+    '''
+    List of all records of the file, every record is a tuple of 4 bytes objects.
+    '''
+    return [record for batch in iter_batches(file_path) for record in batch]
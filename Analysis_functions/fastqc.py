@@ -4,14 +4,66 @@
 # сохраняем в переменную и передаем ее для остальных функций
 
 from collections import Counter
-import matplotlib.pyplot as plt
+import logging
 import csv
+import math
+import numpy as np
+
+from Analysis_functions import adapter_scanner
+from Analysis_functions import fastq_parser
+from Analysis_functions import histogram
+from Analysis_functions import position_bins
+from Analysis_functions import read_store
+from Analysis_functions import sketches
+from Analysis_functions import streaming
+
+
+class SequenceLengthAccumulator(streaming.Accumulator):
+    name = 'sequence_length_distribution'
+
+    def __init__(self):
+        self.lengths = histogram.Histogram()
+
+    def update_batch(self, batch):
+        self.lengths.update(batch.lengths(fastq_parser.SEQUENCE))
+
+    def merge(self, other):
+        self.lengths.merge(other.lengths)
+
+    def finalize(self):
+        lengths, numbers = self.lengths.nonzero()
+        return Counter(dict(zip(lengths.tolist(), numbers.tolist())))
 
 
 def sequence_length_distribution(parsed_file, DEFAULT_OUTPUT_DIR='./Report_data/'):
-    lines_reads = [i[1] for i in parsed_file]
-    seq_dict = Counter(sorted(map(len, lines_reads)))
-    counter = 1
+    seq_dict = streaming.accumulate(parsed_file, SequenceLengthAccumulator())
+    return report_sequence_length_distribution(seq_dict, DEFAULT_OUTPUT_DIR)
+
+
+def report_sequence_length_distribution(seq_dict, DEFAULT_OUTPUT_DIR='./Report_data/'):
+    summary = summarize_sequence_length_distribution(seq_dict)
+    render_sequence_length_distribution(summary, DEFAULT_OUTPUT_DIR)
+    return summary['status']
+
+
+def summarize_sequence_length_distribution(seq_dict):
+    """
+    Summary of the module: check status and the counts of read lengths.
+    """
+    if seq_dict.get(0, 0) != 0:
+        status = 'failure'
+    elif len(seq_dict) != 1:
+        status = 'warning'
+    else:
+        status = 'good'
+
+    return {'status': status, 'lengths': dict(seq_dict)}
+
+
+def render_sequence_length_distribution(summary, DEFAULT_OUTPUT_DIR='./Report_data/'):
+    import matplotlib.pyplot as plt
+
+    seq_dict = summary['lengths']
 
     if len(seq_dict) == 1:
         key = list(seq_dict.keys())[0]
@@ -22,11 +74,9 @@ def sequence_length_distribution(parsed_file, DEFAULT_OUTPUT_DIR='./Report_data/
         xs = seq_dict.keys()
         ys = seq_dict.values()
 
-    while True:
-        if (max(xs) - min(xs) + 1) // counter < 10:
-            xticks = (list(range(min(xs), max(xs) + 1, counter)))
-            break
-        counter += 1
+    # The smallest step with less than 10 ticks:
+    counter = (max(xs) - min(xs) + 1) // 10 + 1
+    xticks = list(range(min(xs), max(xs) + 1, counter))
 
     color = '#CB382E'
     label = 'Sequence length'
@@ -36,118 +86,246 @@ def sequence_length_distribution(parsed_file, DEFAULT_OUTPUT_DIR='./Report_data/
 
     draw_plot(xs, ys, color, label, xlabel, title, xticks, yticks)
 
-    # сохраняем картинку и возвращаем check
+    # сохраняем картинку
 
     plt.gcf().set_size_inches(8, 6)
     plt.savefig(DEFAULT_OUTPUT_DIR+'sequence_length_distribution.png', dpi=100, bbox_inches='tight')
     plt.close()
 
-    if seq_dict[0] != 0:
-        return 'failure'
-    elif len(seq_dict) != 1:
-        return 'warning'
-    else:
-        return 'good'
+
+def truncate_read(read):
+    return read[:50] if len(read) > 75 else read
+
+
+class OverrepresentedAccumulator(streaming.Accumulator):
+    """
+    Heavy hitters among (truncated) reads in bounded memory.
+    Misra-Gries summary with 10 / threshold counters keeps every sequence
+    above threshold (guaranteed recall), its counts are lower bounds.
+    Count-Min sketch gives the second upper bound of the counts
+    to verify the candidates.
+    """
+    name = 'overrepresented_sequences'
+
+    def __init__(self, threshold=0.001):
+        self.threshold = threshold
+        self.summary = sketches.MisraGries(math.ceil(10 / threshold))
+        self.sketch = sketches.CountMinSketch()
+        self.number_reads = 0
+
+    def update_batch(self, batch):
+        reads = [truncate_read(read) for read in batch.lines(fastq_parser.SEQUENCE)]
+        self.number_reads += len(reads)
+        counter = Counter(reads)
+        self.summary.update(counter)
+        self.sketch.update([sketches.fingerprint(read) for read in reads])
+
+    def merge(self, other):
+        self.summary.merge(other.summary)
+        self.sketch.merge(other.sketch)
+        self.number_reads += other.number_reads
+
+    def finalize(self):
+        """
+        Return list of [sequence, count] above threshold sorted by count,
+        number of reads and maximal error of counts.
+        Count is the smallest upper bound, it is exact if no counters were dropped.
+        """
+        items = list(self.summary.counts.items())
+        upper = np.fromiter((count for _, count in items), dtype=np.int64, count=len(items)) + self.summary.error
+        if self.summary.error and items:
+            sketch_upper = self.sketch.estimate([sketches.fingerprint(read) for read, _ in items]).astype(np.int64)
+            upper = np.minimum(upper, sketch_upper)
+
+        d = [[read.decode(), int(count)] for (read, _), count in zip(items, upper)
+             if count >= self.threshold * self.number_reads]
+        d.sort(key=lambda x: x[1], reverse=True)
+        return d, self.number_reads, self.summary.error
 
 
 def overrepresented_sequences(parsed_file, DEFAULT_OUTPUT_DIR='./Report_data/'):
-    lines_reads = [i[1] for i in parsed_file]
-    number_reads = len(lines_reads)
-    counter = 0
+    result = streaming.accumulate(parsed_file, OverrepresentedAccumulator())
+    return report_overrepresented_sequences(result, DEFAULT_OUTPUT_DIR)
 
-    d = Counter([i[:50] if len(i) > 75 else i for i in lines_reads])
-    d = list(map(list, sorted(d.items(), key=lambda x: x[1], reverse=True)))
 
-    for i in range(0, len(d)):
-        percents = d[i][1] / number_reads
+def report_overrepresented_sequences(result, DEFAULT_OUTPUT_DIR='./Report_data/'):
+    summary = summarize_overrepresented_sequences(result)
+    render_overrepresented_sequences(summary, DEFAULT_OUTPUT_DIR)
+    return summary['status']
 
-        if percents < 0.001:
-            d = d[:counter]
-            break
 
-        d[i].append(percents * 100)
-        counter += 1
+def summarize_overrepresented_sequences(result):
+    """
+    Summary of the module: check status and the list of [sequence, count, percent].
+    """
+    d, number_reads, error = result
+    if error:
+        logging.info('overrepresented sequences counts are upper bounds, overestimated by at most %s reads', error)
 
-    if len(d) == 0:
-        return 'good'
+    sequences = [[read, count, count / number_reads * 100] for read, count in d]
+
+    if len(sequences) == 0:
+        status = 'good'
+    elif sequences[0][2] > 1:
+        status = 'failure'
+    else:
+        status = 'warning'
+
+    return {'status': status, 'sequences': sequences}
 
-    # сохраняем таблицу и возвращаем check
+
+def render_overrepresented_sequences(summary, DEFAULT_OUTPUT_DIR='./Report_data/'):
+    if len(summary['sequences']) == 0:
+        return
+
+    # сохраняем таблицу
 
     with open(DEFAULT_OUTPUT_DIR+'or_seq.csv', 'w') as f:
         writer = csv.writer(f)
-        for read in d:
+        for read in summary['sequences']:
             writer.writerow(read)
 
-    if d[0][2] > 1:
-        return 'failure'
-    else:
-        return 'warning'
+
+ADAPTERS = {'Illumina Universal Adapter': 'AATGATACGGCGACCACCGAGATCTACACTCTTTCCCTACACGACGCTCTTCCGATCT',
+            'Illumina Small RNA 3\' Adapter': 'TGGAATTCTCGGGTGCCAAGG',
+            'Illumina Small RNA 5\' Adapter': 'GUUCAGAGUUCUACAGUCCGACGAUC',
+            'Nextera Transposase Sequence 1': 'TCGTCGGCAGCGTCAGATGTGTATAAGAGACAG',
+            'Nextera Transposase Sequence 2': 'GTCTCGTGGGCTCGGAGATGTGTATAAGAGACAG',
+            'SOLID Small RNA Adapter': 'CCACTACGCCTCCGCTTTCCTCTCTATGGGCAGTCGGTGAT'}
+
+ADAPTER_COLORS = {'Illumina Universal Adapter': '#D14139',
+                  'Illumina Small RNA 3\' Adapter': '#1D2DD8',
+                  'Illumina Small RNA 5\' Adapter': '#73DF57',
+                  'Nextera Transposase Sequence 1': '#6D6D6D',
+                  'Nextera Transposase Sequence 2': 'purple',
+                  'SOLID Small RNA Adapter': '#EC69F8'}
+
+
+class AdapterContentAccumulator(streaming.Accumulator):
+    """
+    Cumulative adapter counts per position.
+    For every adapter hit only two elements of the difference array are changed:
+    +1 at the adapter start and -1 after the read end.
+    Element i of the difference array is the bin i - 1 of positions (see position_bins),
+    the position i for reads up to 1024 bp.
+    """
+    name = 'adapter_content'
+
+    def __init__(self, adapters=ADAPTERS):
+        self.adapters = adapters
+        self.scanner = adapter_scanner.AdapterScanner(adapters)
+        self.differences = np.zeros((len(adapters), 2), dtype=np.int64)
+        self.number_reads = 0
+        self.max_length = 0
+
+    def grow(self, n):
+        if n + 2 > self.differences.shape[1]:
+            self.differences = np.pad(self.differences, ((0, 0), (0, n + 2 - self.differences.shape[1])))
+
+    def update_batch(self, batch):
+        reads = batch.lines(fastq_parser.SEQUENCE)
+        lengths = batch.lengths(fastq_parser.SEQUENCE)
+        self.number_reads += len(reads)
+        self.max_length = max(self.max_length, int(lengths.max(initial=0)))
+        self.grow(position_bins.bins_number(self.max_length))
+
+        hits = self.scanner.scan(reads)
+        if not hits:
+            return
+        read_indexes, adapters, starts = np.array(hits, dtype=np.int64).T
+        np.add.at(self.differences, (adapters, position_bins.bin_index(starts - 1) + 1), 1)
+        np.add.at(self.differences, (adapters, position_bins.bin_index(lengths[read_indexes] - 1) + 2), -1)
+
+    def merge(self, other):
+        self.grow(other.differences.shape[1] - 2)
+        self.differences[:, :other.differences.shape[1]] += other.differences
+        self.number_reads += other.number_reads
+        self.max_length = max(self.max_length, other.max_length)
+
+    def finalize(self):
+        """
+        Return dictionary {adapter: {position: number of reads with adapter up to the position}},
+        number of reads and max read length. Positions of long reads are the first positions of bins.
+        """
+        adap_check = {}
+        cumulative = np.cumsum(self.differences, axis=1)
+        # The first element is not a bin:
+        positions = np.append(0, position_bins.first_positions(self.differences.shape[1] - 1))
+        for adap, counts in zip(self.adapters, cumulative):
+            adap_check[adap] = {int(positions[k]): int(counts[k]) for k in np.flatnonzero(counts)}
+        return adap_check, self.number_reads, self.max_length
+
+
+def read_adapters(file_path):
+    """
+    Read adapters from the file in FastQC format:
+    name and sequence separated by tab, lines starting with '#' are comments.
+    """
+    adapters = {}
+    with open(file_path) as inf:
+        for line in inf:
+            if not line.strip() or line.startswith('#'):
+                continue
+            name, sequence = line.rstrip('\n').rsplit('\t', 1)
+            adapters[name.strip()] = sequence.strip().upper()
+    return adapters
 
 
 def adapter_content(parsed_file, DEFAULT_OUTPUT_DIR='./Report_data/'):
-    lines_reads = [i[1] for i in parsed_file]
-    adapters = {'Illumina Universal Adapter': 'AATGATACGGCGACCACCGAGATCTACACTCTTTCCCTACACGACGCTCTTCCGATCT',
-                'Illumina Small RNA 3\' Adapter': 'TGGAATTCTCGGGTGCCAAGG',
-                'Illumina Small RNA 5\' Adapter': 'GUUCAGAGUUCUACAGUCCGACGAUC',
-                'Nextera Transposase Sequence 1': 'TCGTCGGCAGCGTCAGATGTGTATAAGAGACAG',
-                'Nextera Transposase Sequence 2': 'GTCTCGTGGGCTCGGAGATGTGTATAAGAGACAG',
-                'SOLID Small RNA Adapter': 'CCACTACGCCTCCGCTTTCCTCTCTATGGGCAGTCGGTGAT'}
-
-    adap_check = {'Illumina Universal Adapter': [],
-                  'Illumina Small RNA 3\' Adapter': [],
-                  'Illumina Small RNA 5\' Adapter': [],
-                  'Nextera Transposase Sequence 1': [],
-                  'Nextera Transposase Sequence 2': [],
-                  'SOLID Small RNA Adapter': []}
-
-    colors = {'Illumina Universal Adapter': '#D14139',
-              'Illumina Small RNA 3\' Adapter': '#1D2DD8',
-              'Illumina Small RNA 5\' Adapter': '#73DF57',
-              'Nextera Transposase Sequence 1': '#6D6D6D',
-              'Nextera Transposase Sequence 2': 'purple',
-              'SOLID Small RNA Adapter': '#EC69F8'}
-    max_val = 0
-    min_key = max(map(len, lines_reads))
-    max_key = 0
+    result = streaming.accumulate(parsed_file, AdapterContentAccumulator())
+    return report_adapter_content(result, DEFAULT_OUTPUT_DIR)
+
+
+def report_adapter_content(result, DEFAULT_OUTPUT_DIR='./Report_data/'):
+    summary = summarize_adapter_content(result)
+    render_adapter_content(summary, DEFAULT_OUTPUT_DIR)
+    return summary['status']
+
+
+def summarize_adapter_content(result):
+    """
+    Summary of the module: check status and cumulative adapter counts per position.
+    """
+    adap_check, number_reads, max_length = result
+    max_val = max([val for vals in adap_check.values() for val in vals.values()], default=0)
+    thre = max_val / number_reads
+
+    if thre > 0.1:
+        status = 'failure'
+    elif thre > 0.05:
+        status = 'warning'
+    else:
+        status = 'good'
+
+    return {'status': status, 'adapters': adap_check, 'number_reads': number_reads, 'max_length': max_length}
 
-    for read in lines_reads:
-        for adapter in adapters:
-            in1 = read.upper().rfind(adapters[adapter]) + 1
-            in2 = read.upper().rfind(adapters[adapter][::-1].translate(str.maketrans('ATCG', 'TAGC'))) + 1
 
-            if in1 != 0:
-                adap_check[adapter] += range(in1, len(read) + 1)
-            elif in2 != 0:
-                adap_check[adapter] += range(in2, len(read) + 1)
+def render_adapter_content(summary, DEFAULT_OUTPUT_DIR='./Report_data/'):
+    import matplotlib.pyplot as plt
 
-    for adap in adap_check:
-        c_dict = Counter(adap_check[adap])
-        adap_check[adap] = {k: v for k, v in sorted(c_dict.items(), key=lambda x: x[0])}
+    adap_check = summary['adapters']
+    number_reads = summary['number_reads']
+    colors = ADAPTER_COLORS
+    min_key = summary['max_length']
+    max_key = 0
 
     for keys, vals in adap_check.items():
         for key, val in vals.items():
-            if val > max_val:
-                max_val = val
             if key > max_key:
                 max_key = key
             if key < min_key:
                 min_key = key
 
-    thre = max_val / len(lines_reads)
-
+    # Positions of long reads are the first positions of bins, so there are not too many points:
     for key, vals in adap_check.items():
         if len(vals) == 0:
-            if max_key == 0:
-                xs = range(1, min_key + 1)
-                ys = [0] * min_key
-            else:
-                xs = range(1, max_key + 1)
-                ys = [0] * max_key
+            xs = position_bins.first_positions(position_bins.bins_number(max_key or min_key)).tolist()
+            ys = [0] * len(xs)
         else:
-            xs = list(range(1, min_key)) + list(vals.keys())
-            ys = [0] * (min_key - 1) + [i / len(lines_reads) * 100 for i in list(vals.values())]
+            xs = position_bins.first_positions(position_bins.bins_number(min_key - 1)).tolist() + list(vals.keys())
+            ys = [0] * (len(xs) - len(vals)) + [i / number_reads * 100 for i in list(vals.values())]
 
-        color = colors[key]
+        color = colors.get(key)
         label = key
         xlabel = 'Position in read (bp)'
         title = '% Adapter'
@@ -156,40 +334,20 @@ def adapter_content(parsed_file, DEFAULT_OUTPUT_DIR='./Report_data/'):
 
         draw_plot(xs, ys, color, label, xlabel, title, xticks, yticks)
 
-    # сохраняем картинку и возвращаем check
+    # сохраняем картинку
 
     plt.gcf().set_size_inches(8, 6)
     plt.savefig(DEFAULT_OUTPUT_DIR+'adapter_content.png', dpi=100, bbox_inches='tight')
     plt.close()
 
-    if thre > 0.1:
-        return 'failure'
-    elif thre > 0.05:
-        return 'warning'
-    else:
-        return 'good'
-
-
-def read_file(file_path):
-    parsed_file = []
-    temp_list = []
-
-    with open(file_path) as inf:
-
-        for line in inf:
-            temp_list.append(line.rstrip())
-
-            if len(temp_list) == 4:
-                parsed_file.append(temp_list)
-                temp_list = []
-
-        if len(temp_list) != 0:
-            raise Exception('Invalid number of file\'s lines')
 
-    return parsed_file
+def read_file(file_path, headers=False):
+    # Raises exception if the number of lines is not a multiple of 4
+    return read_store.ReadStore.from_file(file_path, headers)
 
 
 def draw_plot(xs, ys, color, label, xlabel, title, xticks, yticks):
+    import matplotlib.pyplot as plt
 
     plt.plot(xs, ys, color=color, label=label)
 
@@ -0,0 +1,92 @@
+'''
+Reading of a fastq file which is still being written.
+
+Every call of FileFollower.read_batches() returns only the complete records
+appended since the previous call, the incomplete record in the end is kept
+until the rest of it is written. gzip and BGZF files are decompressed incrementally.
+'''
+import os
+import zlib
+
+import numpy as np
+
+from Analysis_functions import compression
+from Analysis_functions import fastq_parser
+
+
+class Inflater:
+    '''
+    Incremental decompression of concatenated gzip members (gzip or BGZF).
+    '''
+
+    def __init__(self):
+        self.decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16)
+
+    def decompress(self, data):
+        chunks = []
+        while data:
+            chunks.append(self.decompressor.decompress(data))
+            if not self.decompressor.eof:
+                break
+            # The next gzip member starts after the end of this one:
+            data = self.decompressor.unused_data
+            self.decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16)
+        return b''.join(chunks)
+
+
+class FileFollower:
+    '''
+    Reader of the records appended to a growing fastq file.
+    position is the number of bytes of the file already read.
+    '''
+
+    def __init__(self, file_path, block_size=fastq_parser.BLOCK_SIZE):
+        self.file_path = file_path
+        self.block_size = block_size
+        self.position = 0
+        self.rest = b''
+        self.inflater = None
+        self.detected = False
+
+    def read_blocks(self):
+        '''
+        Generator of new (decompressed) data of the file since the previous call.
+        '''
+        size = os.path.getsize(self.file_path)
+        if size < self.position:
+            raise Exception('The file was truncated: ' + str(self.file_path))
+
+        if not self.detected:
+            # The compression is detected by the first two bytes
+            if size < 2:
+                return
+            if compression.detect_compression(self.file_path) is not None:
+                self.inflater = Inflater()
+            self.detected = True
+
+        with open(self.file_path, 'rb') as inf:
+            inf.seek(self.position)
+            while self.position < size:
+                data = inf.read(min(self.block_size, size - self.position))
+                if not data:
+                    break
+                self.position += len(data)
+                yield self.inflater.decompress(data) if self.inflater else data
+
+    def read_batches(self, final=False):
+        '''
+        Generator of RecordBatch objects with complete records appended since the previous call.
+        final means that the writer has finished, so the last record may have no newline symbol.
+        '''
+        for block in self.read_blocks():
+            data = np.frombuffer(self.rest + block, dtype=np.uint8)
+            batch, consumed = fastq_parser.split_lines(data, False)
+            self.rest = data[consumed:].tobytes()
+            if len(batch):
+                yield batch
+
+        if final and self.rest:
+            batch, _ = fastq_parser.split_lines(np.frombuffer(self.rest, dtype=np.uint8), True)
+            self.rest = b''
+            if len(batch):
+                yield batch
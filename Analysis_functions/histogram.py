@@ -0,0 +1,93 @@
+'''
+Mergeable histogram of non-negative integer bins.
+
+Values are counted by np.bincount, so an update is one vectorized pass over
+the values of a batch, and histograms of chunks are merged by adding counts.
+The memory is the number of bins (the largest value), not the number of reads.
+Bin b stands for the value b * width, so fractions (GC percents) are counted
+at a fixed resolution. Statistics are calculated from the counts: the mean,
+the standard deviation and quantiles are those of np.mean, np.std and
+np.quantile of the values of all bins repeated by their counts.
+'''
+import numpy as np
+
+from Analysis_functions import streaming
+
+
+class Histogram:
+    '''
+    Numbers of values in bins 0, 1, 2... (int64 array counts).
+    '''
+
+    def __init__(self, width=1, counts=None):
+        self.width = width
+        self.counts = np.zeros(0, dtype=np.int64) if counts is None else np.asarray(counts, dtype=np.int64)
+
+    def update(self, bins, numbers=None):
+        '''
+        Count bins of values (non-negative integer array), numbers are the counts of every value (1 by default).
+        '''
+        if len(bins):
+            counts = np.bincount(bins) if numbers is None else np.bincount(bins, numbers).astype(np.int64)
+            self.counts = streaming.add_arrays(self.counts, counts)
+
+    def merge(self, other):
+        if other.width != self.width:
+            raise Exception('Histograms with different bin widths can not be merged')
+        self.counts = streaming.add_arrays(self.counts, other.counts)
+
+    def shift(self, shift):
+        '''
+        Decrease bins by shift, values below 0 are counted in bin 0 (counts are replaced, not changed in place).
+        '''
+        if shift > 0 and len(self.counts):
+            counts = self.counts[shift:].copy() if len(self.counts) > shift else np.zeros(1, dtype=np.int64)
+            counts[0] = self.counts[:shift + 1].sum()
+            self.counts = counts
+        elif shift < 0:
+            self.counts = np.concatenate([np.zeros(-shift, dtype=np.int64), self.counts])
+
+    def values(self):
+        return np.arange(len(self.counts)) * self.width
+
+    def total(self):
+        return int(self.counts.sum())
+
+    def sum(self):
+        return self.counts @ self.values()
+
+    def nonzero(self):
+        '''
+        Bins with values and their counts.
+        '''
+        bins = np.flatnonzero(self.counts)
+        return bins, self.counts[bins]
+
+    def min(self):
+        bins = np.flatnonzero(self.counts)
+        return int(bins[0]) * self.width if len(bins) else None
+
+    def max(self):
+        bins = np.flatnonzero(self.counts)
+        return int(bins[-1]) * self.width if len(bins) else None
+
+    def mean(self):
+        return self.sum() / self.total() if self.total() else np.nan
+
+    def std(self):
+        if not self.total():
+            return np.nan
+        return np.sqrt(self.counts @ (self.values() - self.mean()) ** 2 / self.total())
+
+    def quantile(self, q):
+        '''
+        The q-th quantile, interpolated linearly between the sorted values as np.quantile.
+        '''
+        total = self.total()
+        if not total:
+            return np.nan
+        position = q * (total - 1)
+        cumulative = np.cumsum(self.counts)
+        below, above = np.searchsorted(cumulative, [np.floor(position), np.ceil(position)], side='right')
+        fraction = position - np.floor(position)
+        return (below + (above - below) * fraction) * self.width
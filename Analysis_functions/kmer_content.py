@@ -0,0 +1,234 @@
+'''
+K-mer content: k-mers enriched at some positions of reads.
+
+Bases are packed by 2 bits (A 0, C 1, G 2, T 3), and the codes of all k-mers
+of a batch are made at once by k shifts of the concatenated reads. K-mers with
+other symbols (N) are skipped. Counts of every k-mer in every bin of start
+positions are added with np.bincount. The number of bins is bounded: the bin
+width is doubled, when longer reads come. For k > 8 there are less bins
+(16 for k = 9 and 4 for k = 10), so that the memory stays below 32 Mb.
+
+As in the Kmer Content module of FastQC, a k-mer is enriched if it is found
+in some bin more often than expected from its count in all positions and
+the number of k-mers in the bin (binomial test with Bonferroni correction).
+'''
+import numpy as np
+
+from Analysis_functions import fastq_parser
+from Analysis_functions import streaming
+
+DEFAULT_K = 7
+MAX_K = 10
+# Start positions are grouped into at most this number of bins,
+# and into less bins for long k-mers, so that the table has at most MAX_COUNTERS counters
+MAX_BINS = 64
+MAX_COUNTERS = 1 << 22
+# 2-bit codes of bases, other symbols are INVALID
+INVALID = 4
+BASE_CODES = np.full(256, INVALID, dtype=np.uint8)
+for code, bases in enumerate((b'Aa', b'Cc', b'Gg', b'Tt')):
+    BASE_CODES[list(bases)] = code
+BASES = 'ACGT'
+# Numbers of k-mers in the table of the report and in the plot
+TABLE_KMERS = 20
+PLOT_KMERS = 6
+# Corrected p-value of the warning (any enriched k-mer) and of the failure
+WARNING_P = 1e-2
+FAILURE_P = 1e-5
+COLORS = ['#D14139', '#1D2DD8', '#008000', '#FF8C00', '#8B008B', '#00CED1']
+
+
+def kmer_codes(batch, k):
+    '''
+    Codes of all k-mers of reads of the batch which have only A, C, G and T,
+    and their start positions in reads (uint32 arrays).
+    '''
+    symbols, lengths = batch.concatenated(fastq_parser.SEQUENCE)
+    number = len(symbols) - k + 1
+    if number <= 0:
+        return np.zeros(0, dtype=np.uint32), np.zeros(0, dtype=np.uint32)
+
+    bases = BASE_CODES[symbols]
+    codes = bases[:number].astype(np.uint32)
+    for shift in range(1, k):
+        codes <<= 2
+        codes |= bases[shift:shift + number]
+
+    # K-mers with other symbols or across the end of the read are skipped
+    # (indexes are shifted by k, so that starts before the beginning are in the array):
+    skipped = np.zeros(len(symbols) + k, dtype=bool)
+    invalid = np.flatnonzero(bases == INVALID)
+    ends = np.cumsum(lengths)
+    for offset in range(k):
+        skipped[invalid - offset + k] = True
+    for offset in range(1, k):
+        skipped[ends - offset + k] = True
+    valid = ~skipped[k:k + number]
+
+    positions = np.arange(number, dtype=np.uint32) - np.repeat((ends - lengths).astype(np.uint32), lengths)[:number]
+    return codes[valid], positions[valid]
+
+
+def rebin(counts, factor):
+    '''
+    Counts of bins factor times wider: sums of every factor rows.
+    '''
+    rows = -(-len(counts) // factor) * factor
+    padded = np.zeros((rows, counts.shape[1]), dtype=counts.dtype)
+    padded[:len(counts)] = counts
+    return padded.reshape(-1, factor, counts.shape[1]).sum(axis=1)
+
+
+class KmerContentAccumulator(streaming.Accumulator):
+    '''
+    Counts of every k-mer in every bin of start positions
+    (array 'bins x 4^k', the bin of position p is p // width).
+    '''
+    name = 'kmer_content'
+
+    def __init__(self, k=DEFAULT_K, max_bins=MAX_BINS):
+        if not 1 <= k <= MAX_K:
+            raise Exception('K-mer size must be from 1 to %s' % MAX_K)
+        self.k = k
+        self.max_bins = max(min(max_bins, MAX_COUNTERS >> 2 * k), 1)
+        self.width = 1
+        self.counts = np.zeros((0, 4 ** k), dtype=np.int64)
+
+    def set_width(self, width):
+        if width > self.width:
+            self.counts = rebin(self.counts, width // self.width)
+            self.width = width
+
+    def fit_width(self, last_position):
+        '''
+        Double the width of bins until the position fits into max_bins bins.
+        '''
+        width = self.width
+        while last_position // width >= self.max_bins:
+            width *= 2
+        self.set_width(width)
+
+    def update_batch(self, batch):
+        codes, positions = kmer_codes(batch, self.k)
+        if len(codes) == 0:
+            return
+        self.fit_width(int(batch.lengths().max()) - self.k)
+
+        # Index of the counter: bin and code of the k-mer, the width is a power of 2:
+        index = (positions >> (self.width.bit_length() - 1)).astype(np.int64) << 2 * self.k | codes
+        rows = int(index.max() >> 2 * self.k) + 1
+        counts = np.bincount(index, minlength=rows * 4 ** self.k).reshape(rows, -1)
+        if rows > len(self.counts):
+            self.counts = np.concatenate([self.counts, np.zeros((rows - len(self.counts), 4 ** self.k),
+                                                                dtype=np.int64)])
+        self.counts[:rows] += counts
+
+    def merge(self, other):
+        width = max(self.width, other.width)
+        self.set_width(width)
+        other_counts = rebin(other.counts, width // other.width) if other.width < width else other.counts
+        self.counts = streaming.add_arrays(self.counts, other_counts)
+
+    def finalize(self):
+        return {'k': self.k, 'width': self.width, 'counts': self.counts}
+
+
+def kmer_sequence(code, k):
+    return ''.join(BASES[(code >> 2 * (k - 1 - i)) & 3] for i in range(k))
+
+
+def log_factorial(n):
+    '''
+    ln(n!) by the Stirling series (absolute error below 0.001), 0! is taken as 1!.
+    '''
+    n = np.maximum(np.asarray(n, dtype=np.float64), 1)
+    return n * np.log(n) - n + 0.5 * np.log(2 * np.pi * n) + 1 / (12 * n) - 1 / (360 * n ** 3)
+
+
+def log_binomial_tail(hits, trials, p):
+    '''
+    Natural logarithm of P(X >= hits) for X ~ Binomial(trials, p) and hits > trials * p.
+    The probability of hits is multiplied by the sum of the geometric series
+    of the ratio of the next probabilities, so the value is a close upper bound.
+    '''
+    hits, trials = hits.astype(np.float64), trials.astype(np.float64)
+    log_probability = (log_factorial(trials) - log_factorial(hits) - log_factorial(trials - hits)
+                       + hits * np.log(p) + (trials - hits) * np.log1p(-p))
+    ratio = np.minimum((trials - hits) / (hits + 1) * p / (1 - p), 1 - 1e-12)
+    return np.minimum(log_probability - np.log1p(-ratio), 0)
+
+
+def bin_names(width, bins):
+    '''
+    Ranges of start positions of bins (1-based).
+    '''
+    if width == 1:
+        return [str(i + 1) for i in range(bins)]
+    return ['%s-%s' % (i * width + 1, (i + 1) * width) for i in range(bins)]
+
+
+def summarize_kmer_content(result):
+    '''
+    Summary of the module: check status, the table of enriched k-mers
+    [sequence, count, corrected p-value, maximal obs/exp, position of the maximum]
+    sorted by the maximal obs/exp, and obs/exp of the first of them in every bin.
+    '''
+    k, counts = result['k'], result['counts']
+    total = counts.sum()
+    positions = bin_names(result['width'], len(counts))
+    if total == 0:
+        return {'status': 'good', 'k': k, 'positions': positions, 'kmers': [], 'ratios': {}}
+
+    kmer_totals = counts.sum(axis=0)
+    bin_totals = counts.sum(axis=1)
+    proportions = kmer_totals / total
+    expected = np.outer(bin_totals, proportions)
+
+    # Only bins with more k-mers than expected are tested, corrected by the number of tests:
+    rows, columns = np.nonzero(counts > expected)
+    log_p = np.zeros(counts.shape)
+    log_p[rows, columns] = log_binomial_tail(counts[rows, columns], bin_totals[rows], proportions[columns])
+    log_p += np.log(counts.size)
+    lowest = log_p.min(axis=0)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratios = np.where(expected > 0, counts / expected, 0)
+    enriched = np.flatnonzero(lowest < np.log(WARNING_P))
+    enriched = enriched[np.argsort(-ratios[:, enriched].max(axis=0), kind='stable')]
+
+    kmers = [[kmer_sequence(code, k), int(kmer_totals[code]), float(np.exp(min(lowest[code], 0))),
+              float(ratios[:, code].max()), positions[int(ratios[:, code].argmax())]]
+             for code in enriched[:TABLE_KMERS].tolist()]
+
+    lowest_p = np.exp(lowest.min())
+    if lowest_p < FAILURE_P:
+        status = 'failure'
+    elif lowest_p < WARNING_P:
+        status = 'warning'
+    else:
+        status = 'good'
+
+    return {'status': status, 'k': k, 'positions': positions, 'kmers': kmers,
+            'ratios': {kmer_sequence(code, k): ratios[:, code] for code in enriched[:PLOT_KMERS].tolist()}}
+
+
+def render_kmer_content(summary, DEFAULT_OUTPUT_DIR='./Report_data/'):
+    import matplotlib.pyplot as plt
+
+    positions = summary['positions']
+    for (kmer, ratios), color in zip(summary['ratios'].items(), COLORS):
+        with np.errstate(divide='ignore'):
+            plt.plot(range(len(positions)), np.log2(ratios), color=color, label=kmer)
+
+    step = max(len(positions) // 10, 1)
+    plt.xticks(range(0, len(positions), step), positions[::step], rotation=45)
+    if summary['ratios']:
+        plt.title('Log2 obs/exp of enriched %s-mers' % summary['k'])
+        plt.legend()
+    else:
+        plt.title('No enriched %s-mers' % summary['k'])
+    plt.xlabel('Position in read (bp)')
+    plt.grid(alpha=0.5)
+    plt.gcf().set_size_inches(8, 6)
+    plt.savefig(DEFAULT_OUTPUT_DIR+'kmer_content.png', dpi=100, bbox_inches='tight')
+    plt.close()
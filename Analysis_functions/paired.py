@@ -0,0 +1,206 @@
+'''
+Paired-end analysis of R1 and R2 files in one pass.
+
+Both files are read in background threads at the same time, and their batches
+are cut so that every pair of batches has the same number of records.
+The read names of the mates are checked, then every mate is analysed by its own
+accumulators, and pair accumulators get both batches together
+(method update_pair(first, second) instead of update_batch(batch)).
+'''
+import queue
+import threading
+
+import numpy as np
+
+from Analysis_functions import adapter_scanner
+from Analysis_functions import fastq_parser
+from Analysis_functions import fastqc
+from Analysis_functions import FastQC_G
+from Analysis_functions import streaming
+
+# Number of batches read ahead of the analysis for every file
+PREFETCH_BATCHES = 2
+# Adapter starts of the mates may differ by this number of bases in a consistent read-through
+READ_THROUGH_TOLERANCE = 1
+
+
+def prefetch(batches, size=PREFETCH_BATCHES):
+    '''
+    Iterate batches read in a background thread at most size batches ahead.
+    Decompression and newline search release the GIL, so both mates are read at the same time.
+    '''
+    batch_queue = queue.Queue(size)
+
+    def read():
+        try:
+            for batch in batches:
+                batch_queue.put(batch)
+        except Exception as error:
+            batch_queue.put(error)
+            return
+        batch_queue.put(None)
+
+    threading.Thread(target=read, daemon=True).start()
+    while True:
+        batch = batch_queue.get()
+        if batch is None:
+            return
+        if isinstance(batch, Exception):
+            raise batch
+        yield batch
+
+
+def iter_pairs(first_batches, second_batches):
+    '''
+    Pairs of batches with the same number of records from two iterators of batches.
+    '''
+    first, second = None, None
+    while True:
+        if first is None:
+            first = next(first_batches, None)
+        if second is None:
+            second = next(second_batches, None)
+        if first is None or second is None:
+            if first is not None or second is not None:
+                raise Exception('Paired files have different numbers of reads')
+            return
+
+        number = min(len(first), len(second))
+        yield first[:number], second[:number]
+        first = first[number:] if number < len(first) else None
+        second = second[number:] if number < len(second) else None
+
+
+def read_names(batch):
+    '''
+    Read names without the description and the mate suffix /1 or /2.
+    '''
+    names = []
+    for header in batch.lines(fastq_parser.HEADER):
+        name = header.split(None, 1)[0] if header.strip() else b''
+        if name.endswith((b'/1', b'/2')):
+            name = name[:-2]
+        names.append(name)
+    return names
+
+
+def check_pairing(first, second, offset):
+    '''
+    Raise exception if the names of the mates differ, offset is the number of the first pair.
+    '''
+    first_names, second_names = read_names(first), read_names(second)
+    if first_names != second_names:
+        i = next(i for i, (a, b) in enumerate(zip(first_names, second_names)) if a != b)
+        raise Exception('Reads are not paired: read %s is %s in the first file and %s in the second file'
+                        % (offset + i + 1, first_names[i].decode(errors='replace'),
+                           second_names[i].decode(errors='replace')))
+
+
+def run_paired(first_path, second_path, first_accumulators, second_accumulators, pair_accumulators,
+               threads=None):
+    '''
+    Run accumulators of both mates and pair accumulators on paired files.
+    threads is the number of threads for BGZF decompression of every file.
+    Return three dictionaries {accumulator name: result}.
+    '''
+    pairs = iter_pairs(prefetch(fastq_parser.iter_batches(first_path, threads)),
+                       prefetch(fastq_parser.iter_batches(second_path, threads)))
+    number = 0
+    for first, second in pairs:
+        check_pairing(first, second, number)
+        for accumulator in first_accumulators:
+            accumulator.update_batch(first)
+        for accumulator in second_accumulators:
+            accumulator.update_batch(second)
+        for accumulator in pair_accumulators:
+            accumulator.update_pair(first, second)
+        number += len(first)
+
+    if number == 0:
+        raise Exception('No reads in the paired files')
+
+    return tuple({accumulator.name: accumulator.finalize() for accumulator in accumulators}
+                 for accumulators in (first_accumulators, second_accumulators, pair_accumulators))
+
+
+class PairDeduplicationAccumulator(FastQC_G.DeduplicationAccumulator):
+    '''
+    Duplication levels of pairs: sequences of both mates are counted together,
+    so a pair is a duplicate only if both mates are the same.
+    '''
+    name = 'pair_deduplicated'
+
+    def update_pair(self, first, second):
+        self.add_reads([a + b' ' + b for a, b in zip(first.lines(fastq_parser.SEQUENCE),
+                                                     second.lines(fastq_parser.SEQUENCE))])
+
+
+class ReadThroughAccumulator(streaming.Accumulator):
+    '''
+    Adapter read-through consistency. If the insert is shorter than the reads,
+    both mates read through it into the adapter at the same position.
+    Pairs are counted by the presence of adapters in the mates, and pairs
+    with adapters in both mates also by the agreement of the adapter starts.
+    '''
+    name = 'read_through'
+
+    def __init__(self, adapters=fastqc.ADAPTERS, tolerance=READ_THROUGH_TOLERANCE):
+        self.scanner = adapter_scanner.AdapterScanner(adapters)
+        self.tolerance = tolerance
+        # Pairs without adapters, with adapter only in the first or the second mate, in both mates:
+        self.counts = np.zeros(4, dtype=np.int64)
+        self.consistent = 0
+
+    def adapter_starts(self, batch):
+        '''
+        1-based start of the first adapter of every read, 0 if there is no adapter.
+        '''
+        starts = np.zeros(len(batch), dtype=np.int64)
+        for i, _, start in self.scanner.scan(batch.lines(fastq_parser.SEQUENCE)):
+            if starts[i] == 0 or start < starts[i]:
+                starts[i] = start
+        return starts
+
+    def update_pair(self, first, second):
+        first_starts, second_starts = self.adapter_starts(first), self.adapter_starts(second)
+        self.counts += np.bincount((first_starts > 0) + 2 * (second_starts > 0), minlength=4)
+        both = (first_starts > 0) & (second_starts > 0)
+        self.consistent += int(np.sum(both & (np.abs(first_starts - second_starts) <= self.tolerance)))
+
+    def merge(self, other):
+        self.counts += other.counts
+        self.consistent += other.consistent
+
+    def finalize(self):
+        '''
+        Return dictionary with numbers of pairs.
+        '''
+        no_adapter, first_only, second_only, both = self.counts.tolist()
+        return {'pairs': int(self.counts.sum()), 'no_adapter': no_adapter, 'first_only': first_only,
+                'second_only': second_only, 'both': both, 'consistent': self.consistent}
+
+
+def summarize_read_through(result):
+    '''
+    Summary of the read-through check: status and rows of the table (name, pairs, percent).
+    Inconsistent pairs have an adapter in one mate only or at different positions.
+    '''
+    pairs = result['pairs']
+    inconsistent = result['first_only'] + result['second_only'] + result['both'] - result['consistent']
+    fraction = inconsistent / pairs
+
+    if fraction > 0.05:
+        status = 'failure'
+    elif fraction > 0.01:
+        status = 'warning'
+    else:
+        status = 'good'
+
+    rows = [('No adapter', result['no_adapter']),
+            ('Adapter in the first mate only', result['first_only']),
+            ('Adapter in the second mate only', result['second_only']),
+            ('Adapter in both mates at the same position', result['consistent']),
+            ('Adapter in both mates at different positions', result['both'] - result['consistent'])]
+
+    return {'status': status,
+            'rows': [(name, number, round(100 * number / pairs, 2)) for name, number in rows]}
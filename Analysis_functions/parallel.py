@@ -0,0 +1,112 @@
+'''
+Parallel analysis of one fastq file on several processes.
+
+The file is split into byte ranges aligned to record boundaries.
+Every process runs all accumulators on its own range,
+then the partial accumulators are merged in the file order,
+so the result is the same as in the single-pass serial run.
+'''
+import copy
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from Analysis_functions import compression
+from Analysis_functions import fastq_parser
+from Analysis_functions import streaming
+
+# Number of ranges per process, several ranges help to balance the load:
+RANGES_PER_PROCESS = 4
+
+
+def is_record_start(lines):
+    '''
+    Check that 4 lines starting from the first one are a fastq record.
+    Quality line can also start with '@', but then the third line
+    will be a sequence, not the '+' line.
+    '''
+    return (len(lines) == 4 and lines[0].startswith(b'@') and lines[2].startswith(b'+')
+            and len(lines[1].rstrip()) == len(lines[3].rstrip()))
+
+
+def find_record_start(inf, offset):
+    '''
+    Return the offset of the first record which starts at or after offset.
+    '''
+    if offset == 0:
+        return 0
+
+    # Skip the rest of the line (offset can be in the middle of the line):
+    inf.seek(offset - 1)
+    position = offset - 1 + len(inf.readline())
+
+    lines = [inf.readline() for _ in range(4)]
+    while lines[0]:
+        if is_record_start(lines):
+            return position
+        position += len(lines.pop(0))
+        lines.append(inf.readline())
+
+    return position
+
+
+def split_file(file_path, ranges_number):
+    '''
+    Split file into ranges (start, end) of bytes, every range starts with a record.
+    '''
+    size = os.path.getsize(file_path)
+
+    with open(file_path, 'rb') as inf:
+        starts = [find_record_start(inf, size * i // ranges_number) for i in range(ranges_number)]
+
+    starts = sorted(set(starts + [size]))
+    return list(zip(starts[:-1], starts[1:]))
+
+
+def analyse_range(file_path, start, end, accumulators):
+    '''
+    Run accumulators on one range of the file. Return not finalized accumulators.
+    '''
+    for batch in fastq_parser.iter_batches(file_path, start=start, end=end):
+        for accumulator in accumulators:
+            accumulator.update_batch(batch)
+    return accumulators
+
+
+def is_serial(file_path, processes):
+    '''
+    Check if the file is analysed in this process.
+    Compressed files and streams can not be split by bytes, they are processed in one process.
+    '''
+    return (processes <= 1 or compression.is_stream(file_path)
+            or compression.detect_compression(file_path) is not None)
+
+
+def run_accumulators_parallel(file_path, accumulators, processes, pipeline=None):
+    '''
+    Same as streaming.run_accumulators(), but the file is processed by several processes.
+    Partial accumulators of the processes are merged into the given (empty) accumulators.
+    pipeline is pipeline.Pipeline: the pass in one process is pipelined (reader, parser and analyzer threads).
+    '''
+    if is_serial(file_path, processes):
+        if processes > 1:
+            logging.info('compressed or streamed input is analysed in one process')
+        if pipeline is not None:
+            return pipeline.run(file_path, accumulators, threads=processes)
+        return streaming.run_accumulators(fastq_parser.iter_batches(file_path, threads=processes), accumulators)
+
+    ranges = split_file(file_path, processes * RANGES_PER_PROCESS)
+    logging.info('file split into %s parts for %s processes', len(ranges), processes)
+
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        parts = executor.map(analyse_range,
+                             [file_path] * len(ranges),
+                             [start for start, _ in ranges],
+                             [end for _, end in ranges],
+                             # Tasks are pickled later, while the accumulators are merged:
+                             [copy.deepcopy(accumulators)] * len(ranges))
+        for part in parts:
+            for accumulator, other in zip(accumulators, part):
+                accumulator.merge(other)
+
+    return {accumulator.name: accumulator.finalize() for accumulator in accumulators}
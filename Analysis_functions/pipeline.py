@@ -0,0 +1,161 @@
+'''
+Pipelined pass over a fastq file.
+
+Reading, parsing and analysis of one file run in separate threads connected
+by bounded queues, so the disk (or decompression) works while the previous
+blocks are parsed and analysed:
+- the reader thread reads blocks of block_size bytes;
+- the parser thread splits them into RecordBatch objects (complete records);
+- analyzer threads run the accumulators: every analyzer has its own part of
+  the accumulators and gets every batch in the file order, so the results are
+  the same as in the serial pass.
+A full queue blocks the stage which fills it (backpressure), so at most about
+queue_depth blocks wait in every queue and the memory stays bounded.
+numpy, zlib and file reads release the GIL, so the stages run in parallel.
+An error in any stage stops all of them and is raised in the calling thread.
+'''
+import queue
+import threading
+
+from Analysis_functions import compression
+from Analysis_functions import fastq_parser
+
+DEFAULT_QUEUE_DEPTH = 4
+DEFAULT_ANALYZERS = 1
+# Seconds between checks of the stop event, while a stage waits for a queue:
+POLL_INTERVAL = 0.1
+# The item which ends a queue
+END = None
+
+
+def put(items, item, stop):
+    '''
+    Put item into the queue, waiting while it is full. Return False if the pipeline is stopped.
+    '''
+    while not stop.is_set():
+        try:
+            items.put(item, timeout=POLL_INTERVAL)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+def get(items, stop):
+    '''
+    Next item of the queue, END if the pipeline is stopped.
+    '''
+    while not stop.is_set():
+        try:
+            return items.get(timeout=POLL_INTERVAL)
+        except queue.Empty:
+            pass
+    return END
+
+
+class QueueReader:
+    '''
+    Binary stream of the blocks of the queue, for fastq_parser.iter_stream().
+    '''
+
+    def __init__(self, blocks, stop):
+        self.blocks = blocks
+        self.stop = stop
+
+    def read(self, size=-1):
+        block = get(self.blocks, self.stop)
+        return b'' if block is END else block
+
+
+def read_blocks(inf, blocks, block_size, stop):
+    '''
+    Reader stage: put blocks of the stream into the queue, then END.
+    '''
+    while True:
+        block = inf.read(block_size)
+        if not block:
+            break
+        if not put(blocks, block, stop):
+            return
+    put(blocks, END, stop)
+
+
+def parse_blocks(blocks, outputs, block_size, stop):
+    '''
+    Parser stage: put RecordBatch objects of the blocks into every output queue, then END.
+    '''
+    for batch in fastq_parser.iter_stream(QueueReader(blocks, stop), block_size):
+        for output in outputs:
+            if not put(output, batch, stop):
+                return
+    for output in outputs:
+        put(output, END, stop)
+
+
+def analyse_batches(batches, accumulators, stop):
+    '''
+    Analyzer stage: feed every batch of the queue to the accumulators.
+    '''
+    while True:
+        batch = get(batches, stop)
+        if batch is END:
+            return
+        for accumulator in accumulators:
+            accumulator.update_batch(batch)
+
+
+class Pipeline:
+    '''
+    Settings of the pipelined pass: size of blocks read and parsed at once (bytes),
+    number of blocks or batches in every queue and number of analyzer threads.
+    '''
+
+    def __init__(self, block_size=fastq_parser.BLOCK_SIZE, queue_depth=DEFAULT_QUEUE_DEPTH,
+                 analyzers=DEFAULT_ANALYZERS):
+        if block_size < 1 or queue_depth < 1 or analyzers < 1:
+            raise Exception('Block size, queue depth and number of analyzers must be positive')
+        self.block_size = block_size
+        self.queue_depth = queue_depth
+        self.analyzers = analyzers
+
+    def run_stream(self, inf, accumulators):
+        '''
+        Same as streaming.run_accumulators() for the batches of a binary stream.
+        '''
+        stop = threading.Event()
+        errors = []
+
+        def stage(target, *args):
+            try:
+                target(*args, stop)
+            except BaseException as error:
+                errors.append(error)
+                stop.set()
+
+        blocks = queue.Queue(self.queue_depth)
+        groups = [accumulators[i::self.analyzers] for i in range(min(self.analyzers, len(accumulators)))]
+        batches = [queue.Queue(self.queue_depth) for _ in groups]
+        threads = [threading.Thread(target=stage, args=(read_blocks, inf, blocks, self.block_size), daemon=True),
+                   threading.Thread(target=stage, args=(parse_blocks, blocks, batches, self.block_size), daemon=True)]
+        threads += [threading.Thread(target=stage, args=(analyse_batches, batches[i], group), daemon=True)
+                    for i, group in enumerate(groups)]
+
+        for thread in threads:
+            thread.start()
+        try:
+            for thread in threads:
+                thread.join()
+        finally:
+            stop.set()
+        if errors:
+            raise errors[0]
+
+        return {accumulator.name: accumulator.finalize() for accumulator in accumulators}
+
+    def run(self, file_path, accumulators, threads=None):
+        '''
+        Pipelined pass over a plain, gzip or BGZF file,
+        threads is the number of threads for BGZF decompression.
+        '''
+        with compression.open_fastq(file_path, threads) as inf:
+            return self.run_stream(inf, accumulators)
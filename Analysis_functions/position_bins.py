@@ -0,0 +1,143 @@
+'''
+Bins and groups of positions in reads for the per-base modules.
+
+Accumulators count their values by bins of positions, so that the memory
+does not grow with the length of the longest read. Positions below EXACT are
+counted one by one, so short reads are analysed per base. Every longer octave
+of positions [2^j, 2^(j+1)) is split into OCTAVE_BINS bins of the same width,
+which makes about 2400 bins for 50 kb reads and 3600 bins for 1 Mb reads.
+Bin widths are powers of 2, the bin of a position is found by bit shifts.
+
+For the summaries and plots the bins are joined into groups, as in FastQC,
+chosen by the length distribution (the number of bases in every bin):
+- reads up to UNGROUPED_LENGTH are shown per base;
+- if most reads are about as long as the longest one, groups have the same width,
+  so that there are at most MAX_GROUPS of them;
+- otherwise (a long tail of lengths, like nanopore reads), widths grow exponentially.
+'''
+import numpy as np
+
+EXACT_SHIFT = 10
+EXACT = 1 << EXACT_SHIFT
+OCTAVE_SHIFT = 8
+OCTAVE_BINS = 1 << OCTAVE_SHIFT
+UNGROUPED_LENGTH = 300
+MAX_GROUPS = 100
+# Exponential groups are used if the longest read is longer than LONG_TAIL median lengths
+LONG_TAIL = 4
+# Widths of fixed-width groups are these numbers multiplied by powers of 10
+WIDTH_STEPS = (1, 2, 5)
+
+
+def bin_index(positions):
+    '''
+    Bins of 0-based positions (int64 array).
+    '''
+    positions = np.asarray(positions, dtype=np.int64)
+    # floor(log2(position)) is exact for integers below 2^53:
+    octave = np.frexp(np.maximum(positions, 1))[1] - 1
+    shift = np.maximum(octave - OCTAVE_SHIFT, 0)
+    index = EXACT + (octave - EXACT_SHIFT) * OCTAVE_BINS + (positions >> shift) - OCTAVE_BINS
+    return np.where(positions < EXACT, positions, index)
+
+
+def bin_positions(positions, length):
+    '''
+    Bins of 0-based positions in reads not longer than length.
+    '''
+    return positions if length <= EXACT else bin_index(positions)
+
+
+def bins_number(length):
+    '''
+    Number of bins of positions of reads not longer than length.
+    '''
+    return int(bin_index(length - 1)) + 1 if length > 0 else 0
+
+
+def bin_starts(bins):
+    '''
+    First 0-based positions of the first bins.
+    '''
+    index = np.arange(bins, dtype=np.int64)
+    octave = EXACT_SHIFT + (index - EXACT) // OCTAVE_BINS
+    starts = (OCTAVE_BINS + (index - EXACT) % OCTAVE_BINS) << np.maximum(octave - OCTAVE_SHIFT, 0)
+    return np.where(index < EXACT, index, starts)
+
+
+def first_positions(bins):
+    '''
+    First 1-based positions of the first bins.
+    '''
+    return bin_starts(bins) + 1
+
+
+def sum_by_bins(values):
+    '''
+    Sums of per-position values in bins.
+    '''
+    if len(values) <= EXACT:
+        return values
+    return np.add.reduceat(values, bin_starts(bins_number(len(values))))
+
+
+def group_width(length):
+    '''
+    The smallest of widths 1, 2, 5, 10, 20, 50... with at most MAX_GROUPS groups in the length.
+    '''
+    scale = 1
+    while True:
+        for step in WIDTH_STEPS:
+            if -(-length // (step * scale)) <= MAX_GROUPS:
+                return step * scale
+        scale *= 10
+
+
+def groups(coverage):
+    '''
+    Indexes of the first bins of the groups for the report.
+    coverage is the number of bases in every bin.
+    '''
+    bins = len(coverage)
+    starts = bin_starts(bins + 1)
+    widths = np.diff(starts)
+    starts = starts[:-1]
+    covered = np.flatnonzero(coverage)
+    length = int(starts[covered[-1]] + widths[covered[-1]]) if len(covered) else 0
+    if length <= UNGROUPED_LENGTH:
+        return np.arange(bins)
+
+    # Average number of reads covering the positions of bins, it falls below a half at the median length:
+    depth = coverage / widths
+    shorter = np.flatnonzero(depth < depth[0] / 2)
+    median = int(starts[shorter[0]]) if len(shorter) else length
+
+    if length > LONG_TAIL * median:
+        edges = np.unique(np.round(np.geomspace(1, length + 1, MAX_GROUPS)).astype(np.int64)) - 1
+    else:
+        edges = np.arange(0, length, group_width(length))
+    group = np.searchsorted(edges, starts, side='right') - 1
+    return np.flatnonzero(np.diff(group, prepend=-1))
+
+
+def group(counts, index):
+    '''
+    Sums of counts (array or rows of a matrix) of bins in the groups.
+    '''
+    return np.add.reduceat(counts, index, axis=0) if len(index) else counts[:0]
+
+
+def grouped(positions):
+    '''
+    Whether first positions of groups are not just all positions.
+    '''
+    return not np.array_equal(positions, np.arange(1, len(positions) + 1))
+
+
+def ticks(positions, start=1, step=10):
+    '''
+    Ticks of the x axis of a plot, where groups are drawn at start, start + 1...
+    Every step-th group is labelled with its first position.
+    '''
+    index = np.arange(0, len(positions), step)
+    return index + start, [str(position) for position in np.asarray(positions)[index]]
@@ -0,0 +1,163 @@
+'''
+Profiling of modules and phases of the analysis.
+
+Every module accumulator is wrapped, so the wall time, CPU time, peak memory
+delta and number of reads of its calls are recorded. Phases of the analysis
+(the pass over the file, summaries, plots, report) are measured the same way.
+The peak memory delta is the growth of the peak resident memory of the process
+during the calls: the module which needs the most memory raises the peak.
+It is cheap enough to be measured for every batch, unlike tracing of allocations.
+One module can also be profiled with cProfile.
+'''
+import contextlib
+import cProfile
+import io
+import json
+import pstats
+import resource
+import sys
+import time
+
+from Analysis_functions import streaming
+
+# Number of functions in the text of cProfile statistics
+PROFILE_LINES = 30
+# ru_maxrss is in kilobytes on Linux and in bytes on macOS
+MAXRSS_UNIT = 1 if sys.platform == 'darwin' else 1024
+
+
+def peak_memory():
+    '''
+    Peak resident memory of this process (bytes).
+    '''
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * MAXRSS_UNIT
+
+
+def new_stats():
+    return {'wall_time': 0.0, 'cpu_time': 0.0, 'peak_memory_delta_mb': 0.0, 'reads': 0, 'calls': 0}
+
+
+def add_stats(stats, other):
+    for key in stats:
+        stats[key] += other[key]
+
+
+@contextlib.contextmanager
+def measure(stats, reads=0):
+    '''
+    Add wall time, CPU time, peak memory delta and reads of the block to stats.
+    '''
+    memory_start = peak_memory()
+    wall_start, cpu_start = time.perf_counter(), time.process_time()
+
+    try:
+        yield
+    finally:
+        stats['wall_time'] += time.perf_counter() - wall_start
+        stats['cpu_time'] += time.process_time() - cpu_start
+        stats['peak_memory_delta_mb'] += (peak_memory() - memory_start) / 2 ** 20
+        stats['reads'] += reads
+        stats['calls'] += 1
+
+
+def phase(profiler, name, reads=0):
+    '''
+    Measure a phase of the analysis, does nothing if profiler is None.
+    '''
+    if profiler is None:
+        return contextlib.nullcontext()
+    return measure(profiler.phases.setdefault(name, new_stats()), reads)
+
+
+class ProfiledAccumulator(streaming.Accumulator):
+    '''
+    Accumulator which measures the calls of the wrapped one.
+    Other attributes are taken from the wrapped accumulator.
+    '''
+
+    def __init__(self, accumulator, profile=False):
+        self.accumulator = accumulator
+        self.name = accumulator.name
+        self.stats = new_stats()
+        self.profile = cProfile.Profile() if profile else None
+
+    def __getattr__(self, name):
+        if name.startswith('__') or name == 'accumulator':
+            raise AttributeError(name)
+        return getattr(self.accumulator, name)
+
+    @contextlib.contextmanager
+    def measure(self, reads=0):
+        with measure(self.stats, reads):
+            if self.profile is None:
+                yield
+                return
+            self.profile.enable()
+            try:
+                yield
+            finally:
+                self.profile.disable()
+
+    def update_batch(self, batch):
+        with self.measure(len(batch)):
+            self.accumulator.update_batch(batch)
+
+    def merge(self, other):
+        with self.measure():
+            self.accumulator.merge(other.accumulator)
+        add_stats(self.stats, other.stats)
+
+    def finalize(self):
+        with self.measure():
+            return self.accumulator.finalize()
+
+
+class Profiler:
+    '''
+    Statistics of the wrapped accumulators and of the phases.
+    module is the name of the module profiled with cProfile.
+    '''
+
+    def __init__(self, module=None):
+        self.module = module
+        self.accumulators = []
+        self.phases = {}
+
+    def wrap(self, accumulator):
+        profiled = ProfiledAccumulator(accumulator, accumulator.name == self.module)
+        self.accumulators.append(profiled)
+        return profiled
+
+    def trace(self):
+        return {'modules': {accumulator.name: accumulator.stats for accumulator in self.accumulators},
+                'phases': self.phases}
+
+    def table(self):
+        '''
+        Rows of the timing table: (module or phase, name, wall time, CPU time, memory, reads, reads per second).
+        '''
+        rows = []
+        trace = self.trace()
+        for kind in ('modules', 'phases'):
+            for name, stats in trace[kind].items():
+                rows.append((kind[:-1], name, '%.3f' % stats['wall_time'], '%.3f' % stats['cpu_time'],
+                             '%.1f' % stats['peak_memory_delta_mb'], stats['reads'] or '-',
+                             '%.0f' % (stats['reads'] / stats['wall_time']) if stats['reads'] and stats['wall_time']
+                             else '-'))
+        return rows
+
+    def write(self, outdir, information=None):
+        '''
+        Save the trace to "outdir/profile.json" and the cProfile statistics
+        of the module to "outdir/profile_MODULE.prof" and "outdir/profile_MODULE.txt".
+        '''
+        with open(outdir + 'profile.json', 'w') as outf:
+            json.dump((information or {}) | self.trace(), outf, indent=1)
+
+        for accumulator in self.accumulators:
+            if accumulator.profile is not None:
+                accumulator.profile.dump_stats(outdir + 'profile_' + accumulator.name + '.prof')
+                text = io.StringIO()
+                pstats.Stats(accumulator.profile, stream=text).sort_stats('cumulative').print_stats(PROFILE_LINES)
+                with open(outdir + 'profile_' + accumulator.name + '.txt', 'w') as outf:
+                    outf.write(text.getvalue())
@@ -0,0 +1,175 @@
+'''
+Compact in-memory storage of fastq reads.
+
+Sequences and quality scores of all reads are kept in two concatenated
+uint8 arrays with one array of offsets, instead of a list of 4 strings
+per read. Identifiers are kept only if they are asked for,
+the '+' lines are never kept.
+
+ReadStore has the same interface as fastq_parser.RecordBatch
+(lengths, lines, concatenated, positions), so accumulators process
+its contiguous slices without copying.
+'''
+import numpy as np
+
+from Analysis_functions import fastq_parser
+
+# Number of reads in one slice passed to accumulators:
+SLICE_SIZE = 10000
+
+
+class ReadStore:
+    '''
+    Sequences and qualities of reads: read i is sequences[offsets[i]:offsets[i + 1]],
+    its quality is qualities[offsets[i]:offsets[i + 1]].
+    headers is None or a pair (concatenated identifiers, their offsets).
+    Slicing returns a ReadStore which shares the arrays.
+    '''
+
+    def __init__(self, sequences, qualities, offsets, headers=None):
+        self.sequences = sequences
+        self.qualities = qualities
+        self.offsets = offsets
+        self.headers = headers
+
+    @classmethod
+    def from_batches(cls, batches, headers=False):
+        '''
+        Copy sequences and qualities (and identifiers if headers is True) from RecordBatch objects.
+        '''
+        sequences, qualities, lengths = [], [], []
+        header_lines, header_lengths = [], []
+
+        for batch in batches:
+            sequence, length = batch.concatenated(fastq_parser.SEQUENCE)
+            quality, quality_length = batch.concatenated(fastq_parser.QUALITY)
+            if not np.array_equal(length, quality_length):
+                raise Exception('Sequence and quality lengths differ')
+            sequences.append(sequence)
+            qualities.append(quality)
+            lengths.append(length)
+
+            if headers:
+                header, header_length = batch.concatenated(fastq_parser.HEADER)
+                header_lines.append(header)
+                header_lengths.append(header_length)
+
+        offsets = concatenate_offsets(lengths)
+        if headers:
+            headers = (concatenate(header_lines), concatenate_offsets(header_lengths))
+        else:
+            headers = None
+
+        return cls(concatenate(sequences), concatenate(qualities), offsets, headers)
+
+    @classmethod
+    def from_file(cls, file_path, headers=False, threads=None):
+        return cls.from_batches(fastq_parser.iter_batches(file_path, threads), headers)
+
+    @classmethod
+    def from_records(cls, records, headers=False):
+        '''
+        Build store from records (lists of 4 bytes or strings).
+        '''
+        records = list(records)
+        batches = (fastq_parser.RecordBatch.from_records(records[i:i + SLICE_SIZE])
+                   for i in range(0, len(records), SLICE_SIZE))
+        return cls.from_batches(batches, headers)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        '''
+        Slice of reads as ReadStore, or one record as a tuple of 4 bytes objects
+        (identifier is empty if it is not stored).
+        '''
+        if isinstance(i, slice):
+            start, stop, step = i.indices(len(self))
+            if step != 1:
+                raise Exception('ReadStore supports only contiguous slices')
+            stop = max(start, stop)
+            headers = None
+            if self.headers is not None:
+                headers = (self.headers[0], self.headers[1][start:stop + 1])
+            return ReadStore(self.sequences, self.qualities, self.offsets[start:stop + 1], headers)
+
+        if i < 0:
+            i += len(self)
+        start, end = int(self.offsets[i]), int(self.offsets[i + 1])
+        header = b''
+        if self.headers is not None:
+            header = self.headers[0][self.headers[1][i]:self.headers[1][i + 1]].tobytes()
+        return header, self.sequences[start:end].tobytes(), b'+', self.qualities[start:end].tobytes()
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    @property
+    def nbytes(self):
+        '''
+        Memory taken by the arrays of this store.
+        '''
+        size = self.sequences.nbytes + self.qualities.nbytes + self.offsets.nbytes
+        if self.headers is not None:
+            size += self.headers[0].nbytes + self.headers[1].nbytes
+        return size
+
+    def field(self, field):
+        '''
+        Buffer and offsets of one line of the records.
+        '''
+        if field == fastq_parser.SEQUENCE:
+            return self.sequences, self.offsets
+        if field == fastq_parser.QUALITY:
+            return self.qualities, self.offsets
+        if field == fastq_parser.HEADER and self.headers is not None:
+            return self.headers
+        raise Exception('Line %s of records is not stored' % field)
+
+    def lengths(self, field=fastq_parser.SEQUENCE):
+        return np.diff(self.field(field)[1])
+
+    def lines(self, field=fastq_parser.SEQUENCE):
+        '''
+        List of bytes objects of one line of every read.
+        '''
+        data, offsets = self.field(field)
+        data = data[offsets[0]:offsets[-1]].tobytes()
+        bounds = (offsets - offsets[0]).tolist()
+        return [data[start:end] for start, end in zip(bounds[:-1], bounds[1:])]
+
+    def concatenated(self, field=fastq_parser.SEQUENCE):
+        '''
+        One line of all reads as one uint8 array (a view, not a copy) and lengths of lines.
+        '''
+        data, offsets = self.field(field)
+        return data[offsets[0]:offsets[-1]], np.diff(offsets)
+
+    def positions(self, field=fastq_parser.SEQUENCE):
+        '''
+        Position inside the line for every symbol of concatenated().
+        '''
+        offsets = self.field(field)[1]
+        lengths = np.diff(offsets)
+        return np.arange(offsets[-1] - offsets[0]) - np.repeat(offsets[:-1] - offsets[0], lengths)
+
+    def slices(self, size=SLICE_SIZE):
+        '''
+        Generator of contiguous slices of size reads.
+        '''
+        for i in range(0, len(self), size):
+            yield self[i:i + size]
+
+
+def concatenate(arrays):
+    return np.concatenate(arrays) if arrays else np.zeros(0, dtype=np.uint8)
+
+
+def concatenate_offsets(lengths):
+    '''
+    Offsets of lines in the concatenated buffer from lists of arrays of their lengths.
+    '''
+    lengths = np.concatenate(lengths) if lengths else np.zeros(0, dtype=np.int64)
+    return np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)
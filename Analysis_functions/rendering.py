@@ -0,0 +1,43 @@
+'''
+Drawing of module plots from their summaries.
+
+A summary is a small dictionary with the check status and the data of the plot,
+its size does not depend on the number of reads. The plots are independent,
+so they are drawn concurrently in a pool of processes with the Agg backend.
+matplotlib is imported only by the render functions, so the analysis
+without plots (--no-plots) does not load it.
+'''
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+
+def use_agg():
+    '''
+    Non-interactive backend: plots are only saved to files.
+    '''
+    import matplotlib
+
+    matplotlib.use('Agg')
+
+
+def render_plots(plots, processes=None):
+    '''
+    Draw plots, plots is a list of (render function, summary, output directory).
+    Every render function takes the summary and the output directory.
+    processes is the size of the pool, by default one process per plot
+    (at most the number of CPUs). With one process plots are drawn in this process.
+    '''
+    if processes is None:
+        processes = min(len(plots), os.cpu_count() or 1)
+
+    if processes <= 1:
+        use_agg()
+        for render, summary, outdir in plots:
+            render(summary, outdir)
+        return
+
+    with ProcessPoolExecutor(max_workers=processes, initializer=use_agg) as executor:
+        futures = [executor.submit(render, summary, outdir) for render, summary, outdir in plots]
+        for future in futures:
+            # Raise the exceptions of the workers:
+            future.result()
@@ -0,0 +1,119 @@
+'''
+Cache of module results between runs.
+
+For every module the finalized result of its accumulator is saved in the cache
+directory. The key is made of the Vagus version, the module name and parameters,
+and the input file identity: size, modification time and a hash of several
+blocks of the content. So a rerun on an unchanged file does not parse it.
+The checks are calculated from the results on every run, so changed thresholds
+are applied at once. The files drawn by a module are cached by the content of
+its summary and the source of its render function: plots are drawn again only
+if the summary (or the drawing) has changed.
+The least recently used entries are deleted when the cache is larger than its limit.
+'''
+import hashlib
+import inspect
+import logging
+import os
+import pickle
+
+VERSION = '0.4'
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'vagus')
+DEFAULT_CACHE_SIZE = 1 << 30
+# The content hash reads HASH_BLOCKS blocks of HASH_BLOCK_SIZE bytes evenly spaced in the file
+HASH_BLOCKS = 16
+HASH_BLOCK_SIZE = 1 << 16
+
+
+def file_fingerprint(file_path):
+    '''
+    Fast identity of the file: size, modification time and hash of sampled blocks.
+    '''
+    status = os.stat(file_path)
+    digest = hashlib.blake2b(str((status.st_size, status.st_mtime_ns)).encode(), digest_size=16)
+
+    with open(file_path, 'rb') as inf:
+        step = max(status.st_size // HASH_BLOCKS, HASH_BLOCK_SIZE)
+        for offset in range(0, status.st_size, step):
+            inf.seek(offset)
+            digest.update(inf.read(HASH_BLOCK_SIZE))
+        # The end of the file, where appended data is:
+        inf.seek(max(status.st_size - HASH_BLOCK_SIZE, 0))
+        digest.update(inf.read(HASH_BLOCK_SIZE))
+
+    return digest.hexdigest()
+
+
+class ResultCache:
+    '''
+    Directory of pickled entries, {'result': ...} for module results and
+    {'files': {file name: bytes}} for plots, one file per key.
+    Access time is kept as the modification time of the entry.
+    '''
+
+    def __init__(self, directory=DEFAULT_CACHE_DIR, max_size=DEFAULT_CACHE_SIZE):
+        self.directory = directory
+        self.max_size = max_size
+
+    def key(self, fingerprint, name, parameters=None):
+        data = repr((VERSION, fingerprint, name, parameters)).encode()
+        return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+    def plot_key(self, name, summary, render):
+        '''
+        Key of the files drawn by render from the summary of the module.
+        '''
+        digest = hashlib.blake2b(repr((VERSION, name)).encode(), digest_size=16)
+        digest.update(pickle.dumps(summary, protocol=pickle.HIGHEST_PROTOCOL))
+        digest.update(inspect.getsource(render).encode())
+        return digest.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key + '.pkl')
+
+    def get(self, key):
+        '''
+        Return the entry or None if there is no such key.
+        '''
+        path = self.path(key)
+        try:
+            with open(path, 'rb') as inf:
+                entry = pickle.load(inf)
+        except FileNotFoundError:
+            return None
+        except Exception as error:
+            logging.warning('cache entry %s is broken: %s', path, error)
+            return None
+
+        os.utime(path)
+        return entry
+
+    def put(self, key, entry):
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.path(key)
+        # Entries are written by several processes in batch mode, so the file is replaced atomically:
+        temporary_path = '%s.%s.tmp' % (path, os.getpid())
+        with open(temporary_path, 'wb') as outf:
+            pickle.dump(entry, outf, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temporary_path, path)
+        self.evict()
+
+    def evict(self):
+        '''
+        Delete the least recently used entries while the cache is larger than max_size.
+        '''
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith('.pkl'):
+                status = entry.stat()
+                entries.append((status.st_mtime, status.st_size, entry.path))
+
+        size = sum(entry_size for _, entry_size, _ in entries)
+        for _, entry_size, path in sorted(entries):
+            if size <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            size -= entry_size
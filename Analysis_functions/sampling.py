@@ -0,0 +1,139 @@
+'''
+Random sample of reads for a fast approximate report.
+
+Plain files are not read completely: random byte offsets are chosen in the file
+and the first record after every offset is taken (the same resynchronization
+as for the split of the file between processes). The chance of a record
+to be taken is proportional to the size of the previous record, so if
+neighbouring records are independent, it is a uniform sample of reads.
+Compressed files can not be read from random offsets, they are decompressed
+completely and records are sampled with reservoir sampling.
+'''
+import logging
+import os
+
+import numpy as np
+
+from Analysis_functions import compression
+from Analysis_functions import fastq_parser
+from Analysis_functions import parallel
+
+# Number of records used to estimate the average record size
+PILOT_SIZE = 1000
+# If the sample is larger than this fraction of the file, the whole file is analysed
+MAX_FRACTION = 0.5
+# Number of rounds of additional offsets when offsets hit the same records
+MAX_ROUNDS = 10
+
+
+def read_record(inf, offset):
+    '''
+    Start and lines of the first record at or after offset, (None, None) if there is no one.
+    '''
+    start = parallel.find_record_start(inf, offset)
+    inf.seek(start)
+    lines = [inf.readline() for _ in range(4)]
+    if not parallel.is_record_start(lines):
+        return None, None
+    return start, tuple(line.rstrip(b'\r\n') for line in lines)
+
+
+def sample_offsets(inf, offsets, records):
+    '''
+    Add records after the offsets to the dictionary records {start: record}.
+    '''
+    for offset in np.sort(offsets).tolist():
+        start, record = read_record(inf, offset)
+        if start is not None:
+            records[start] = record
+
+
+def sample_plain(file_path, size, fraction, rng):
+    '''
+    Sample records of a plain file by random offsets.
+    Return list of records and estimated number of reads in the file,
+    or (None, None) if the sample would be a large part of the file.
+    '''
+    file_size = os.path.getsize(file_path)
+    records = {}
+
+    with open(file_path, 'rb') as inf:
+        sample_offsets(inf, rng.integers(0, file_size, PILOT_SIZE), records)
+        if not records:
+            return None, None
+
+        record_size = np.mean([sum(map(len, record)) + 4 for record in records.values()])
+        total_number = file_size / record_size
+        if size is None:
+            size = max(1, round(fraction * total_number))
+
+        if size > MAX_FRACTION * total_number:
+            return None, None
+
+        for _ in range(MAX_ROUNDS):
+            if len(records) >= size:
+                break
+            sample_offsets(inf, rng.integers(0, file_size, size - len(records)), records)
+
+    starts = sorted(records)
+    if len(starts) > size:
+        starts = sorted(rng.choice(starts, size, replace=False).tolist())
+    return [records[start] for start in starts], round(total_number)
+
+
+def sample_stream(file_path, size, fraction, rng, threads=None):
+    '''
+    Sample records of a compressed file: size records with reservoir sampling,
+    or every record with the probability fraction.
+    Return list of records and the number of reads in the file.
+    '''
+    sample = []
+    seen = 0
+
+    for batch in fastq_parser.iter_batches(file_path, threads):
+        if size is None:
+            sample.extend(batch[i] for i in np.flatnonzero(rng.random(len(batch)) < fraction).tolist())
+        else:
+            # Slot of every record in the reservoir, records with slot >= size are skipped:
+            indexes = seen + np.arange(len(batch))
+            slots = np.where(indexes < size, indexes, rng.integers(0, indexes + 1))
+            for i in np.flatnonzero(slots < size).tolist():
+                if slots[i] < len(sample):
+                    sample[slots[i]] = batch[i]
+                else:
+                    sample.append(batch[i])
+        seen += len(batch)
+
+    return sample, seen
+
+
+def sample_records(file_path, size=None, fraction=None, seed=None, threads=None):
+    '''
+    Random sample of size records or of the fraction of records.
+    Return list of records (tuples of 4 bytes objects) and the (estimated) number of reads in the file.
+    If the sample would be a large part of a plain file, records are None:
+    the whole file should be analysed.
+    '''
+    if (size is None) == (fraction is None):
+        raise Exception('Either sample size or sample fraction must be given')
+
+    rng = np.random.default_rng(seed)
+
+    if compression.detect_compression(file_path) is not None:
+        logging.info('compressed input is decompressed completely for sampling')
+        return sample_stream(file_path, size, fraction, rng, threads)
+
+    return sample_plain(file_path, size, fraction, rng)
+
+
+def wilson_interval(successes, trials, z=1.96):
+    '''
+    Wilson score interval of binomial proportions (arrays are supported).
+    '''
+    successes = np.asarray(successes, dtype=np.float64)
+    trials = np.asarray(trials, dtype=np.float64)
+    p = successes / trials
+    denominator = 1 + z ** 2 / trials
+    center = (p + z ** 2 / (2 * trials)) / denominator
+    half_width = z * np.sqrt(p * (1 - p) / trials + z ** 2 / (4 * trials ** 2)) / denominator
+    return center - half_width, center + half_width
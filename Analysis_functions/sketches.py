@@ -0,0 +1,175 @@
+'''
+Bounded-memory summaries of large sets of sequences.
+
+Sequences are identified by a stable 64-bit fingerprint (blake2b),
+so the summaries calculated in different processes can be merged.
+'''
+import hashlib
+import math
+
+import numpy as np
+
+
+def fingerprint(sequence):
+    '''
+    64-bit fingerprint of a sequence (bytes or string), the same in all processes.
+    '''
+    if isinstance(sequence, str):
+        sequence = sequence.encode()
+    return int.from_bytes(hashlib.blake2b(sequence, digest_size=8).digest(), 'little')
+
+
+def leading_zeros(values):
+    '''
+    Number of leading zero bits of each element of uint64 array.
+    '''
+    values = values.copy()
+    zeros = np.zeros(len(values), dtype=np.int64)
+    for shift in (32, 16, 8, 4, 2, 1):
+        mask = (values >> np.uint64(64 - shift)) == 0
+        zeros += shift * mask
+        values[mask] <<= np.uint64(shift)
+    zeros[values == 0] = 64
+    return zeros
+
+
+class HyperLogLog:
+    '''
+    HyperLogLog estimator of the number of distinct fingerprints.
+    With precision p there are 2^p registers and the relative
+    standard error is 1.04 / sqrt(2^p).
+    '''
+
+    def __init__(self, precision=14):
+        self.precision = precision
+        self.registers = np.zeros(1 << precision, dtype=np.uint8)
+
+    def update(self, fingerprints):
+        fingerprints = np.asarray(fingerprints, dtype=np.uint64)
+        index = (fingerprints >> np.uint64(64 - self.precision)).astype(np.int64)
+        rest = fingerprints << np.uint64(self.precision)
+        rank = np.minimum(leading_zeros(rest) + 1, 64 - self.precision + 1).astype(np.uint8)
+        np.maximum.at(self.registers, index, rank)
+
+    def merge(self, other):
+        np.maximum(self.registers, other.registers, out=self.registers)
+
+    def relative_error(self):
+        return 1.04 / math.sqrt(len(self.registers))
+
+    def count(self):
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / np.sum(np.ldexp(1.0, -self.registers.astype(np.int64)))
+
+        # Linear counting for small cardinalities:
+        empty = np.count_nonzero(self.registers == 0)
+        if estimate <= 2.5 * m and empty:
+            estimate = m * math.log(m / empty)
+
+        return estimate
+
+
+class DistinctSample:
+    '''
+    Exact counts for a uniform sample of distinct sequences.
+    A sequence is tracked if the top 'level' bits of its fingerprint are zero,
+    so each distinct sequence is sampled with probability 2^-level
+    independently of how many times it occurs, and all its occurrences are counted.
+    When more than 'limit' sequences are tracked, the level is increased
+    and the half of sequences is dropped. Samples are merged exactly.
+    '''
+
+    def __init__(self, limit=100000):
+        self.limit = limit
+        self.level = 0
+        self.counts = {}
+
+    def sampled(self, fingerprint):
+        return fingerprint >> (64 - self.level) == 0 if self.level else True
+
+    def add(self, fingerprint, count=1):
+        if self.sampled(fingerprint):
+            self.counts[fingerprint] = self.counts.get(fingerprint, 0) + count
+            if len(self.counts) > self.limit:
+                self.shrink(self.level + 1)
+
+    def shrink(self, level):
+        self.level = level
+        self.counts = {key: count for key, count in self.counts.items() if self.sampled(key)}
+        if len(self.counts) > self.limit:
+            self.shrink(self.level + 1)
+
+    def merge(self, other):
+        if other.level > self.level:
+            self.shrink(other.level)
+        for key, count in other.counts.items():
+            self.add(key, count)
+
+    def sampling_rate(self):
+        return 2.0 ** -self.level
+
+
+class MisraGries:
+    '''
+    Misra-Gries summary of frequent items with at most 'capacity' counters.
+    Counts are lower bounds, the true count of any item is at most
+    count + error, and error <= total / (capacity + 1).
+    So every item more frequent than total / (capacity + 1) is kept (guaranteed recall).
+    Items are added by batches, summaries are mergeable.
+    '''
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.counts = {}
+        self.error = 0
+
+    def update(self, counter):
+        '''
+        Add dictionary {item: count}, for example Counter of a batch.
+        '''
+        for item, count in counter.items():
+            self.counts[item] = self.counts.get(item, 0) + count
+        self.prune()
+
+    def merge(self, other):
+        self.error += other.error
+        self.update(other.counts)
+
+    def prune(self):
+        if len(self.counts) <= self.capacity:
+            return
+        # Subtract the (capacity + 1)-th largest count from all counters:
+        values = np.fromiter(self.counts.values(), dtype=np.int64, count=len(self.counts))
+        decrement = int(np.partition(values, len(values) - self.capacity - 1)[len(values) - self.capacity - 1])
+        self.error += decrement
+        self.counts = {item: count - decrement for item, count in self.counts.items() if count > decrement}
+
+
+class CountMinSketch:
+    '''
+    Count-Min sketch over 64-bit fingerprints: 4 rows of 2^16 counters,
+    row indexes are the four 16-bit parts of the fingerprint.
+    Estimates are upper bounds of the true counts.
+    '''
+    depth = 4
+    width_bits = 16
+
+    def __init__(self):
+        self.table = np.zeros((self.depth, 1 << self.width_bits), dtype=np.uint64)
+
+    def indexes(self, fingerprints):
+        fingerprints = np.asarray(fingerprints, dtype=np.uint64)
+        mask = np.uint64((1 << self.width_bits) - 1)
+        return [((fingerprints >> np.uint64(self.width_bits * row)) & mask).astype(np.int64)
+                for row in range(self.depth)]
+
+    def update(self, fingerprints):
+        for row, index in enumerate(self.indexes(fingerprints)):
+            self.table[row] += np.bincount(index, minlength=self.table.shape[1]).astype(np.uint64)
+
+    def merge(self, other):
+        self.table += other.table
+
+    def estimate(self, fingerprints):
+        return np.min([self.table[row][index] for row, index in enumerate(self.indexes(fingerprints))], axis=0)
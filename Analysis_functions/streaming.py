@@ -0,0 +1,103 @@
+'''
+Single-pass analysis engine.
+
+Every module is an accumulator: it receives each batch of fastq records
+once through update_batch() and returns its collected data with finalize().
+Batches come from a generator reader, so the whole file never has
+to be held in memory.
+'''
+import numpy as np
+
+from Analysis_functions import fastq_parser
+from Analysis_functions import read_store
+
+# Number of records in batches made from lists of records:
+BATCH_SIZE = 10000
+
+
+class Accumulator:
+    '''
+    Base class for all module accumulators.
+    A record is a tuple of 4 bytes objects
+    (identifier, read sequence, plus, and quality score sequence),
+    a batch is fastq_parser.RecordBatch.
+    '''
+    name = None
+
+    def update(self, record):
+        raise NotImplementedError
+
+    def update_batch(self, batch):
+        '''
+        Process a batch of records at once.
+        Accumulators with vectorized calculations override it.
+        '''
+        for record in batch:
+            self.update(record)
+
+    def merge(self, other):
+        '''
+        Add the data of other accumulator of the same type
+        (calculated on another part of the file) to this one.
+        '''
+        raise NotImplementedError
+
+    def finalize(self):
+        raise NotImplementedError
+
+
+def add_arrays(first, second):
+    '''
+    Element-wise sum of two arrays of counts with possibly different lengths.
+    '''
+    if len(first) < len(second):
+        first, second = second, first
+    result = np.array(first, copy=True)
+    result[:len(second)] += second
+    return result
+
+
+def iter_records(file_path, threads=None):
+    '''
+    Generator that yields fastq records one by one.
+    Each record is a tuple of 4 bytes objects, as in read_file().
+    threads is the number of threads for BGZF decompression.
+    '''
+    for batch in fastq_parser.iter_batches(file_path, threads):
+        yield from batch
+
+
+def iter_batches(records, batch_size=BATCH_SIZE):
+    '''
+    Split list of records into batches of batch_size records.
+    '''
+    for i in range(0, len(records), batch_size):
+        yield fastq_parser.RecordBatch.from_records(records[i:i + batch_size])
+
+
+def accumulate(records, accumulator):
+    '''
+    Feed all records to one accumulator and return its result.
+    Used by the module functions that take a parsed file:
+    a ReadStore (processed by contiguous slices) or a list of records.
+    '''
+    if isinstance(records, read_store.ReadStore):
+        batches = records.slices()
+    else:
+        batches = iter_batches(list(records))
+
+    for batch in batches:
+        accumulator.update_batch(batch)
+    return accumulator.finalize()
+
+
+def run_accumulators(batches, accumulators):
+    '''
+    Pass over the batches of records once, feeding every batch to every accumulator.
+    Return dictionary {accumulator name: finalized result}.
+    '''
+    for batch in batches:
+        for accumulator in accumulators:
+            accumulator.update_batch(batch)
+
+    return {accumulator.name: accumulator.finalize() for accumulator in accumulators}
@@ -0,0 +1,248 @@
+'''
+Benchmarks of the module accumulators and of the whole report.
+
+Every module is run alone over the same file (parsing included) in a new process,
+so its peak resident memory is not mixed with other modules. The 'parse' entry
+is the parsing without modules: the difference with it is the cost of the module.
+Peak memory includes the pages of the memory-mapped input file.
+The end-to-end 'generate' command is run as a separate program (its pool of plot
+processes is not included in the memory, which is measured only on Linux). Results are written as JSON
+and can be compared between commits.
+
+Run from the repository root:
+python -m benchmarks.run_benchmarks run -o new.json --reads 1000000
+python -m benchmarks.run_benchmarks compare old.json new.json
+'''
+import datetime
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import List
+
+import numpy as np
+import typer
+
+from Analysis_functions import fastq_parser
+from benchmarks import synthetic_fastq
+
+REPOSITORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PARSE = 'parse'
+# Peak memory of the process on Linux (resource usage keeps the peak of the parent process after fork)
+PROC_STATUS = '/proc/self/status'
+# Runs parsing_report.py as the main program and writes its peak memory (kb) to a file at exit
+GENERATE_WRAPPER = '''
+import atexit, runpy, sys
+
+def write_peak_rss(path):
+    with open('/proc/self/status') as inf, open(path, 'w') as outf:
+        outf.write(next(line.split()[1] for line in inf if line.startswith('VmHWM')))
+
+atexit.register(write_peak_rss, sys.argv.pop(1))
+sys.argv[0] = 'parsing_report.py'
+runpy.run_path('parsing_report.py', run_name='__main__')
+'''
+
+app = typer.Typer()
+
+
+def peak_rss():
+    '''
+    Peak resident memory of this process (Mb).
+    '''
+    if os.path.exists(PROC_STATUS):
+        with open(PROC_STATUS) as inf:
+            return next(int(line.split()[1]) for line in inf if line.startswith('VmHWM')) / 1024
+    # Kilobytes on Linux, bytes on macOS:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1 << 20 if sys.platform == 'darwin' else 1 << 10)
+
+
+def module_functions():
+    '''
+    Dictionary {module name: (accumulator class, summary function or None)}.
+    '''
+    import parsing_report
+    from Analysis_functions import FastQC_B
+
+    modules = {accumulator.name: (accumulator, summarize) for _, accumulator, summarize, _, _ in parsing_report.MODULES}
+    modules[FastQC_B.BasicStatisticsAccumulator.name] = (FastQC_B.BasicStatisticsAccumulator, None)
+    return modules
+
+
+def benchmark_module(file_path, name, repeats):
+    '''
+    Run one module (or only the parser for 'parse') repeats times over the file.
+    It is called in a new process.
+    '''
+    accumulator_class, summarize = module_functions()[name] if name != PARSE else (None, None)
+    baseline = peak_rss()
+    times = []
+
+    for _ in range(repeats):
+        accumulator = accumulator_class() if accumulator_class else None
+        reads = 0
+        start = time.perf_counter()
+        for batch in fastq_parser.iter_batches(file_path):
+            if accumulator:
+                accumulator.update_batch(batch)
+            reads += len(batch)
+        if accumulator:
+            result = accumulator.finalize()
+            if summarize:
+                summarize(result)
+        times.append(time.perf_counter() - start)
+
+    return {'wall_time': min(times),
+            'times': times,
+            'reads': reads,
+            'reads_per_second': reads / min(times),
+            'peak_rss_mb': peak_rss(),
+            'baseline_rss_mb': baseline}
+
+
+def benchmark_generate(file_path, repeats, threads=1):
+    '''
+    Run the 'generate' command on the file repeats times, without the result cache.
+    The peak memory is measured only on Linux.
+    '''
+    times = []
+    rss = []
+    for _ in range(repeats):
+        with tempfile.TemporaryDirectory() as outdir:
+            arguments = ['generate', '-i', file_path, '-o', outdir + '/', '--no-cache', '--threads', str(threads),
+                         '--log-level', 'warning']
+            peak_file = os.path.join(outdir, 'peak_rss')
+            if os.path.exists(PROC_STATUS):
+                command = [sys.executable, '-c', GENERATE_WRAPPER, peak_file] + arguments
+            else:
+                command = [sys.executable, 'parsing_report.py'] + arguments
+
+            start = time.perf_counter()
+            subprocess.run(command, cwd=REPOSITORY, check=True)
+            times.append(time.perf_counter() - start)
+            if os.path.exists(peak_file):
+                with open(peak_file) as inf:
+                    rss.append(int(inf.read()) / 1024)
+
+    reads = sum(len(batch) for batch in fastq_parser.iter_batches(file_path))
+    return {'wall_time': min(times),
+            'times': times,
+            'reads': reads,
+            'reads_per_second': reads / min(times),
+            'peak_rss_mb': max(rss, default=None),
+            'threads': threads}
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=REPOSITORY, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def memory_text(megabytes):
+    return '-' if megabytes is None else '%.1f' % megabytes
+
+
+def run_benchmarks(file_path, names, repeats, end_to_end=True, threads=1):
+    '''
+    Return dictionary of results of modules and of the 'generate' command.
+    '''
+    modules = {}
+    for name in names:
+        # A new process for every module, so the peak memory is its own:
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as executor:
+            modules[name] = executor.submit(benchmark_module, file_path, name, repeats).result()
+    results = {'modules': modules}
+    if end_to_end:
+        results['generate'] = benchmark_generate(file_path, repeats, threads)
+
+    for name, entry in list(modules.items()) + [('generate', results.get('generate'))]:
+        if entry is not None:
+            typer.echo('%-30s %8.3f s %12.0f reads/s %8s Mb' % (name, entry['wall_time'], entry['reads_per_second'],
+                                                                memory_text(entry['peak_rss_mb'])))
+    return results
+
+
+@app.command()
+def run(output: str = typer.Option(..., "--output", "-o", help="Path to the JSON file with results"),
+        input: str = typer.Option(None, "--input", "-i",
+                                  help="Existing fastq file (by default a synthetic file is generated)"),
+        module: List[str] = typer.Option(None, "--module", "-m",
+                                         help="Module to benchmark (can be repeated, all modules by default)"),
+        repeats: int = typer.Option(3, min=1, help="Number of runs, the best time is used"),
+        end_to_end: bool = typer.Option(True, help="Also benchmark the 'generate' command"),
+        threads: int = typer.Option(1, min=1, help="Number of processes of the 'generate' command"),
+        reads: int = typer.Option(200000, min=1, help="Number of reads of the synthetic file"),
+        length_mean: float = typer.Option(150, help="Mean read length of the synthetic file"),
+        length_sd: float = typer.Option(0, min=0, help="Standard deviation of read lengths"),
+        n_rate: float = typer.Option(0.001, min=0, max=1, help="Fraction of N bases"),
+        adapter_rate: float = typer.Option(0.05, min=0, max=1, help="Fraction of reads with adapter"),
+        duplication_rate: float = typer.Option(0.1, min=0, max=1, help="Fraction of duplicated reads"),
+        seed: int = typer.Option(0, help="Seed of the synthetic file")):
+    names = list(module or []) or [PARSE] + list(module_functions())
+    unknown = set(names) - {PARSE} - set(module_functions())
+    if unknown:
+        raise Exception('Unknown modules: ' + ', '.join(sorted(unknown)))
+
+    with tempfile.TemporaryDirectory() as directory:
+        generator = None
+        if input is None:
+            generator = {'reads': reads, 'length_mean': length_mean, 'length_sd': length_sd, 'n_rate': n_rate,
+                         'adapter_rate': adapter_rate, 'duplication_rate': duplication_rate, 'seed': seed}
+            input = os.path.join(directory, 'synthetic.fastq')
+            synthetic_fastq.generate_fastq(input, **generator)
+        input = os.path.abspath(input)
+
+        results = {'date': datetime.datetime.now().isoformat(timespec='seconds'),
+                   'commit': git_commit(),
+                   'python': platform.python_version(),
+                   'numpy': np.__version__,
+                   'platform': platform.platform(),
+                   'cpus': os.cpu_count(),
+                   'input': {'path': None if generator else input,
+                             'size': os.path.getsize(input),
+                             'generator': generator},
+                   'repeats': repeats}
+        results |= run_benchmarks(input, names, repeats, end_to_end, threads)
+
+    with open(output, 'w') as outf:
+        json.dump(results, outf, indent=1)
+    typer.echo('results written to ' + output)
+
+
+@app.command()
+def compare(old: str = typer.Argument(..., help="JSON results of the base commit"),
+            new: str = typer.Argument(..., help="JSON results of the new commit")):
+    '''
+    Print time and memory of the benchmarks in two result files.
+    '''
+    with open(old) as inf:
+        old_results = json.load(inf)
+    with open(new) as inf:
+        new_results = json.load(inf)
+
+    if old_results['input'] != new_results['input']:
+        typer.echo('Warning: the results are for different input files')
+
+    old_entries = old_results['modules'] | ({'generate': old_results['generate']} if 'generate' in old_results else {})
+    new_entries = new_results['modules'] | ({'generate': new_results['generate']} if 'generate' in new_results else {})
+
+    typer.echo('%-30s %10s %10s %8s %10s %10s' % ('', 'old, s', 'new, s', 'speedup', 'old, Mb', 'new, Mb'))
+    for name in [name for name in new_entries if name in old_entries]:
+        old_entry, new_entry = old_entries[name], new_entries[name]
+        speedup = old_entry['wall_time'] / new_entry['wall_time']
+        values = (name, old_entry['wall_time'], new_entry['wall_time'], speedup,
+                  memory_text(old_entry['peak_rss_mb']), memory_text(new_entry['peak_rss_mb']))
+        typer.echo('%-30s %10.3f %10.3f %7.2fx %10s %10s' % values)
+
+
+if __name__ == '__main__':
+    app()
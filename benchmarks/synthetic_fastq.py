@@ -0,0 +1,121 @@
+'''
+Deterministic synthetic fastq files for benchmarks.
+
+The same seed and parameters always give the same file. Reads have normally
+distributed lengths, random bases with a given rate of N, qualities which fall
+along the read, adapter read-through (the adapter starts at a random position
+and goes to the end of the read) and exact duplicates of earlier reads.
+
+Run from the repository root:
+python -m benchmarks.synthetic_fastq -o reads.fastq --reads 1000000
+'''
+import gzip
+
+import numpy as np
+import typer
+
+from Analysis_functions import fastqc
+
+BASES = np.frombuffer(b'ACGT', dtype=np.uint8)
+N_SYMBOL = ord('N')
+# Reads are generated by chunks of this number of reads
+CHUNK_SIZE = 100000
+DEFAULT_ADAPTER = fastqc.ADAPTERS['Illumina Universal Adapter']
+
+
+def chunk_reads(rng, number, length_mean, length_sd, min_length, max_length, n_rate, adapter_rate, adapter):
+    '''
+    Sequences and qualities (lists of bytes) of number new reads without duplicates.
+    '''
+    lengths = np.clip(np.round(rng.normal(length_mean, length_sd, number)), min_length, max_length).astype(np.int64)
+    total = int(lengths.sum())
+    starts = np.cumsum(lengths) - lengths
+    positions = np.arange(total) - np.repeat(starts, lengths)
+
+    symbols = BASES[rng.integers(0, 4, total)]
+    symbols[rng.random(total) < n_rate] = N_SYMBOL
+
+    # Adapter read-through: the adapter replaces the end of the read from a random position
+    adapter = np.frombuffer(adapter, dtype=np.uint8)
+    adapter_starts = np.where(rng.random(number) < adapter_rate,
+                              rng.integers(0, np.maximum(lengths, 1)), lengths)
+    shifts = positions - np.repeat(adapter_starts, lengths)
+    in_adapter = (shifts >= 0) & (shifts < len(adapter))
+    symbols[in_adapter] = adapter[shifts[in_adapter]]
+
+    # Mean quality falls from 38 to 25 along the read, Phred+33:
+    mean_quality = 38 - 13 * positions / max(max_length - 1, 1)
+    qualities = np.clip(np.round(rng.normal(mean_quality, 3)), 2, 41).astype(np.uint8) + 33
+
+    symbols, qualities = symbols.tobytes(), qualities.tobytes()
+    bounds = list(zip(starts.tolist(), (starts + lengths).tolist()))
+    return [symbols[start:end] for start, end in bounds], [qualities[start:end] for start, end in bounds]
+
+
+def generate_fastq(file_path, reads=100000, length_mean=150, length_sd=0, min_length=20, max_length=None,
+                   n_rate=0.001, adapter_rate=0.05, duplication_rate=0.1, adapter=DEFAULT_ADAPTER, seed=0):
+    '''
+    Write a synthetic fastq file (gzip compressed if the name ends with .gz).
+    length_sd is the standard deviation of read lengths (0 for reads of the same length),
+    lengths are limited by min_length and max_length (by default twice the mean).
+    n_rate is the fraction of N bases, adapter_rate and duplication_rate
+    are the fractions of reads with an adapter and of exact copies of earlier reads.
+    Return the number of bytes of the (uncompressed) file.
+    '''
+    if max_length is None:
+        max_length = 2 * length_mean
+    rng = np.random.default_rng(seed)
+    adapter = adapter.encode() if isinstance(adapter, str) else adapter
+    opener = gzip.open if str(file_path).endswith('.gz') else open
+    written = 0
+    previous = []
+
+    with opener(file_path, 'wb') as outf:
+        for chunk_start in range(0, reads, CHUNK_SIZE):
+            number = min(CHUNK_SIZE, reads - chunk_start)
+            sequences, qualities = chunk_reads(rng, number, length_mean, length_sd, min_length, max_length,
+                                               n_rate, adapter_rate, adapter)
+
+            # Duplicates are copies of earlier reads of this or the previous chunk:
+            for i in np.flatnonzero(rng.random(number) < duplication_rate).tolist():
+                if len(previous) + i == 0:
+                    continue
+                source = int(rng.integers(0, len(previous) + i))
+                if source < len(previous):
+                    sequences[i], qualities[i] = previous[source]
+                else:
+                    sequences[i], qualities[i] = sequences[source - len(previous)], qualities[source - len(previous)]
+            previous = list(zip(sequences, qualities))
+
+            lines = []
+            for i, (sequence, quality) in enumerate(zip(sequences, qualities)):
+                lines.append(b'@synthetic.%d length=%d\n%s\n+\n%s\n' % (chunk_start + i + 1, len(sequence),
+                                                                        sequence, quality))
+            data = b''.join(lines)
+            outf.write(data)
+            written += len(data)
+
+    return written
+
+
+app = typer.Typer()
+
+
+@app.command()
+def main(output: str = typer.Option(..., "--output", "-o", help="Path to the fastq file (.fastq or .fastq.gz)"),
+         reads: int = typer.Option(100000, min=1, help="Number of reads"),
+         length_mean: float = typer.Option(150, help="Mean read length"),
+         length_sd: float = typer.Option(0, min=0, help="Standard deviation of read lengths"),
+         min_length: int = typer.Option(20, min=1, help="Minimal read length"),
+         max_length: int = typer.Option(None, min=1, help="Maximal read length (twice the mean by default)"),
+         n_rate: float = typer.Option(0.001, min=0, max=1, help="Fraction of N bases"),
+         adapter_rate: float = typer.Option(0.05, min=0, max=1, help="Fraction of reads with adapter"),
+         duplication_rate: float = typer.Option(0.1, min=0, max=1, help="Fraction of duplicated reads"),
+         seed: int = typer.Option(0, help="Seed of the random generator")):
+    size = generate_fastq(output, reads, length_mean, length_sd, min_length, max_length, n_rate, adapter_rate,
+                          duplication_rate, seed=seed)
+    typer.echo('%s reads, %s bytes written to %s' % (reads, size, output))
+
+
+if __name__ == '__main__':
+    app()
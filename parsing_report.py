@@ -1,25 +1,40 @@
 import logging
 import datetime
+import glob
 import os
 import shutil
 import re
-import pandas as pd
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
 
 from pathlib import Path
 import typer
-import jinja2
 
 from Analysis_functions import fastqc
 from Analysis_functions import FastQC_functions
 from Analysis_functions import FastQC_G
 from Analysis_functions import FastQC_B
+from Analysis_functions import compression
+from Analysis_functions import export
+from Analysis_functions import fastq_parser
+from Analysis_functions import follow
+from Analysis_functions import kmer_content
+from Analysis_functions import paired
+from Analysis_functions import parallel
+from Analysis_functions import pipeline
+from Analysis_functions import profiling
+from Analysis_functions import rendering
+from Analysis_functions import result_cache
+from Analysis_functions import sampling
+from Analysis_functions import streaming
 
 
 app = typer.Typer()
 
 
-@jinja2.pass_context
-def format_datetime(context, value):
+def format_datetime(value):
     return value.strftime('%d/%m/%y  %H:%M:%S')
 
 
@@ -46,95 +61,429 @@ def prepare_outdir(outdir):
         shutil.copytree('./Report_templates/check_img/', outdir + 'check_img/')
 
 
-def prepair_data(input, outdir):
+# Context key, accumulator, function for checker (summary), function for plot (None if there is no plot), log message
+MODULES = [
+    ('sequence_length_distribution_result', fastqc.SequenceLengthAccumulator,
+     fastqc.summarize_sequence_length_distribution, fastqc.render_sequence_length_distribution,
+     'sequence length distribution result generated'),
+    ('overrepresented_sequences_result', fastqc.OverrepresentedAccumulator,
+     fastqc.summarize_overrepresented_sequences, None,
+     'overrepresented sequences result generated'),
+    ('adapter_content_result', fastqc.AdapterContentAccumulator,
+     fastqc.summarize_adapter_content, fastqc.render_adapter_content,
+     'adapter content result generated'),
+    ('per_base_seq_quality_result', FastQC_functions.QualityPerBaseAccumulator,
+     FastQC_functions.summarize_per_base_seq_quality, FastQC_functions.render_per_base_seq_quality,
+     'per base sequence quality result generated'),
+    ('per_seq_quality_scores_result', FastQC_functions.PerSequenceQualityAccumulator,
+     FastQC_functions.summarize_per_seq_quality_scores, FastQC_functions.render_per_seq_quality_scores,
+     'per sequence quality scores result generated'),
+    ('per_base_seq_content_result', FastQC_functions.NucleotidesPerBaseAccumulator,
+     FastQC_functions.summarize_per_base_seq_content, FastQC_functions.render_per_base_seq_content,
+     'per base sequence content result generated'),
+    ('gc_content_result', FastQC_G.GCContentAccumulator,
+     FastQC_G.summarize_gc_content, FastQC_G.render_gc_content,
+     'GC content result generated'),
+    ('N_content_result', FastQC_G.NContentAccumulator,
+     FastQC_G.summarize_N_content, FastQC_G.render_N_content,
+     'N content result generated'),
+    ('deduplicated_result', FastQC_G.DeduplicationAccumulator,
+     FastQC_G.summarize_deduplicated, FastQC_G.render_deduplicated,
+     'deduplicated generated'),
+    ('kmer_content_result', kmer_content.KmerContentAccumulator,
+     kmer_content.summarize_kmer_content, kmer_content.render_kmer_content,
+     'k-mer content generated'),
+]
+
+# Modules of both mates together, the read-through check has no plot
+PAIR_MODULES = [
+    ('pair_deduplicated_result', paired.PairDeduplicationAccumulator,
+     FastQC_G.summarize_deduplicated, FastQC_G.render_deduplicated,
+     'pair duplication generated'),
+    ('read_through_result', paired.ReadThroughAccumulator,
+     paired.summarize_read_through, None,
+     'adapter read-through generated'),
+]
+
+
+def estimated_intervals(accumulators, results):
     '''
-    Parsed file and create quality checks and plots.
-    Save plots to "outdir_DATE_TIME/".
-    Print log to console.
+    Text of 95% confidence intervals of the checked values,
+    if results are calculated for a random sample of reads.
     '''
-    parsed_file = FastQC_functions.read_file(input)
-    prepare_outdir(outdir)
-    logging.info('outdir generated')
+    modules = {accumulator.name: accumulator for accumulator in accumulators}
 
-    # 1
-    sequence_length_distribution_result = fastqc.sequence_length_distribution(parsed_file, outdir)
-    logging.info('sequence length distribution result generated')
-    # 2
-    overrepresented_sequences_result = fastqc.overrepresented_sequences(parsed_file, outdir)
-    logging.info('overrepresented sequences result generated')
-    # 3
-    adapter_content_result = fastqc.adapter_content(parsed_file, outdir)
-    logging.info('adapter content result generated')
-    # 4
-    per_base_seq_quality_result = FastQC_functions.plot_per_base_seq_quality(parsed_file, outdir)
-    logging.info('per base sequence quality result generated')
-    # 5
-    per_seq_quality_scores_result = FastQC_functions.plot_per_seq_quality_scores(parsed_file, outdir)
-    logging.info('per sequence quality scores result generated')
-    # 6
-    per_base_seq_content_result = FastQC_functions.plot_per_base_seq_content(parsed_file, outdir)
-    logging.info('per base sequence content result generated')
-    # 7
-    gc_content_result = FastQC_G.draw_gc_content(parsed_file, outdir)
-    logging.info('GC content result generated')
-    # 8
-    N_content_result = FastQC_G.draw_N_content(parsed_file, outdir)
-    logging.info('N content result generated')
-    # 9
-    deduplicated_result = FastQC_G.draw_deduplicated(parsed_file, outdir)
-    logging.info('deduplicated generated')
-
-    # Basic statistics
-    Encoding = FastQC_B.encoding_detector(parsed_file)
-    total_sequences = len(parsed_file)
-    sequence_length = FastQC_B.sequence_length(parsed_file)
-    mean_GC = FastQC_B.count_all_GC(parsed_file)
-    logging.info('basic statusctics generated')
+    low, high = FastQC_G.gc_deviation_interval(results['gc_content'])
+    deviation = FastQC_G.gc_deviation(results['gc_content'])[2]
+    N_low, N_high = FastQC_G.N_content_interval(modules['N_content'].N_counter, modules['N_content'].Read_counter)
+    duplicated_low, duplicated_high = FastQC_G.non_unique_interval(results['deduplicated'])
 
-    if os.path.exists(outdir+'or_seq.csv'):
-        overrepresented_sequences_table = pd.read_csv(outdir+'or_seq.csv',
-                                                      names=["Sequence", "Count", "Percentage"])
-        overrepresented_sequences_table = overrepresented_sequences_table.to_html(index=False,
-                                                                                  justify='center',
-                                                                                  classes='table_dupl')
-    else:
-        overrepresented_sequences_table = 'No overrepresented sequences'
+    gc_text = 'deviation from the normal distribution %.1f%% (95%% CI %.1f-%.1f%%), ' \
+              'warning above 15%%, failure above 30%%' % (deviation, low, high)
+    N_text = 'maximal N content %.2f%% (95%% CI %.2f-%.2f%%), warning above 5%%, failure above 20%%' \
+             % (np.max(results['N_content']['N_content']) * 100, N_low * 100, N_high * 100)
+    duplicated_text = 'non-unique sequences in the sample 95%% CI %.1f-%.1f%%, warning above 20%%, ' \
+                      'failure above 50%%; duplication of the whole file can be higher' \
+                      % (duplicated_low * 100, duplicated_high * 100)
+
+    return {'gc_content_result': gc_text, 'N_content_result': N_text, 'deduplicated_result': duplicated_text}
+
+
+def module_files(directory):
+    '''
+    Read files drawn by one module into dictionary {file name: bytes}.
+    '''
+    files = {}
+    for name in sorted(os.listdir(directory)):
+        with open(os.path.join(directory, name), 'rb') as inf:
+            files[name] = inf.read()
+    return files
+
+
+def write_files(files, outdir):
+    for name, data in files.items():
+        with open(outdir + name, 'wb') as outf:
+            outf.write(data)
+
+
+def summarize_modules(accumulators, results, outdir, cache=None, plot_processes=None,
+                      modules=MODULES, profiler=None, plots=True):
+    '''
+    Checks of all modules and drawing of their plots from the summaries.
+    modules are the descriptions of accumulators (MODULES or PAIR_MODULES).
+    profiler (profiling.Profiler) measures the summaries and plots phases.
+    cache is result_cache.ResultCache: plots of the same summaries are taken from it,
+    new plots are drawn into their own directories "outdir/.NAME/" and saved to it.
+    Without plots only the checks are calculated, nothing is drawn or written.
+    Return context {key: status} and summaries {accumulator name: summary}.
+    '''
+    context = {}
+    summaries = {}
+    drawings = []
+    drawn = []
+    for (key, accumulator, summarize, render, message), module in zip(modules, accumulators):
+        with profiling.phase(profiler, 'summaries'):
+            summary = summarize(results[module.name])
+        context[key] = summary['status']
+        summaries[module.name] = summary
+        logging.info(message)
+        if render is None or not plots:
+            continue
+
+        if cache is None:
+            os.makedirs(outdir, exist_ok=True)
+            drawings.append((render, summary, outdir))
+            continue
+        plot_key = cache.plot_key(module.name, summary, render)
+        entry = cache.get(plot_key)
+        if entry is not None:
+            write_files(entry['files'], outdir)
+            continue
+        module_outdir = outdir + '.' + module.name + '/'
+        os.makedirs(module_outdir, exist_ok=True)
+        drawings.append((render, summary, module_outdir))
+        drawn.append((plot_key, module_outdir))
+
+    if drawings:
+        with profiling.phase(profiler, 'plots'):
+            rendering.render_plots(drawings, plot_processes)
+        logging.info('plots generated')
+
+    for plot_key, module_outdir in drawn:
+        files = module_files(module_outdir)
+        write_files(files, outdir)
+        shutil.rmtree(module_outdir)
+        cache.put(plot_key, {'files': files})
+    return context, summaries
+
+
+def input_name(input, label=None):
+    '''
+    Name of the input in the report given by the user, 'stdin' for the standard input, None for other files.
+    '''
+    if label is None and str(input) == compression.STDIN:
+        return STDIN_NAME
+    return label
+
+
+def basic_context(input, outdir, basic_statistics, summaries, label=None):
+    '''
+    Basic statistics and the overrepresented sequences for the report.
+    label is the name of the input in the report (by default the file name).
+    '''
+    sequence_length = basic_statistics['sequence_length']
+    logging.info('basic statusctics generated')
 
     if sequence_length[0] == sequence_length[1]:
         seq_length = sequence_length[0]
     else:
         seq_length = str(sequence_length[0])+'-'+str(sequence_length[1])
 
-    input_file_short = re.search(r'\w*\.fastq$', str(input)).group(0)
+    input_file_short = input_name(input, label)
+    if input_file_short is None:
+        # Named pipes may have any name:
+        match = re.search(r'\w*\.fastq(\.gz)?$', str(input))
+        input_file_short = match.group(0) if match else os.path.basename(str(input))
 
     # context for html report
-    context = {'now': datetime.datetime.utcnow(),
-               'file': input_file_short,
-               'outdir': outdir,
-               'Encoding': Encoding,
-               'total_sequences': total_sequences,
-               'sequence_length': seq_length,
-               'GC': mean_GC,
-
-               'per_base_seq_quality_result': per_base_seq_quality_result,
-               'per_seq_quality_scores_result': per_seq_quality_scores_result,
-               'per_base_seq_content_result': per_base_seq_content_result,
-               'gc_content_result': gc_content_result,
-               'N_content_result': N_content_result,
-               'sequence_length_distribution_result': sequence_length_distribution_result,
-               'deduplicated_result': deduplicated_result,
-               'overrepresented_sequences_result': overrepresented_sequences_result,
-               'adapter_content_result': adapter_content_result,
-               'overrepresented_sequences_table': overrepresented_sequences_table}
+    return {'now': datetime.datetime.utcnow(),
+            'file': input_file_short,
+            'outdir': outdir,
+            'Encoding': basic_statistics['Encoding'],
+            'total_sequences': basic_statistics['total_sequences'],
+            'sequence_length': seq_length,
+            'GC': basic_statistics['GC'],
+            'overrepresented_sequences': summaries[fastqc.OverrepresentedAccumulator.name]['sequences'],
+            'enriched_kmers': summaries[kmer_content.KmerContentAccumulator.name]['kmers']}
+
+
+def export_results(input, outdir, summaries, basic_statistics, information=None, label=None):
+    '''
+    Save statuses, summaries and basic statistics to "outdir/results.json" and "outdir/results.npz".
+    '''
+    export.write_results(outdir, input_name(input, label) or os.path.basename(str(input)), summaries,
+                         basic_statistics, information)
+    logging.info('results saved to %s%s', outdir, export.RESULTS_FILE)
+
+
+def profile_parsing(profiler, accumulators, serial):
+    '''
+    Reads of the pass and the parsing phase: the time of the pass without the time of modules.
+    In parallel runs module times are summed over processes, so parsing is not separated.
+    '''
+    reads = max(accumulator.stats['reads'] for accumulator in accumulators)
+    profiler.phases['pass']['reads'] = reads
+    if serial:
+        parse = profiling.new_stats()
+        parse['wall_time'] = profiler.phases['pass']['wall_time'] - sum(accumulator.stats['wall_time']
+                                                                        for accumulator in accumulators)
+        parse['cpu_time'] = profiler.phases['pass']['cpu_time'] - sum(accumulator.stats['cpu_time']
+                                                                      for accumulator in accumulators)
+        parse['peak_memory_delta_mb'] = profiler.phases['pass']['peak_memory_delta_mb'] - sum(
+            accumulator.stats['peak_memory_delta_mb'] for accumulator in accumulators)
+        parse['reads'], parse['calls'] = reads, 1
+        profiler.phases['parse'] = parse
+
+
+def prepair_data(input, outdir, processes=1, parameters=None, plot_processes=None, sample=None, cache=None,
+                 profiler=None, plots=True, pipeline=None, label=None):
+    '''
+    Parsed file and create quality checks and plots.
+    All modules are calculated in a single pass over the file,
+    split between several processes if processes > 1.
+    Every module result is reduced to a small summary, and plots are drawn
+    from the summaries in a pool of processes.
+    parameters is dictionary {accumulator name: dictionary of its arguments}.
+    plot_processes is the size of the pool for plots (by default one process per plot).
+    sample is dictionary {'size': number of reads} or {'fraction': fraction of reads}:
+    only a random sample of reads is analysed, statuses are marked as estimated.
+    cache is result_cache.ResultCache: results of modules are taken from it
+    if the file was analysed with the same parameters, new ones are saved to it.
+    The checks are calculated from the results on every run,
+    plots are taken from the cache if their summaries have not changed.
+    profiler is profiling.Profiler: modules and phases of the analysis are measured.
+    pipeline is pipeline.Pipeline: reading, parsing and analysis of the file in one process
+    overlap in threads connected by bounded queues.
+    input can be '-' (the standard input) or a named pipe: it is read once, without the cache.
+    label is the name of the input in the report and results.json.
+    Without plots only the checks, basic statistics and results.json are created.
+    Save plots to "outdir_DATE_TIME/".
+    Print log to console.
+    '''
+    prepare_outdir(outdir)
+    logging.info('outdir generated')
+
+    parameters = parameters or {}
+    accumulators = [accumulator(**parameters.get(accumulator.name, {})) for _, accumulator, _, _, _ in MODULES]
+    basic_statistics = FastQC_B.BasicStatisticsAccumulator()
+    if profiler is not None:
+        accumulators = [profiler.wrap(accumulator) for accumulator in accumulators]
+        basic_statistics = profiler.wrap(basic_statistics)
+    all_accumulators = accumulators + [basic_statistics]
+
+    # Results of a random sample are not cached, a stream has no fingerprint:
+    if sample or compression.is_stream(input):
+        cache = None
+
+    cached = {}
+    if cache is not None:
+        fingerprint = result_cache.file_fingerprint(input)
+        keys = {module.name: cache.key(fingerprint, module.name, parameters.get(module.name))
+                for module in all_accumulators}
+        for name, key in keys.items():
+            entry = cache.get(key)
+            if entry is not None:
+                cached[name] = entry['result']
+        logging.info('%s of %s modules found in cache', len(cached), len(all_accumulators))
+
+    missing = [module for module in all_accumulators if module.name not in cached]
+    results = {}
+    records = None
+    if sample:
+        with profiling.phase(profiler, 'sample'):
+            records, total_number = sampling.sample_records(input, sample.get('size'), sample.get('fraction'),
+                                                            threads=processes)
+        if records is None:
+            logging.info('the sample is a large part of the file, the whole file is analysed')
+
+    if records is not None:
+        with profiling.phase(profiler, 'pass', len(records)):
+            results = streaming.run_accumulators(streaming.iter_batches(records), missing)
+        logging.info('%s reads sampled of about %s', len(records), total_number)
+    elif missing:
+        with profiling.phase(profiler, 'pass'):
+            results = parallel.run_accumulators_parallel(input, missing, processes, pipeline)
+        logging.info('file parsed')
+
+    if profiler is not None and 'pass' in profiler.phases:
+        profile_parsing(profiler, missing, records is not None or parallel.is_serial(input, processes))
+
+    if cache is not None:
+        for module in missing:
+            cache.put(keys[module.name], {'result': results[module.name]})
+        results |= cached
+
+    context, summaries = summarize_modules(accumulators, results, outdir, cache, plot_processes,
+                                           profiler=profiler, plots=plots)
+
+    if records is None:
+        sample_note, intervals = '', {}
+    else:
+        sample_note = 'Estimated from a random sample of %s of about %s reads' % (len(records), total_number)
+        intervals = estimated_intervals(accumulators, results)
+
+    context |= basic_context(input, outdir, results[basic_statistics.name], summaries, label)
+    context |= {'estimated': records is not None,
+                'sample_note': sample_note,
+                'intervals': intervals}
+    export_results(input, outdir, summaries, results[basic_statistics.name],
+                   {'estimated': records is not None, 'sample_note': sample_note, 'intervals': intervals}, label)
+
+    return context
+
+
+def prepair_paired_data(input, input2, outdir, processes=1, parameters=None, plot_processes=None, plots=True):
+    '''
+    Parse paired files and create quality checks and plots of both mates and of pairs.
+    Both files are read at the same time in one pass, the names of the mates are checked.
+    Plots of the mates are saved to "outdir/R1/" and "outdir/R2/", plots of pairs to "outdir/pair/".
+    processes is the number of threads for BGZF decompression of every file.
+    Return context for the paired report.
+    '''
+    prepare_outdir(outdir)
+    logging.info('outdir generated')
+
+    parameters = parameters or {}
+    mate_accumulators = [[accumulator(**parameters.get(accumulator.name, {})) for _, accumulator, _, _, _ in MODULES]
+                         for _ in range(2)]
+    basic_statistics = [FastQC_B.BasicStatisticsAccumulator() for _ in range(2)]
+    # Pair modules use the arguments of the corresponding modules of single reads:
+    pair_parameters = {'pair_deduplicated': parameters.get('deduplicated', {}),
+                       'read_through': parameters.get('adapter_content', {})}
+    pair_accumulators = [accumulator(**pair_parameters[accumulator.name]) for _, accumulator, _, _, _ in PAIR_MODULES]
+
+    first_results, second_results, pair_results = paired.run_paired(
+        input, input2, mate_accumulators[0] + [basic_statistics[0]], mate_accumulators[1] + [basic_statistics[1]],
+        pair_accumulators, processes)
+    logging.info('files parsed')
+
+    mates = []
+    for mate, path, accumulators, results in zip(('R1', 'R2'), (input, input2), mate_accumulators,
+                                                 (first_results, second_results)):
+        mate_outdir = outdir + mate + '/'
+        context, summaries = summarize_modules(accumulators, results, mate_outdir, plot_processes=plot_processes,
+                                               plots=plots)
+        context |= basic_context(path, mate_outdir, results[FastQC_B.BasicStatisticsAccumulator.name], summaries)
+        export_results(path, mate_outdir, summaries, results[FastQC_B.BasicStatisticsAccumulator.name])
+        context |= {'mate': mate}
+        mates.append(context)
+
+    context, summaries = summarize_modules(pair_accumulators, pair_results, outdir + 'pair/',
+                                           plot_processes=plot_processes, modules=PAIR_MODULES, plots=plots)
+    export.write_results(outdir + 'pair/', [os.path.basename(str(path)) for path in (input, input2)], summaries, {})
+    context |= {'read_through': summaries['read_through'],
+                'now': datetime.datetime.utcnow(),
+                'outdir': outdir,
+                'mates': mates}
 
     return context
 
 
+def follow_report(input, outdir, accumulators, basic_statistics, template, plot_processes=None):
+    '''
+    Report of the records read so far in the follow mode.
+    '''
+    results = {module.name: module.finalize() for module in accumulators + [basic_statistics]}
+
+    context, summaries = summarize_modules(accumulators, results, outdir, plot_processes=plot_processes)
+    context |= basic_context(input, outdir, results[basic_statistics.name], summaries)
+    context |= {'estimated': False, 'sample_note': '', 'intervals': {}}
+    export_results(input, outdir, summaries, results[basic_statistics.name])
+    render_report(context, template, outdir)
+
+
+def follow_file(input, outdir, template, parameters=None, interval=60, idle_timeout=None, plot_processes=None):
+    '''
+    Create report of a fastq file which is still being written.
+    Accumulators are kept in memory and get only the records appended to the file,
+    the report and plots are redrawn every interval seconds if there are new records.
+    It stops after idle_timeout seconds without new records or by Ctrl+C,
+    then the last record is read even without the final newline and the final report is created.
+    '''
+    prepare_outdir(outdir)
+    parameters = parameters or {}
+    accumulators = [accumulator(**parameters.get(accumulator.name, {})) for _, accumulator, _, _, _ in MODULES]
+    basic_statistics = FastQC_B.BasicStatisticsAccumulator()
+    follower = follow.FileFollower(input)
+    last_data = time.monotonic()
+
+    def feed(batches):
+        number = 0
+        for batch in batches:
+            for module in accumulators + [basic_statistics]:
+                module.update_batch(batch)
+            number += len(batch)
+        return number
+
+    while True:
+        try:
+            started = time.monotonic()
+            number = feed(follower.read_batches())
+            if number:
+                last_data = time.monotonic()
+                logging.info('%s new reads, %s reads in total', number, basic_statistics.lengths.total())
+                follow_report(input, outdir, accumulators, basic_statistics, template, plot_processes)
+                logging.info('report updated in %.1f s', time.monotonic() - started)
+            elif idle_timeout is not None and time.monotonic() - last_data >= idle_timeout:
+                logging.info('no new reads for %s s', idle_timeout)
+                break
+            time.sleep(max(interval - (time.monotonic() - started), 0))
+        except KeyboardInterrupt:
+            break
+
+    number = feed(follower.read_batches(final=True))
+    if basic_statistics.lengths.total() == 0:
+        raise Exception('No reads in the file: ' + str(input))
+    if number or not os.path.exists(outdir + 'Report.html'):
+        follow_report(input, outdir, accumulators, basic_statistics, template, plot_processes)
+    logging.info('final report: %s reads', basic_statistics.lengths.total())
+
+
+def echo_statuses(context, modules=MODULES, prefix=''):
+    '''
+    Print the statuses of modules, a line "NAME<tab>status" for every module.
+    '''
+    for key, accumulator, _, _, _ in modules:
+        typer.echo(prefix + accumulator.name + '\t' + context[key])
+
+
 def render_report(context, template, outdir):
     '''
     Create html report.
     Save it to "outdit/Report.html".
     '''
+    import jinja2
+
     environment = jinja2.Environment(loader=jinja2.FileSystemLoader('./'),
                                      autoescape=False,
                                      undefined=jinja2.StrictUndefined,
@@ -165,39 +514,380 @@ def check_outdir(outdir, now_time):
     return outdir
 
 
+def find_inputs(input):
+    '''
+    Return sorted list of fastq files from a directory, a fastq file,
+    a text file with paths (one per line, relative to the file) or a glob pattern.
+    '''
+    if os.path.isdir(input):
+        files = [path for pattern in FASTQ_PATTERNS for path in glob.glob(os.path.join(input, pattern))]
+    elif os.path.isfile(input) and re.search(FASTQ_SUFFIX, input):
+        files = [input]
+    elif os.path.isfile(input):
+        base = os.path.dirname(os.path.abspath(input))
+        with open(input) as inf:
+            files = [os.path.join(base, line.strip()) for line in inf
+                     if line.strip() and not line.startswith('#')]
+    else:
+        files = glob.glob(input, recursive=True)
+
+    if len(files) == 0:
+        raise Exception('No fastq files found: ' + input)
+
+    return sorted(set(os.path.abspath(path) for path in files))
+
+
+def sample_names(files):
+    '''
+    Names of samples (file names without extension), used for their output directories.
+    Repeated names get a number.
+    '''
+    names = []
+    for path in files:
+        name = re.sub(FASTQ_SUFFIX, '', os.path.basename(path))
+        unique_name, number = name, 1
+        while unique_name in names:
+            number += 1
+            unique_name = name + '_' + str(number)
+        names.append(unique_name)
+    return names
+
+
+def analyse_sample(input, outdir, parameters, template, cache=None, plots=True):
+    '''
+    Create the report of one sample of the batch, return its row of the summary.
+    It runs in a worker process, so the sample is analysed and drawn in this process.
+    Without plots only results.json of the sample is created.
+    '''
+    context = prepair_data(input, outdir, processes=1, parameters=parameters, plot_processes=1, cache=cache,
+                           plots=plots)
+    if plots:
+        render_report(context, template, outdir)
+    return {key: context[key] for key in SUMMARY_KEYS}
+
+
+def run_batch(files, outdir, processes, parameters, template, cache=None, plots=True):
+    '''
+    Create reports of many fastq files in "outdir/SAMPLE/",
+    files are analysed by a pool of processes at the same time.
+    Return context for the summary report.
+    A sample which fails is shown in the summary with the error.
+    '''
+    prepare_outdir(outdir)
+    names = sample_names(files)
+    samples = []
+
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        futures = [executor.submit(analyse_sample, path, outdir + name + '/', parameters, template, cache, plots)
+                   for path, name in zip(files, names)]
+
+        for path, name, future in zip(files, names, futures):
+            try:
+                sample = future.result()
+                sample['error'] = None
+            except Exception as error:
+                logging.error('%s: %s', path, error)
+                sample = {'error': str(error)}
+            sample |= {'name': name, 'path': path,
+                       'report': name + ('/Report.html' if plots else '/' + export.RESULTS_FILE)}
+            samples.append(sample)
+            logging.info('%s of %s samples done: %s', len(samples), len(files), name)
+
+    return {'now': datetime.datetime.utcnow(),
+            'outdir': outdir,
+            'samples': samples}
+
+
+def open_cache(no_cache, cache_dir, cache_size):
+    '''
+    Result cache from command line options, None if it is disabled.
+    '''
+    if no_cache:
+        return None
+    return result_cache.ResultCache(cache_dir, cache_size << 20)
+
+
+def module_parameters(adapters, exact_duplication, kmer_size=None):
+    '''
+    Arguments of module accumulators from command line options.
+    '''
+    parameters = {}
+    if adapters is not None:
+        parameters['adapter_content'] = {'adapters': fastqc.read_adapters(adapters)}
+    if exact_duplication:
+        parameters['deduplicated'] = {'exact': True}
+    if kmer_size is not None:
+        parameters['kmer_content'] = {'k': kmer_size}
+    return parameters
+
+
 now_time = directory_datetime()
 DEFAULT_TEMPLATE = './Report_templates/report.html.j2'
+DEFAULT_PAIRED_TEMPLATE = './Report_templates/paired_report.html.j2'
+DEFAULT_SUMMARY_TEMPLATE = './Report_templates/summary.html.j2'
 DEFAULT_OUTPUT_DIR = 'Report_data'
+FASTQ_PATTERNS = ('*.fastq', '*.fastq.gz')
+FASTQ_SUFFIX = r'\.fastq(\.gz)?$'
+# Name of the standard input in the report
+STDIN_NAME = 'stdin'
+# Values of the sample report shown in the batch summary
+SUMMARY_KEYS = [module[0] for module in MODULES] + ['file', 'Encoding', 'total_sequences', 'sequence_length', 'GC']
+# Options of the application itself, not of the 'generate' command
+APP_OPTIONS = ('--help', '--install-completion', '--show-completion')
 
 
 @app.command()
 def generate(input: Path = typer.Option(...,
                                         "--input", "-i",
-                                        help="Path to input file from Vagus repository",
+                                        help="Path to input file from Vagus repository, "
+                                             "a named pipe or '-' for the standard input",
                                         exists=True,
                                         file_okay=True,
                                         dir_okay=False,
                                         writable=False,
                                         readable=True,
-                                        resolve_path=True),
+                                        resolve_path=True,
+                                        allow_dash=True),
+             label: str = typer.Option(None,
+                                       "--name",
+                                       help="Name of the input in the report (by default the file name, "
+                                            "'stdin' for the standard input)"),
+             input2: Path = typer.Option(None,
+                                         "--input2",
+                                         help="Path to the second file of paired reads (R2), "
+                                              "both mates are analysed in one paired report",
+                                         exists=True,
+                                         dir_okay=False,
+                                         resolve_path=True),
              outdir: str = typer.Option(DEFAULT_OUTPUT_DIR,
                                         "--outdir", "-o",
                                         help="Path to analysis output directory from Vagus repository"),
+             processes: int = typer.Option(1,
+                                           "--threads", "--processes", "-t",
+                                           min=1,
+                                           help="Number of processes for the analysis"),
+             batch_size: int = typer.Option(fastq_parser.BLOCK_SIZE >> 20,
+                                            "--batch-size",
+                                            min=1,
+                                            help="Size of the blocks of the file read and parsed at once (Mb)"),
+             queue_depth: int = typer.Option(pipeline.DEFAULT_QUEUE_DEPTH,
+                                             "--queue-depth",
+                                             min=0,
+                                             help="Number of blocks waiting in every queue between the reader, "
+                                                  "parser and analyzer threads (0 runs them in sequence)"),
+             analyzers: int = typer.Option(pipeline.DEFAULT_ANALYZERS,
+                                           "--analyzers",
+                                           min=1,
+                                           help="Number of analyzer threads, modules are split between them"),
+             adapters: Path = typer.Option(None,
+                                           "--adapters",
+                                           help="File with adapters (name and sequence separated by tab)",
+                                           exists=True,
+                                           dir_okay=False),
+             exact_duplication: bool = typer.Option(False,
+                                                    "--exact-duplication",
+                                                    help="Count every distinct sequence for duplication levels "
+                                                         "(memory grows with the number of distinct reads)"),
+             kmer_size: int = typer.Option(None,
+                                           "--kmer-size",
+                                           min=1,
+                                           max=kmer_content.MAX_K,
+                                           help="Length of k-mers of the k-mer content module "
+                                                "(%s by default)" % kmer_content.DEFAULT_K),
+             sample_size: int = typer.Option(None,
+                                             "--sample",
+                                             min=1,
+                                             help="Analyse only a random sample of N reads (fast estimated report)"),
+             sample_fraction: float = typer.Option(None,
+                                                   "--sample-fraction",
+                                                   min=0,
+                                                   max=1,
+                                                   help="Analyse only a random sample of this fraction of reads"),
+             no_cache: bool = typer.Option(False,
+                                           "--no-cache",
+                                           help="Do not use the cache of results, analyse the file again"),
+             cache_dir: str = typer.Option(result_cache.DEFAULT_CACHE_DIR,
+                                           "--cache-dir",
+                                           help="Directory of the cache of results"),
+             cache_size: int = typer.Option(result_cache.DEFAULT_CACHE_SIZE >> 20,
+                                            "--cache-size",
+                                            min=0,
+                                            help="Maximal size of the cache (Mb), old results are deleted"),
+             follow_file_mode: bool = typer.Option(False,
+                                                   "--follow",
+                                                   help="Follow a file which is still being written: "
+                                                        "read appended reads and update the report"),
+             interval: float = typer.Option(60,
+                                            "--interval",
+                                            min=0,
+                                            help="Seconds between report updates in the follow mode"),
+             follow_timeout: float = typer.Option(None,
+                                                  "--follow-timeout",
+                                                  min=0,
+                                                  help="Stop the follow mode after this number of seconds "
+                                                       "without new reads (by default only by Ctrl+C)"),
+             profile: bool = typer.Option(False,
+                                          "--profile",
+                                          help="Measure time and memory of every module and phase: "
+                                               "profile.json and a table in the report"),
+             profile_module: str = typer.Option(None,
+                                                "--profile-module",
+                                                help="Also profile one module (for example adapter_content) "
+                                                     "with cProfile, in one process"),
+             no_plots: bool = typer.Option(False,
+                                           "--no-plots",
+                                           help="Only checks and statistics: statuses are printed and saved "
+                                                "to results.json, without plots and the html report"),
              template: str = DEFAULT_TEMPLATE,
+             paired_template: str = DEFAULT_PAIRED_TEMPLATE,
              log_level: str = 'info'):
 
     logging.basicConfig(level=getattr(logging, log_level.upper()))
 
     outdir = check_outdir(outdir, now_time)
-    context = prepair_data(input, outdir)
+    parameters = module_parameters(adapters, exact_duplication, kmer_size)
+
+    stream = compression.is_stream(input)
+    if stream and (follow_file_mode or sample_size is not None or sample_fraction is not None):
+        raise Exception('The standard input and named pipes are read once, without --follow or --sample')
+
+    if input2 is not None:
+        if follow_file_mode or sample_size is not None or sample_fraction is not None:
+            raise Exception('--input2 can not be used with --follow or --sample')
+        if label is not None:
+            raise Exception('--name can not be used with --input2')
+        context = prepair_paired_data(input, input2, outdir, processes, parameters, plots=not no_plots)
+        if no_plots:
+            for mate in context['mates']:
+                echo_statuses(mate, prefix=mate['mate'] + '\t')
+            echo_statuses(context, PAIR_MODULES, 'pair\t')
+            logging.info('results saved in %s', outdir)
+            return
+        logging.info('report template: %s', paired_template)
+        render_report(context, paired_template, outdir)
+        logging.info('paired report created in %s', outdir)
+        return
+
+    if sample_size is not None and sample_fraction is not None:
+        raise Exception('Use either --sample or --sample-fraction')
+    sample = None
+    if sample_size is not None:
+        sample = {'size': sample_size}
+    elif sample_fraction is not None:
+        sample = {'fraction': sample_fraction}
+
+    if follow_file_mode:
+        if sample is not None or no_plots:
+            raise Exception('--sample and --no-plots can not be used with --follow')
+        logging.info('follow %s, report is updated every %s s', input, interval)
+        follow_file(input, outdir, template, parameters, interval, follow_timeout)
+        logging.info('report created in %s', outdir)
+        return
+
+    profiler = None
+    if profile or profile_module:
+        profiler = profiling.Profiler(profile_module)
+        names = [accumulator.name for _, accumulator, _, _, _ in MODULES] + [FastQC_B.BasicStatisticsAccumulator.name]
+        if profile_module is not None and profile_module not in names:
+            raise Exception('Unknown module %s, modules: %s' % (profile_module, ', '.join(names)))
+        if profile_module is not None and processes > 1:
+            logging.warning('the module is profiled with cProfile in one process')
+            processes = 1
+        # Results from the cache would not be measured:
+        no_cache = True
+
+    # Stages can not overlap on one CPU, and the profiler measures modules one after another:
+    stages = None
+    if queue_depth > 0 and profiler is None and (os.cpu_count() or 1) > 1:
+        stages = pipeline.Pipeline(batch_size << 20, queue_depth, analyzers)
+
+    cache = open_cache(no_cache, cache_dir, cache_size)
+    context = prepair_data(input, outdir, processes, parameters, sample=sample, cache=cache, profiler=profiler,
+                           plots=not no_plots, pipeline=stages, label=label)
+
+    if no_plots:
+        echo_statuses(context)
+        logging.info('results saved in %s', outdir)
+    else:
+        logging.info('report template: %s', template)
+        logging.info('generate report')
+        if profiler is not None:
+            context['profile'] = profiler.table()
+        with profiling.phase(profiler, 'report'):
+            render_report(context, template, outdir)
+        logging.info('report created in %s', outdir)
 
-    logging.info('report template: %s', template)
-    logging.info('generate report')
-    render_report(context, template, outdir)
-    logging.info('report created in %s', outdir)
+    if profiler is not None:
+        profiler.write(outdir, {'input': str(input), 'processes': processes, 'sample': sample})
+        for row in profiler.table():
+            logging.info('%-8s %-30s wall %8s s, CPU %8s s, memory %6s Mb, reads %s, reads/s %s', *row)
+        logging.info('profile written to %sprofile.json', outdir)
+
+
+@app.command()
+def batch(input: str = typer.Option(...,
+                                    "--input", "-i",
+                                    help="Directory with fastq files, file with the list of fastq files "
+                                         "or glob pattern (in quotes)"),
+          outdir: str = typer.Option(DEFAULT_OUTPUT_DIR,
+                                     "--outdir", "-o",
+                                     help="Path to analysis output directory from Vagus repository"),
+          processes: int = typer.Option(1,
+                                        "--threads", "--processes", "-t",
+                                        min=1,
+                                        help="Number of files analysed at the same time"),
+          adapters: Path = typer.Option(None,
+                                        "--adapters",
+                                        help="File with adapters (name and sequence separated by tab)",
+                                        exists=True,
+                                        dir_okay=False),
+          exact_duplication: bool = typer.Option(False,
+                                                 "--exact-duplication",
+                                                 help="Count every distinct sequence for duplication levels "
+                                                      "(memory grows with the number of distinct reads)"),
+          kmer_size: int = typer.Option(None,
+                                        "--kmer-size",
+                                        min=1,
+                                        max=kmer_content.MAX_K,
+                                        help="Length of k-mers of the k-mer content module "
+                                             "(%s by default)" % kmer_content.DEFAULT_K),
+          no_cache: bool = typer.Option(False,
+                                        "--no-cache",
+                                        help="Do not use the cache of results, analyse the file again"),
+          cache_dir: str = typer.Option(result_cache.DEFAULT_CACHE_DIR,
+                                        "--cache-dir",
+                                        help="Directory of the cache of results"),
+          cache_size: int = typer.Option(result_cache.DEFAULT_CACHE_SIZE >> 20,
+                                         "--cache-size",
+                                         min=0,
+                                         help="Maximal size of the cache (Mb), old results are deleted"),
+          no_plots: bool = typer.Option(False,
+                                        "--no-plots",
+                                        help="Only checks and statistics of every sample (results.json), "
+                                             "without plots and sample reports"),
+          template: str = DEFAULT_TEMPLATE,
+          summary_template: str = DEFAULT_SUMMARY_TEMPLATE,
+          log_level: str = 'info'):
+
+    logging.basicConfig(level=getattr(logging, log_level.upper()))
+
+    outdir = check_outdir(outdir, now_time)
+    parameters = module_parameters(adapters, exact_duplication, kmer_size)
+    files = find_inputs(input)
+    logging.info('%s fastq files found', len(files))
+
+    cache = open_cache(no_cache, cache_dir, cache_size)
+    context = run_batch(files, outdir, processes, parameters, template, cache, plots=not no_plots)
+
+    logging.info('summary template: %s', summary_template)
+    render_report(context, summary_template, outdir)
+    logging.info('reports created in %s', outdir)
 
 
 def main():
+    # 'generate' is the default command, so 'parsing_report.py -i file.fastq' works as before
+    if len(sys.argv) > 1 and sys.argv[1].startswith('-') and sys.argv[1] not in APP_OPTIONS:
+        sys.argv.insert(1, 'generate')
     app()
 
 